@@ -13,6 +13,7 @@
 
 import logging
 import html
+import json
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     CommandHandler,
@@ -40,6 +41,11 @@ EDIT_REG_SELECT_BOT, EDIT_REG_INPUT_LINK = 20, 21
 BOT_TYPE_GUIDE = 'private'  # 私聊引导注册类型
 BOT_TYPE_CHANNEL = 'channel'  # 频道带单类型
 
+# 键集分页：/listbots 每页条数（控制消息长度）、按钮选择器每页条数，以及 /listbots 需要的列
+LIST_PAGE_SIZE = 8
+PICKER_PAGE_SIZE = 25
+LIST_COLUMNS = ("id", "agent_name", "bot_token", "registration_link", "video_url", "image_url")
+
 
 # --- 权限检查 ---
 def is_admin(update: Update) -> bool:
@@ -66,6 +72,9 @@ async def start_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "🔹 **/catuser** - 查看自己创建的引导机器人引流人数（数据隔离）\n"
         "🔹 **/editplay** - 修改频道带单机器人的游戏链接（play_url）\n"
         "🔹 **/editreg** - 修改引导注册机器人的注册链接\n"
+        "🔹 **/pauseall** - 停用自己创建的全部机器人（可加 private / channel）\n"
+        "🔹 **/resumeall** - 重新启用自己创建的全部机器人（可加 private / channel）\n"
+        "🔹 **/dbstats** - 查看数据库连接池、缓存与各函数耗时统计\n"
         "🔹 **/cancel** - 取消当前操作"
     )
     await update.message.reply_text(help_text, parse_mode='HTML')
@@ -82,14 +91,14 @@ async def claimbot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 带 token：直接认领
     if len(parts) >= 2:
         token = parts[1].strip()
-        ok = database.claim_bot_owner(token, update.effective_user.id)
+        ok = await database.aio.claim_bot_owner(token, update.effective_user.id)
         if ok:
             await update.message.reply_text("✅ 认领成功。")
         else:
             await update.message.reply_text("❌ 认领失败：可能该机器人已被认领或不存在。")
         return
     # 无参：列出所有未归属机器人，提供按钮一键认领
-    unowned = database.get_unclaimed_bots()
+    unowned = await database.aio.get_unclaimed_bots()
     if not unowned:
         await update.message.reply_text("当前没有未归属的历史机器人。")
         return
@@ -112,9 +121,9 @@ async def claimbot_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 优先尝试按 id 认领；若失败则按 token 认领
     try:
         bot_id = int(ref)
-        ok = database.claim_bot_owner_by_id(bot_id, update.effective_user.id)
+        ok = await database.aio.claim_bot_owner_by_id(bot_id, update.effective_user.id)
     except ValueError:
-        ok = database.claim_bot_owner(ref, update.effective_user.id)
+        ok = await database.aio.claim_bot_owner(ref, update.effective_user.id)
     if ok:
         await query.edit_message_text("✅ 认领成功。")
     else:
@@ -124,37 +133,41 @@ async def claimbot_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # 删除 claimall 功能
 
 
-async def list_bots(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """分页列出当前管理员创建的所有机器人（区分在线/离线）。"""
-    if not is_admin(update): return
-    # 仅显示本人创建的机器人
-    operator_id = update.effective_user.id
-    all_bots = database.get_bots_by_creator(operator_id)
-    if not all_bots:
-        await update.message.reply_text("数据库中还没有任何机器人。")
-        return
+def _next_page_button(prefix: str, next_after: int | None, page: int):
+    """键集分页的“下一页”按钮行：回调携带本页最后一个 id 与下一页页码。"""
+    if next_after is None:
+        return []
+    return [[InlineKeyboardButton("下一页 ➡️", callback_data=f"{prefix}{next_after}_{page + 1}")]]
+
+
+def _parse_page_callback(data: str) -> tuple[int, int]:
+    """解析 `<prefix>_<after_id>_<page>` 形式的分页回调。"""
+    after_id, page = data.rsplit('_', 2)[-2:]
+    return int(after_id), int(page)
+
+
+async def _render_bot_list_page(context: ContextTypes.DEFAULT_TYPE, operator_id: int, after_id: int, page: int):
+    """渲染 /listbots 的一页，返回 (文本, 键盘)；首页为空时返回 (None, None)。"""
+    bots, next_after = await database.aio.get_bots_page(
+        after_id, LIST_PAGE_SIZE, created_by=operator_id, columns=LIST_COLUMNS
+    )
+    if not bots:
+        return None, None
 
     manager = context.application.bot_data['manager']
     running_tokens = manager.running_bots.keys()
 
-    # 分页：按消息长度切分，避免超过 Telegram 的 4096 限制
-    header = "<b>机器人列表:</b>\n\n"
-    max_chars = 3500  # 保留余量
-    current_chunks = [header]
-    current_len = len(header)
-    pages: list[str] = []
-
-    for bot in all_bots:
+    parts = ["<b>机器人列表:</b>\n\n"]
+    for bot in bots:
         run_status = "✅ 在线" if bot['bot_token'] in running_tokens else "❌ 离线"
 
         agent_name = html.escape(bot['agent_name'])
         reg_link = html.escape(bot['registration_link'])
-        channel_link = html.escape(bot.get('channel_link') or '未配置')
         video_url = html.escape(bot['video_url'] or '未配置')
         image_url = html.escape(bot['image_url'] or '未配置')
         bot_token = html.escape(bot['bot_token'])
 
-        part = (
+        parts.append(
             f"<b>代理:</b> {agent_name}\n"
             f"<b>状态:</b> {run_status}\n"
             f"<b>注册链接:</b> {reg_link}\n"
@@ -163,22 +176,35 @@ async def list_bots(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"<b>Token:</b> <code>{bot_token}</code>\n"
             f"--------------------\n"
         )
+    if page > 1 or next_after is not None:
+        parts.append(f"\n第 {page} 页")
+    keyboard = _next_page_button("listbots_page_", next_after, page)
+    return "".join(parts), (InlineKeyboardMarkup(keyboard) if keyboard else None)
 
-        if current_len + len(part) > max_chars:
-            pages.append("".join(current_chunks))
-            current_chunks = [header, part]
-            current_len = len(header) + len(part)
-        else:
-            current_chunks.append(part)
-            current_len += len(part)
 
-    if current_chunks:
-        pages.append("".join(current_chunks))
+async def list_bots(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """分页列出当前管理员创建的所有机器人（区分在线/离线），每次只查询一页。"""
+    if not is_admin(update): return
+    # 仅显示本人创建的机器人
+    text, markup = await _render_bot_list_page(context, update.effective_user.id, 0, 1)
+    if text is None:
+        await update.message.reply_text("数据库中还没有任何机器人。")
+        return
+    await update.message.reply_text(text, parse_mode='HTML', reply_markup=markup)
 
-    # 逐页发送
-    for idx, content in enumerate(pages, start=1):
-        suffix = f"\n第 {idx}/{len(pages)} 页" if len(pages) > 1 else ""
-        await update.message.reply_text(content + suffix, parse_mode='HTML')
+
+async def list_bots_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/listbots 的“下一页”回调：在原消息上展示下一页。"""
+    if not is_admin(update):
+        return
+    query = update.callback_query
+    await query.answer()
+    after_id, page = _parse_page_callback(query.data)
+    text, markup = await _render_bot_list_page(context, update.effective_user.id, after_id, page)
+    if text is None:
+        await query.edit_message_text("没有更多机器人了。")
+        return
+    await query.edit_message_text(text, parse_mode='HTML', reply_markup=markup)
 
 
 # --- 修改频道机器人 play_url ---
@@ -187,7 +213,7 @@ async def edit_play_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update):
         return ConversationHandler.END
     operator_id = update.effective_user.id
-    bots = database.get_bots_by_creator(operator_id, role=BOT_TYPE_CHANNEL)
+    bots = await database.aio.get_bots_by_creator(operator_id, role=BOT_TYPE_CHANNEL)
     if not bots:
         await update.message.reply_text("你还没有创建任何频道带单机器人。")
         return ConversationHandler.END
@@ -207,7 +233,7 @@ async def edit_play_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     token = query.data.split("_", 2)[-1]
-    bot = database.get_bot_by_token(token)
+    bot = await database.aio.get_bot_by_token(token)
     if not bot or (bot.get('created_by') not in (None, update.effective_user.id)):
         await query.edit_message_text("错误：无权限或机器人不存在。")
         return ConversationHandler.END
@@ -229,7 +255,7 @@ async def edit_play_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not new_url:
         await update.message.reply_text("请输入有效的链接。")
         return EDIT_INPUT_PLAY_URL
-    ok = database.update_play_url(token, new_url)
+    ok = await database.aio.update_play_url(token, new_url)
     # 热更新运行中的频道机器人配置
     try:
         supervisor = context.application.bot_data.get('channel_supervisor')
@@ -254,7 +280,7 @@ async def edit_reg_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update):
         return ConversationHandler.END
     operator_id = update.effective_user.id
-    bots = database.get_bots_by_creator(operator_id, role=BOT_TYPE_GUIDE)
+    bots = await database.aio.get_bots_by_creator(operator_id, role=BOT_TYPE_GUIDE)
     if not bots:
         await update.message.reply_text("你还没有创建任何引导注册机器人。")
         return ConversationHandler.END
@@ -274,7 +300,7 @@ async def edit_reg_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     token = query.data.split("_", 2)[-1]
-    bot = database.get_bot_by_token(token)
+    bot = await database.aio.get_bot_by_token(token)
     if not bot or (bot.get('created_by') not in (None, update.effective_user.id)):
         await query.edit_message_text("错误：无权限或机器人不存在。")
         return ConversationHandler.END
@@ -296,7 +322,7 @@ async def edit_reg_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not new_link:
         await update.message.reply_text("请输入有效的链接。")
         return EDIT_REG_INPUT_LINK
-    ok = database.update_registration_link(token, new_link)
+    ok = await database.aio.update_registration_link(token, new_link)
     # 若该机器人正在运行（私聊引导），热更新其配置
     try:
         manager = context.application.bot_data.get('manager')
@@ -316,18 +342,38 @@ async def edit_reg_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # --- 强制触发一次发送 ---
+async def _send_now_keyboard(after_id: int, page: int):
+    bots, next_after = await database.aio.get_bots_page(
+        after_id, PICKER_PAGE_SIZE, role=BOT_TYPE_CHANNEL, active_only=True
+    )
+    keyboard = [[InlineKeyboardButton(bot['agent_name'], callback_data=f"sendnow_{bot['bot_token']}")] for bot in bots]
+    keyboard += _next_page_button("sendnow_page_", next_after, page)
+    return bots, InlineKeyboardMarkup(keyboard)
+
+
 async def send_now_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """展示本人可用的频道机器人，准备触发立即发送。"""
+    """展示本人可用的频道机器人，准备触发立即发送（按页查询）。"""
     if not is_admin(update):
         return
-    all_bots = database.get_active_bots(role=BOT_TYPE_CHANNEL)
-    if not all_bots:
+    bots, markup = await _send_now_keyboard(0, 1)
+    if not bots:
         await update.message.reply_text("当前没有频道带单机器人。")
         return
-    keyboard = []
-    for bot in all_bots:
-        keyboard.append([InlineKeyboardButton(bot['agent_name'], callback_data=f"sendnow_{bot['bot_token']}")])
-    await update.message.reply_text("请选择要立即发送的频道机器人：", reply_markup=InlineKeyboardMarkup(keyboard))
+    await update.message.reply_text("请选择要立即发送的频道机器人：", reply_markup=markup)
+
+
+async def send_now_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/sendnow 选择器的“下一页”回调（须先于 `^sendnow_` 注册）。"""
+    if not is_admin(update):
+        return
+    query = update.callback_query
+    await query.answer()
+    after_id, page = _parse_page_callback(query.data)
+    bots, markup = await _send_now_keyboard(after_id, page)
+    if not bots:
+        await query.edit_message_text("没有更多频道机器人了。")
+        return
+    await query.edit_message_text(f"请选择要立即发送的频道机器人（第{page}页）：", reply_markup=markup)
 
 
 async def send_now_execute(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -459,7 +505,7 @@ async def get_play_url(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
         await update.message.reply_text("正在保存所有配置并尝试启动机器人...")
         created_by = update.effective_user.id
-        new_bot_config = database.add_bot(name, token, reg_link, channel_link, play_url, video_url, image_url, bot_role, created_by)
+        new_bot_config = await database.aio.add_bot(name, token, reg_link, channel_link, play_url, video_url, image_url, bot_role, created_by)
 
         if not new_bot_config:
             await update.message.reply_text("❌ 保存失败！这个Bot Token可能已经存在于数据库中。")
@@ -566,7 +612,7 @@ async def get_image_url_and_save(update: Update, context: ContextTypes.DEFAULT_T
 
     await context.bot.send_message(chat_id=chat_id, text="正在保存所有配置并尝试启动机器人...")
     created_by = update.effective_user.id
-    new_bot_config = database.add_bot(name, token, reg_link, channel_link, play_url, video_url, image_url, bot_role, created_by)
+    new_bot_config = await database.aio.add_bot(name, token, reg_link, channel_link, play_url, video_url, image_url, bot_role, created_by)
 
     if not new_bot_config:
         await context.bot.send_message(chat_id=chat_id, text="❌ 保存失败！这个Bot Token可能已经存在于数据库中。")
@@ -643,6 +689,57 @@ edit_reg_handler = ConversationHandler(
     },
     fallbacks=[CommandHandler("cancel", cancel_add_bot)],
 )
+# --- /dbstats: 数据库运行指标 ---
+DBSTATS_TOP_N = 15
+DBSTATS_MAX_CHARS = 3500  # 单条消息 <pre> 内容的上限，留足 Telegram 4096 字符限制的余量
+
+
+async def _reply_pre_pages(update: Update, title: str, text: str):
+    """把多行文本按行分页放进 <pre> 发送，每页转义后不超过 DBSTATS_MAX_CHARS；超长的单行截断。"""
+    pages, current, curlen = [], [], 0
+    for line in text.split("\n"):
+        line = html.escape(line)[:DBSTATS_MAX_CHARS]
+        if current and curlen + len(line) + 1 > DBSTATS_MAX_CHARS:
+            pages.append("\n".join(current))
+            current, curlen = [], 0
+        current.append(line)
+        curlen += len(line) + 1
+    if current:
+        pages.append("\n".join(current))
+    for idx, content in enumerate(pages, start=1):
+        suffix = f"（{idx}/{len(pages)}）" if len(pages) > 1 else ""
+        await update.message.reply_text(f"<b>{title}</b>{suffix}\n<pre>{content}</pre>", parse_mode='HTML')
+
+
+async def dbstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """输出连接池、缓存、执行器、写入队列、机器人批量启动汇总等指标，以及总耗时最高的数据库函数。"""
+    if not is_admin(update):
+        return
+    overview = {
+        "pool": database.get_pool_stats(),
+        "executor": database.aio.stats(),
+        "bot_cache": database.get_cache_stats(),
+        "media_cache": database.get_media_cache_stats(),
+        "conv_writer": database.get_conversation_writer_stats(),
+        "sweeper": database.get_sweeper_stats(),
+    }
+    manager = context.bot_data.get('manager')
+    if manager is not None and manager.startup_report:
+        overview["bot_startup"] = manager.startup_report
+    await _reply_pre_pages(update, "数据库概览", json.dumps(overview, ensure_ascii=False, indent=1))
+    stats = list(database.get_query_stats().items())[:DBSTATS_TOP_N]
+    if not stats:
+        await update.message.reply_text("暂无函数耗时统计（DB_TIMING 未开启或尚无调用）。")
+        return
+    lines = [f"{'函数':<30}{'次数':>7}{'错误':>5}{'p50':>8}{'p95':>8}{'p99':>8}{'总ms':>10}"]
+    for name, st in stats:
+        lines.append(
+            f"{name[:30]:<30}{st['count']:>7}{st['errors']:>5}{st['p50_ms']:>8.2f}"
+            f"{st['p95_ms']:>8.2f}{st['p99_ms']:>8.2f}{st['total_ms']:>10.0f}"
+        )
+    await _reply_pre_pages(update, f"函数耗时（按总耗时前 {len(stats)}，单位 ms）", "\n".join(lines))
+
+
 # --- /catuser: 仅查看自己创建的私聊引导机器人引流人数 ---
 async def catuser(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """统计与分页展示本人创建的私聊引导机器人引流人数（去重）。"""
@@ -650,7 +747,7 @@ async def catuser(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     operator_id = update.effective_user.id
     # 仅查询该用户创建的 private 机器人
-    bots = database.get_bots_by_creator(operator_id, role=BOT_TYPE_GUIDE)
+    bots = await database.aio.get_bots_by_creator(operator_id, role=BOT_TYPE_GUIDE)
     if not bots:
         await update.message.reply_text("你还没有创建任何引导注册机器人。")
         return
@@ -662,12 +759,14 @@ async def catuser(update: Update, context: ContextTypes.DEFAULT_TYPE):
     curlen = len(header)
     pages = []
 
+    # 一次批量读取全部机器人的引流人数
+    try:
+        counts = await database.aio.count_users_for_bots([bot['bot_token'] for bot in bots])
+    except Exception:
+        counts = {}
+
     for bot in bots:
-        count = 0
-        try:
-            count = database.count_users_for_bot(bot['bot_token'])
-        except Exception:
-            count = 0
+        count = counts.get(bot['bot_token'], 0)
         line = (
             f"<b>代理:</b> {html.escape(bot['agent_name'])}\n"
             f"<b>Token:</b> <code>{html.escape(bot['bot_token'][:10])}...</code>\n"
@@ -690,31 +789,74 @@ async def catuser(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(content + suffix, parse_mode='HTML')
 
 
+# --- /pauseall 与 /resumeall: 批量停用/启用本人创建的机器人 ---
+async def _set_own_fleet_active(update: Update, context: ContextTypes.DEFAULT_TYPE, active: bool):
+    """一次事务切换本人机器人的启用状态，再并发启动/停止受影响的应用。可选参数 private / channel 只处理该类型。"""
+    if not is_admin(update):
+        return
+    role = (context.args[0].lower() if context.args else None)
+    if role not in (None, BOT_TYPE_GUIDE, BOT_TYPE_CHANNEL):
+        await update.message.reply_text(f"用法：/{'resumeall' if active else 'pauseall'} [{BOT_TYPE_GUIDE}|{BOT_TYPE_CHANNEL}]")
+        return
+    bots = await database.aio.get_bots_by_creator(update.effective_user.id, role=role)
+    if not bots:
+        await update.message.reply_text("你还没有创建任何机器人。")
+        return
+    changed = await database.aio.set_bots_active([bot['id'] for bot in bots], active)
+    started = stopped = 0
+    for runner in (context.application.bot_data.get('manager'), context.application.bot_data.get('channel_supervisor')):
+        if runner is not None and changed:
+            n_start, n_stop = await runner.apply_bot_states(changed)
+            started += n_start
+            stopped += n_stop
+    action = "启用" if active else "停用"
+    await update.message.reply_text(
+        f"已{action} {len(changed)} 个机器人（共 {len(bots)} 个，其余已处于{action}状态）。\n"
+        f"启动应用 {started} 个，停止应用 {stopped} 个。"
+    )
+
+
+async def pause_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/pauseall [private|channel]：停用本人创建的全部（或某类型）机器人并停止其应用。"""
+    await _set_own_fleet_active(update, context, False)
+
+
+async def resume_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/resumeall [private|channel]：启用本人创建的全部（或某类型）机器人并启动其应用。"""
+    await _set_own_fleet_active(update, context, True)
+
 
 # --- 删除机器人流程 (保持不变) ---
 async def delete_bot_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """删除机器人流程入口：分页展示本人可删除的机器人按钮。"""
     if not is_admin(update): return
-    # 仅展示本人创建的机器人
-    operator_id = update.effective_user.id
-    all_bots = database.get_bots_by_creator(operator_id)
-    if not all_bots:
+    # 仅展示本人创建的机器人，每次只查询一页
+    bots, markup = await _delete_bot_keyboard(update.effective_user.id, 0, 1)
+    if not bots:
         await update.message.reply_text("数据库中还没有任何机器人可以删除。")
         return
+    await update.message.reply_text("请选择您要删除的代理机器人：", reply_markup=markup)
 
-    # 分页发送按钮，避免键盘/消息过长
-    page_size = 25
-    total = (len(all_bots) + page_size - 1) // page_size
-    for page_idx in range(total):
-        slice_bots = all_bots[page_idx * page_size:(page_idx + 1) * page_size]
-        keyboard = []
-        for bot in slice_bots:
-            bot_id = bot.get('id') if isinstance(bot, dict) else bot.id
-            button = InlineKeyboardButton(bot['agent_name'], callback_data=f"delbot_confirm_{bot_id}")
-            keyboard.append([button])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        text = "请选择您要删除的代理机器人：" if total == 1 else f"请选择您要删除的代理机器人（第{page_idx + 1}/{total}页）："
-        await update.message.reply_text(text, reply_markup=reply_markup)
+
+async def _delete_bot_keyboard(operator_id: int, after_id: int, page: int):
+    bots, next_after = await database.aio.get_bots_page(after_id, PICKER_PAGE_SIZE, created_by=operator_id)
+    keyboard = [[InlineKeyboardButton(bot['agent_name'], callback_data=f"delbot_confirm_{bot['id']}")] for bot in bots]
+    keyboard += _next_page_button("delbot_page_", next_after, page)
+    return bots, InlineKeyboardMarkup(keyboard)
+
+
+async def delete_bot_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/delbot 选择器的“下一页”回调。"""
+    if not is_admin(update):
+        return
+    query = update.callback_query
+    await query.answer()
+    after_id, page = _parse_page_callback(query.data)
+    bots, markup = await _delete_bot_keyboard(update.effective_user.id, after_id, page)
+    if not bots:
+        await query.edit_message_text("没有更多机器人了。")
+        return
+    await query.edit_message_text(f"请选择您要删除的代理机器人（第{page}页）：", reply_markup=markup)
 
 
 async def delete_bot_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -726,9 +868,9 @@ async def delete_bot_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # 优先按 id 解析；失败则回退按 token
     try:
         bot_id = int(bot_ref)
-        bot_config = database.get_bot_by_id(bot_id)
+        bot_config = await database.aio.get_bot_by_id(bot_id)
     except ValueError:
-        bot_config = database.get_bot_by_token(bot_ref)
+        bot_config = await database.aio.get_bot_by_token(bot_ref)
     # 越权校验：仅允许操作本人创建的机器人
     if not bot_config or (bot_config.get('created_by') not in (None, update.effective_user.id)):
         await query.edit_message_text("错误：找不到该机器人，可能已被删除。")
@@ -757,9 +899,9 @@ async def delete_bot_execute(update: Update, context: ContextTypes.DEFAULT_TYPE)
     bot_id = None
     try:
         bot_id = int(bot_ref)
-        bot_config = database.get_bot_by_id(bot_id)
+        bot_config = await database.aio.get_bot_by_id(bot_id)
     except ValueError:
-        bot_config = database.get_bot_by_token(bot_ref)
+        bot_config = await database.aio.get_bot_by_token(bot_ref)
     # 越权校验：仅允许操作本人创建的机器人
     if not bot_config or (bot_config.get('created_by') not in (None, update.effective_user.id)):
         await query.edit_message_text("错误：无权限操作该机器人。")
@@ -777,14 +919,24 @@ async def delete_bot_execute(update: Update, context: ContextTypes.DEFAULT_TYPE)
             except Exception:
                 pass
     await query.edit_message_text(f"正在从数据库中删除 '{agent_name}'...")
-    success = False
+    result = None
     if bot_config:
         if bot_id is not None:
-            success = database.delete_bot_by_id(bot_id)
+            result = await database.aio.delete_bot_by_id(bot_id)
         else:
-            success = database.delete_bot(bot_config['bot_token'])
-    if success:
-        await query.edit_message_text(f"✅ 代理机器人 '{agent_name}' 已被成功删除。")
+            result = await database.aio.delete_bot(bot_config['bot_token'])
+    if result:
+        try:
+            removed_files = await manager.remove_persist_files(result['bot_token'])
+        except Exception as e:
+            logger.warning(f"删除本地持久化文件失败: {e}")
+            removed_files = []
+        reclaimed = result['reclaimed']
+        await query.edit_message_text(
+            f"✅ 代理机器人 '{agent_name}' 已被成功删除。\n"
+            f"回收：会话 {reclaimed.get('user_conversations', 0)} 行，持久化数据 {reclaimed.get('bot_persistence', 0)} 行，"
+            f"媒体缓存 {reclaimed.get('bot_media_file_ids', 0)} 行，本地文件 {len(removed_files)} 个。"
+        )
     else:
         await query.edit_message_text("❌ 删除失败！数据库中未找到相应机器人。")
 
@@ -5,6 +5,7 @@
 - stop(token): 停止并清理计划任务与应用
 - send_now(token): 立即触发一次发送
 - update_config(token, **fields): 运行中热更新配置（如 play_url）
+- apply_bot_states(bots): 批量启停后并发启动/停止受影响的机器人
 
 目标：将频道发送能力与管理员后台解耦，由此项目统一管理。
 """
@@ -97,6 +98,20 @@ class ChannelSupervisor:
             self.running.pop(token, None)
             logger.info("ChannelSupervisor: stopped %s", token)
 
+    async def apply_bot_states(self, bots):
+        """按 `database.set_bots_active` 返回的行并发启动/停止受影响的频道机器人（其余角色忽略）。
+
+        返回:
+            tuple[int, int]: (启动数, 停止数)
+        """
+        to_start = [bot for bot in bots if bot.get('bot_role') == 'channel' and bot.get('is_active')]
+        to_stop = [bot['bot_token'] for bot in bots if bot.get('bot_role') == 'channel' and not bot.get('is_active')]
+        await asyncio.gather(
+            *(self.start(bot) for bot in to_start),
+            *(self.stop(token) for token in to_stop),
+        )
+        return len(to_start), len(to_stop)
+
     async def send_now(self, token: str, text: str | None = None) -> bool:
         """强制在对应频道立即触发一次发送。"""
         app = self.running.get(token)
@@ -18,6 +18,35 @@ MYSQL_PORT = _S.MYSQL_PORT
 MYSQL_USER = _S.MYSQL_USER
 MYSQL_PASSWORD = _S.MYSQL_PASSWORD
 MYSQL_DATABASE = _S.MYSQL_DATABASE
+MYSQL_REPLICAS = _S.MYSQL_REPLICAS
+REPLICA_PIN_SECONDS = _S.REPLICA_PIN_SECONDS
+SQLITE_TUNING = _S.SQLITE_TUNING
+SQLITE_JOURNAL_MODE = _S.SQLITE_JOURNAL_MODE
+SQLITE_SYNCHRONOUS = _S.SQLITE_SYNCHRONOUS
+SQLITE_BUSY_TIMEOUT_MS = _S.SQLITE_BUSY_TIMEOUT_MS
+SQLITE_MMAP_SIZE = _S.SQLITE_MMAP_SIZE
+SQLITE_CACHE_SIZE = _S.SQLITE_CACHE_SIZE
+SQLITE_TEMP_STORE = _S.SQLITE_TEMP_STORE
+DB_POOL_SIZE = _S.DB_POOL_SIZE
+DB_POOL_TIMEOUT = _S.DB_POOL_TIMEOUT
+DB_POOL_RECYCLE = _S.DB_POOL_RECYCLE
+DB_POOL_PING_INTERVAL = _S.DB_POOL_PING_INTERVAL
+DB_EXECUTOR_WORKERS = _S.DB_EXECUTOR_WORKERS
+DB_TIMING = _S.DB_TIMING
+DB_SLOW_QUERY_MS = _S.DB_SLOW_QUERY_MS
+BOT_CACHE_TTL = _S.BOT_CACHE_TTL
+CONV_FLUSH_INTERVAL = _S.CONV_FLUSH_INTERVAL
+CONV_FLUSH_BATCH = _S.CONV_FLUSH_BATCH
+CONV_RETENTION_DAYS = _S.CONV_RETENTION_DAYS
+CONV_SWEEP_INTERVAL = _S.CONV_SWEEP_INTERVAL
+CONV_SWEEP_CHUNK = _S.CONV_SWEEP_CHUNK
+CONV_SWEEP_PAUSE = _S.CONV_SWEEP_PAUSE
+BOT_PERSISTENCE = _S.BOT_PERSISTENCE
+PERSISTENCE_UPDATE_INTERVAL = _S.PERSISTENCE_UPDATE_INTERVAL
+FLEET_SNAPSHOT_FILE = _S.FLEET_SNAPSHOT_FILE
+FLEET_SNAPSHOT_INTERVAL = _S.FLEET_SNAPSHOT_INTERVAL
+BOT_START_CONCURRENCY = _S.BOT_START_CONCURRENCY
+BOT_START_JITTER = _S.BOT_START_JITTER
 
 ADMIN_BOT_TOKEN = _S.ADMIN_BOT_TOKEN
 ADMIN_USER_IDS = _S.ADMIN_USER_IDS
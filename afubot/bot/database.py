@@ -1,13 +1,33 @@
 """数据库访问层（Data Access Layer）
 
 提供对机器人配置与用户会话数据的持久化支持，兼容 MySQL 与 SQLite：
-- 连接管理：`get_db_connection()`
+- 连接管理：`get_db_connection()`（MySQL 有界连接池 / SQLite 按线程复用连接）
 - 表结构初始化与向后兼容处理：`initialize_db()`
-- 业务实体：机器人（bots）、用户会话（user_conversations）的 CRUD 与统计查询
-
-注意：本模块为同步数据库调用，建议在上层异步代码中避免长时间阻塞，或在必要时放入线程池执行。
+- 业务实体：机器人（bots，读取结果为 `BotConfig` 记录）、用户会话（user_conversations）的 CRUD 与统计查询
+- bots 变更检测：`get_active_bots_with_revision()`（起点）/ `get_bots_revision()` / `get_bots_changed_since(rev)`
+- 本地机队快照的数据来源与预热：`get_fleet_snapshot()` / `seed_fleet()`（供 `fleet_snapshot` 使用）
+- 工作单元：`session()` / `aio.transaction(func)` 内的调用共享一个连接，结束时统一提交
+- PTB 持久化数据按键存储：`get_persistence_rows()` / `put_persistence_rows()`（供 `persistence.DatabasePersistence` 使用）
+
+注意：本模块的函数均为同步调用；异步代码请使用同名的异步门面
+`database.aio.<函数名>(...)`，其在专用的有界线程池中执行，不会阻塞事件循环。
 """
 
+import asyncio
+import atexit
+import collections
+import collections.abc
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import math
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from .config import (
     DB_BACKEND,
     DB_FILE,
@@ -16,48 +36,1040 @@ from .config import (
     MYSQL_USER,
     MYSQL_PASSWORD,
     MYSQL_DATABASE,
+    MYSQL_REPLICAS,
+    REPLICA_PIN_SECONDS,
+    SQLITE_TUNING,
+    SQLITE_JOURNAL_MODE,
+    SQLITE_SYNCHRONOUS,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_MMAP_SIZE,
+    SQLITE_CACHE_SIZE,
+    SQLITE_TEMP_STORE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PING_INTERVAL,
+    DB_EXECUTOR_WORKERS,
+    DB_TIMING,
+    DB_SLOW_QUERY_MS,
+    BOT_CACHE_TTL,
+    CONV_FLUSH_INTERVAL,
+    CONV_FLUSH_BATCH,
 )
 
 if DB_BACKEND == "mysql":
     import pymysql
-    from pymysql.cursors import DictCursor
+    from pymysql.constants import SERVER_STATUS
+    from pymysql.cursors import Cursor, DictCursor, SSCursor
 else:
     import sqlite3
 
+logger = logging.getLogger(__name__)
+
+
+# --- 连接池 ---
+class _PooledConnection:
+    """借出的连接代理：其余属性透传给底层连接，`close()` 改为归还到池。"""
+
+    __slots__ = ("_raw", "_pool", "_created_at", "_released")
+
+    def __init__(self, raw, pool, created_at: float = 0.0):
+        self._raw = raw
+        self._pool = pool
+        self._created_at = created_at
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        self._pool.release(self._raw, self._created_at)
 
-def get_db_connection():
-    """建立并返回数据库连接。
 
-    - 当配置为 MySQL 时，返回 `pymysql.connect` 的连接对象（DictCursor，utf8mb4）。
-    - 当配置为 SQLite 时，返回 `sqlite3.connect` 的连接对象（行工厂 `sqlite3.Row`）。
+class _CheckoutStats:
+    """借出耗时统计（次数 / 总耗时 / 最大耗时），供 `get_pool_stats()` 读取。"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, seconds: float):
+        self.checkouts += 1
+        self.total_wait += seconds
+        if seconds > self.max_wait:
+            self.max_wait = seconds
+
+    def as_dict(self) -> dict:
+        avg = self.total_wait / self.checkouts if self.checkouts else 0.0
+        return {
+            "checkouts": self.checkouts,
+            "checkout_avg_ms": round(avg * 1000, 3),
+            "checkout_max_ms": round(self.max_wait * 1000, 3),
+        }
+
+
+class _MySQLPool:
+    """有界 MySQL 连接池。
+
+    - 最多同时打开 `size` 个连接，池满时等待至多 `timeout` 秒，超时抛出 `TimeoutError`
+    - 借出时对空闲超过 `ping_interval` 秒的连接做 ping 健康检查，失败则重建
+    - 存活超过 `recycle` 秒的连接在借出时关闭并重建
+    - 归还时若仍处于事务中则回滚，避免脏状态泄漏给下一个使用者
     """
-    if DB_BACKEND == "mysql":
+
+    def __init__(self, size: int, timeout: float, recycle: int, ping_interval: float, connect_kwargs: dict | None = None):
+        self._connect_kwargs = connect_kwargs or {
+            "host": MYSQL_HOST,
+            "port": MYSQL_PORT,
+            "user": MYSQL_USER,
+            "password": MYSQL_PASSWORD,
+            "database": MYSQL_DATABASE,
+        }
+        self._size = max(1, size)
+        self._timeout = timeout
+        self._recycle = recycle
+        self._ping_interval = ping_interval
+        self._idle = collections.deque()  # (conn, created_at, last_used)
+        self._cond = threading.Condition(threading.Lock())
+        self._open = 0
+        self._in_use = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._recycled = 0
+        self._ping_failures = 0
+        self._stats = _CheckoutStats()
+
+    def _connect(self):
         return pymysql.connect(
-            host=MYSQL_HOST,
-            port=MYSQL_PORT,
-            user=MYSQL_USER,
-            password=MYSQL_PASSWORD,
-            database=MYSQL_DATABASE,
+            **self._connect_kwargs,
             cursorclass=DictCursor,
             autocommit=False,
             charset="utf8mb4",
         )
-    # sqlite (默认本地)
-    conn = sqlite3.connect(DB_FILE)
+
+    def acquire(self) -> _PooledConnection:
+        started = time.perf_counter()
+        deadline = time.monotonic() + self._timeout
+        entry = None
+        with self._cond:
+            waited = False
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()  # LIFO：优先复用最热的连接
+                    break
+                if self._open < self._size:
+                    self._open += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise TimeoutError(f"数据库连接池已满（size={self._size}），等待 {self._timeout}s 超时")
+                if not waited:
+                    self._waits += 1
+                    waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+
+        try:
+            conn, created_at = self._checkout(entry)
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        self._stats.record(time.perf_counter() - started)
+        return _PooledConnection(conn, self, created_at)
+
+    def _checkout(self, entry):
+        now = time.monotonic()
+        if entry is None:
+            return self._connect(), now
+        conn, created_at, last_used = entry
+        if self._recycle and now - created_at > self._recycle:
+            self._recycled += 1
+            self._close_quietly(conn)
+            return self._connect(), now
+        if now - last_used > self._ping_interval:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                self._ping_failures += 1
+                self._close_quietly(conn)
+                return self._connect(), now
+        return conn, created_at
+
+    def release(self, conn, created_at: float):
+        try:
+            if conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                conn.rollback()
+        except Exception:
+            self._close_quietly(conn)
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._in_use -= 1
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), collections.deque()
+            self._open -= len(idle)
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        with self._cond:
+            data = {
+                "backend": "mysql",
+                "server": f"{self._connect_kwargs['host']}:{self._connect_kwargs['port']}",
+                "size": self._size,
+                "open": self._open,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "recycled": self._recycled,
+                "ping_failures": self._ping_failures,
+            }
+        data.update(self._stats.as_dict())
+        return data
+
+
+def _sqlite_pragmas() -> list:
+    """按配置生成 SQLite 连接参数：(pragma, 值)；关闭调优时为空，沿用 sqlite3 默认行为。"""
+    if not SQLITE_TUNING:
+        return []
+    return [
+        ("busy_timeout", SQLITE_BUSY_TIMEOUT_MS),
+        ("journal_mode", SQLITE_JOURNAL_MODE),
+        ("synchronous", SQLITE_SYNCHRONOUS),
+        ("mmap_size", SQLITE_MMAP_SIZE),
+        ("cache_size", SQLITE_CACHE_SIZE),
+        ("temp_store", SQLITE_TEMP_STORE),
+    ]
+
+
+# 新建 SQLite 连接时依次执行的 PRAGMA（journal_mode=WAL 写入文件后持久生效，其余按连接生效）
+SQLITE_PRAGMAS = _sqlite_pragmas()
+
+
+# 每个 SQLite 连接按 SQL 文本缓存的预编译语句数量（方言层保证同一操作的语句文本固定）
+_SQLITE_STATEMENT_CACHE = 256
+
+
+def _connect_sqlite(path: str, check_same_thread: bool = True):
+    """打开 SQLite 连接并应用 `SQLITE_PRAGMAS`。"""
+    pragmas = dict(SQLITE_PRAGMAS)
+    kwargs = {"cached_statements": _SQLITE_STATEMENT_CACHE, "check_same_thread": check_same_thread}
+    if "busy_timeout" in pragmas:
+        kwargs["timeout"] = pragmas["busy_timeout"] / 1000
+    conn = sqlite3.connect(path, **kwargs)
+    for name, value in SQLITE_PRAGMAS:
+        conn.execute(f"PRAGMA {name}={value}")
     conn.row_factory = sqlite3.Row
     return conn
 
 
-def initialize_db():
-    """初始化数据库，创建或修补所需表结构（支持 MySQL / SQLite）。
+class _SQLiteThreadPool:
+    """SQLite 按线程复用连接：同一线程内的调用共享一个连接，不再反复打开文件。
 
-    - 创建 `bots` 表（机器人配置）与 `user_conversations` 表（用户会话持久化）。
-    - 对历史库进行列补全（向后兼容），容错处理不影响主流程。
+    允许同一线程嵌套借出（例如 `add_bot` 内部调用 `get_bot_by_id`），
+    仅在最外层归还时回滚未提交的事务。
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
 
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._stats = _CheckoutStats()
+
+    def acquire(self) -> _PooledConnection:
+        started = time.perf_counter()
+        local = self._local
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = _connect_sqlite(DB_FILE)
+            local.conn = conn
+            local.depth = 0
+            with self._lock:
+                self._opened += 1
+        local.depth += 1
+        self._stats.record(time.perf_counter() - started)
+        return _PooledConnection(conn, self)
+
+    def release(self, conn, created_at: float = 0.0):
+        local = self._local
+        local.depth -= 1
+        if local.depth <= 0:
+            local.depth = 0
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except Exception:
+                pass
+
+    def close_all(self):
+        """关闭当前线程持有的连接（其它线程的连接随线程结束释放）。"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        data = {"backend": "sqlite", "threads_opened": self._opened}
+        data.update(self._stats.as_dict())
+        return data
+
+
+class _SQLiteSessionPool:
+    """供 `session()` 使用的 SQLite 连接：不绑定线程、与线程复用连接分开（会话期间同线程的写后合并落库等
+    不借会话连接的写入不会混入会话事务），
+    归还时回滚未提交的事务，最多保留 `max_idle` 个空闲连接复用。
+    """
+
+    def __init__(self, max_idle: int):
+        self._max_idle = max(1, max_idle)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._stats = _CheckoutStats()
+
+    def acquire(self) -> _PooledConnection:
+        started = time.perf_counter()
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = _connect_sqlite(DB_FILE, check_same_thread=False)
+            with self._lock:
+                self._opened += 1
+        self._stats.record(time.perf_counter() - started)
+        return _PooledConnection(conn, self)
+
+    def release(self, conn, created_at: float = 0.0):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            conn.close()
+            return
+        with self._lock:
+            if len(self._idle) < self._max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = {"opened": self._opened, "idle": len(self._idle)}
+        data.update(self._stats.as_dict())
+        return data
+
+
+def _parse_replica_dsn(dsn: str) -> dict:
+    """解析 `[user[:password]@]host[:port][/database]`，省略的部分沿用主库配置。"""
+    kwargs = {
+        "host": MYSQL_HOST,
+        "port": MYSQL_PORT,
+        "user": MYSQL_USER,
+        "password": MYSQL_PASSWORD,
+        "database": MYSQL_DATABASE,
+    }
+    rest = dsn
+    if "@" in rest:
+        creds, rest = rest.rsplit("@", 1)
+        user, _, password = creds.partition(":")
+        kwargs["user"] = user or kwargs["user"]
+        if password:
+            kwargs["password"] = password
+    if "/" in rest:
+        rest, database = rest.split("/", 1)
+        kwargs["database"] = database or kwargs["database"]
+    host, _, port = rest.partition(":")
+    kwargs["host"] = host or kwargs["host"]
+    if port:
+        kwargs["port"] = int(port)
+    return kwargs
+
+
+if DB_BACKEND == "mysql":
+    _pool = _MySQLPool(DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PING_INTERVAL)
+    _replica_pools = [
+        _MySQLPool(DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PING_INTERVAL, _parse_replica_dsn(dsn))
+        for dsn in MYSQL_REPLICAS
+    ]
+else:
+    _pool = _SQLiteThreadPool()
+    _replica_pools = []
+
+if DB_BACKEND == "mysql" and DB_POOL_SIZE <= DB_EXECUTOR_WORKERS:
+    logger.warning(
+        f"DB_POOL_SIZE={DB_POOL_SIZE} 不大于 DB_EXECUTOR_WORKERS={DB_EXECUTOR_WORKERS}："
+        "执行线程占满连接池时，写入线程等其他调用方只能等待借出超时"
+    )
+
+# 工作单元使用的主库连接来源：MySQL 连接本身不绑定线程，直接用主库池
+_session_pool = _pool if DB_BACKEND == "mysql" else _SQLiteSessionPool(DB_POOL_SIZE)
+
+
+# --- 读写分离：写后固定主库 ---
+# 每个调用方（异步任务 / 线程）持有一个可变的截止时间；`database.aio` 把调用方上下文带进执行线程，
+# 写入时更新截止时间，调用方在截止前的读取都走主库。
+_primary_pin = contextvars.ContextVar("db_primary_pin", default=None)
+_replica_rr = 0
+_replica_stats = {"replica_reads": 0, "pinned_reads": 0, "fallbacks": 0}
+
+
+def _pin_primary():
+    """标记当前调用方刚刚写入：`REPLICA_PIN_SECONDS` 秒内的读取固定走主库。"""
+    if not _replica_pools:
+        return
+    until = time.monotonic() + REPLICA_PIN_SECONDS
+    holder = _primary_pin.get()
+    if holder is None:
+        _primary_pin.set([until])
+    else:
+        holder[0] = until
+
+
+def _pinned_to_primary() -> bool:
+    holder = _primary_pin.get()
+    return holder is not None and holder[0] > time.monotonic()
+
+
+def _acquire_replica():
+    """轮询借出一个副本连接；副本不可用时回退主库。"""
+    global _replica_rr
+    if _pinned_to_primary():
+        _replica_stats["pinned_reads"] += 1
+        return _pool.acquire()
+    _replica_rr = (_replica_rr + 1) % len(_replica_pools)
+    try:
+        conn = _replica_pools[_replica_rr].acquire()
+    except Exception as e:
+        _replica_stats["fallbacks"] += 1
+        logger.warning(f"只读副本不可用，回退主库: {e}")
+        return _pool.acquire()
+    _replica_stats["replica_reads"] += 1
+    return conn
+
+
+# --- 工作单元：一个处理流程内的调用共享连接与提交 ---
+# 与写后固定主库一样经 contextvar 传递：`session()` / `aio.transaction()` 期间，本模块函数借出的都是会话的主库连接，
+# 函数内的 `commit()` 推迟到会话结束统一提交；缓存失效等副作用登记为提交后回调，回滚时丢弃。
+_session_var = contextvars.ContextVar("db_session", default=None)
+_SESSION_SAVEPOINT = "db_session_call"
+
+
+def _in_transaction(conn) -> bool:
+    if DB_BACKEND == "mysql":
+        return bool(conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS)
+    return conn.in_transaction
+
+
+class _SessionConnection:
+    """会话内借出的连接视图：`commit()` 推迟到会话提交，`rollback()` 只撤销本次调用的写入，`close()` 归还给会话。"""
+
+    __slots__ = ("_session", "_released")
+
+    def __init__(self, session):
+        self._session = session
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._session._conn, name)
+
+    def commit(self):
+        return
+
+    def rollback(self):
+        self._session._rollback_call()
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        self._session._release()
+
+
+class _DBSession:
+    """一次工作单元：共享一个主库连接（首次使用时借出），结束时提交一次并执行提交后回调。
+
+    - 会话内的调用由可重入锁串行化，读取同样走主库，读己之写
+    - 已有写入时，每次调用前设置保存点，函数内部的回滚只撤销该次调用，不影响会话此前的写入
+    - 写入在会话提交前一直持有锁：整个会话必须在一个线程内连续执行完（异步代码用 `aio.transaction`），
+      不能跨越 await，否则并发会话会占满执行线程、互相等待对方的锁
+    """
+
+    def __init__(self):
+        self._conn = None
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._savepoint = False
+        self._after_commit = []
+        self._conversations = {}  # 会话内的用户会话写入，提交后进入写后合并队列
+        self.bots_changed = False
+        self.closed = False
+        self.calls = 0
+
+    def connection(self) -> _SessionConnection:
+        self._lock.acquire()
+        try:
+            if self.closed:
+                raise RuntimeError("数据库会话已结束")
+            if self._conn is None:
+                self._conn = _session_pool.acquire()
+            if self._depth == 0:
+                self._savepoint = _in_transaction(self._conn)
+                if self._savepoint:
+                    self._execute_raw(f"SAVEPOINT {_SESSION_SAVEPOINT}")
+            self._depth += 1
+            self.calls += 1
+        except BaseException:
+            self._lock.release()
+            raise
+        return _SessionConnection(self)
+
+    def _release(self):
+        self._depth -= 1
+        self._lock.release()
+
+    def _execute_raw(self, sql: str):
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute(sql)
+        finally:
+            cursor.close()
+
+    def _rollback_call(self):
+        if self._savepoint:
+            self._execute_raw(f"ROLLBACK TO SAVEPOINT {_SESSION_SAVEPOINT}")
+        else:
+            self._conn.rollback()
+
+    def after_commit(self, callback):
+        """登记提交后执行的回调（同一回调只登记一次）；会话回滚时丢弃。"""
+        with self._lock:
+            if callback not in self._after_commit:
+                self._after_commit.append(callback)
+
+    def queue_conversation(self, key, value):
+        with self._lock:
+            if not self._conversations:
+                self._after_commit.append(self._flush_conversations)
+            self._conversations[key] = value
+
+    def lookup_conversation(self, key):
+        with self._lock:
+            if key in self._conversations:
+                return True, self._conversations[key]
+        return False, None
+
+    def _flush_conversations(self):
+        with self._lock:
+            pending, self._conversations = self._conversations, {}
+        for key, value in pending.items():
+            _conv_writer.put(key, value)
+
+    def commit(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.commit()
+            callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"数据库会话提交后回调失败: {e}")
+
+    def rollback(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.rollback()
+            self._after_commit = []
+            self._conversations = {}
+            if self.bots_changed:
+                # 会话内解析到的 bot_id 可能来自已撤销的写入
+                with _bot_ids_lock:
+                    _bot_ids.clear()
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+
+
+def _after_commit(callback):
+    """处于会话中时把回调推迟到会话提交后，否则立即执行。"""
+    session = _session_var.get()
+    if session is None:
+        callback()
+    else:
+        session.after_commit(callback)
+
+
+@contextlib.contextmanager
+def session():
+    """工作单元：块内本模块函数共享一个主库连接，正常退出时统一提交一次，异常时整体回滚。
+
+    嵌套使用时复用外层会话。异步代码使用 `database.aio.transaction(func)`，在一个执行线程内运行整个工作单元。
+
+    用法:
+        with database.session():
+            cfg = database.get_bot_by_token(token)
+            database.update_bot_file_ids(token, first_image_file_id=fid)
+            database.upsert_user_conversation(token, chat_id, state)
+    """
+    current = _session_var.get()
+    if current is not None:
+        yield current
+        return
+    unit = _DBSession()
+    token = _session_var.set(unit)
+    try:
+        yield unit
+        unit.commit()
+    except BaseException:
+        unit.rollback()
+        raise
+    finally:
+        _session_var.reset(token)
+        unit.close()
+
+
+def _run_in_session(func, args, kwargs):
+    with session():
+        return func(*args, **kwargs)
+
+
+def get_db_connection(readonly: bool = False):
+    """从连接池借出并返回数据库连接，调用方用完后 `close()` 即归还。
+
+    - 当配置为 MySQL 时，返回有界连接池中的 `pymysql` 连接（DictCursor，utf8mb4）。
+      `readonly=True` 且配置了 `MYSQL_REPLICAS` 时改从只读副本借出（调用方刚写入时除外）。
+    - 当配置为 SQLite 时，返回当前线程复用的 `sqlite3` 连接（行工厂 `sqlite3.Row`，已应用 `SQLITE_PRAGMAS`）。
+    - 处于 `session()` 中时，返回会话共享的主库连接视图（提交推迟到会话结束）。
+    """
+    unit = _session_var.get()
+    if unit is not None:
+        return unit.connection()
+    if readonly and _replica_pools:
+        return _acquire_replica()
+    return _pool.acquire()
+
+
+def get_pool_stats() -> dict:
+    """返回连接池的运行指标（容量、占用、等待/超时次数、借出耗时等）；配置副本时附带各副本指标与路由计数。"""
+    data = _pool.stats()
+    if _session_pool is not _pool:
+        data["sessions"] = _session_pool.stats()
+    if _replica_pools:
+        data["replicas"] = [pool.stats() for pool in _replica_pools]
+        data["routing"] = dict(_replica_stats)
+    return data
+
+
+def close_db_pool():
+    """关闭连接池中的空闲连接（进程退出时调用）。"""
+    _pool.close_all()
+    if _session_pool is not _pool:
+        _session_pool.close_all()
+    for pool in _replica_pools:
+        pool.close_all()
+
+
+# --- bots 配置记录 ---
+BOT_COLUMNS = (
+    "id", "agent_name", "bot_token", "registration_link", "channel_link", "play_url", "video_url",
+    "image_url", "bot_role", "is_active", "video_file_id", "image_file_id", "deposit_file_id",
+    "sticker_file_id", "first_image_file_id", "created_by",
+)
+
+
+class BotConfig(collections.abc.MutableMapping):
+    """bots 表一行：`__slots__` 记录，按列位置直接由查询结果元组构造。
+
+    保留字典风格的用法（`cfg['bot_token']`、`cfg.get(...)`、`in`、`items()`、`update()`、`dict(cfg)`），
+    只是键固定为 bots 的列：写入不存在的列抛出 KeyError，不支持删除键。
+    同一条记录在配置缓存与各运行中的 Application 之间按引用共享，就地修改（如回填 file_id）对持有者都可见。
+    """
+
+    __slots__ = BOT_COLUMNS + ("rev",)
+
+    @classmethod
+    def _from_row(cls, row):
+        self = cls.__new__(cls)
+        for setter, value in zip(_BOT_SETTERS, row):
+            setter(self, value)
+        return self
+
+    @classmethod
+    def from_dict(cls, data):
+        """由字典构造（缺少的列为 None）。"""
+        return cls._from_row([data.get(name) for name in cls.__slots__])
+
+    def __getitem__(self, key):
+        if key not in _BOT_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        if key not in _BOT_FIELDS:
+            return default
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in _BOT_FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        raise TypeError("BotConfig 的列不能删除")
+
+    def __contains__(self, key):
+        return key in _BOT_FIELDS
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def copy(self) -> "BotConfig":
+        return self._from_row([getattr(self, name) for name in self.__slots__])
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for setter, value in zip(_BOT_SETTERS, state):
+            setter(self, value)
+
+    def __repr__(self):
+        return f"BotConfig({self.to_dict()!r})"
+
+
+_BOT_FIELDS = frozenset(BotConfig.__slots__)
+_BOT_SETTERS = tuple(getattr(BotConfig, name).__set__ for name in BotConfig.__slots__)
+_BOTS_SELECT = f"SELECT {', '.join(BotConfig.__slots__)} FROM bots"
+# bots 完整行按元组读取（MySQL 不经 DictCursor 构造字典）
+_TUPLE_CURSOR = Cursor if DB_BACKEND == "mysql" else None
+
+
+def _select_bots(conn, where: str = "", params=()) -> list:
+    """查询 bots 完整行（`where` 为 WHERE/ORDER BY 子句），返回 `BotConfig` 列表。"""
+    with _cursor(conn, _TUPLE_CURSOR) as cursor:
+        _execute(cursor, _BOTS_SELECT + where, params)
+        return [BotConfig._from_row(row) for row in cursor.fetchall()]
+
+
+# --- bots 配置读穿缓存 ---
+class _BotConfigCache:
+    """机器人配置的进程内读穿缓存（按 token / id / 角色 / 创建者 作为键）。
+
+    - 每个条目带 TTL（`BOT_CACHE_TTL` 秒），兜底跨进程写入带来的陈旧
+    - 任意 bots 写操作后整体失效；用代数（generation）丢弃失效前发起的回填
+    - `BotConfig` 记录按引用共享（不复制）；列表容器与分页投影的字典返回副本
+    - 启用只读副本时，失效后 `settle` 秒内读到的结果不回填，避免把副本上的旧数据缓存一个 TTL
+    """
+
+    def __init__(self, ttl: float, settle: float = 0.0):
+        self._ttl = ttl
+        self._settle = settle
+        self._invalidated_at = float("-inf")
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (expires_at, value)
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @classmethod
+    def _copy(cls, value):
+        if isinstance(value, BotConfig):
+            return value
+        if isinstance(value, list):
+            return [row if isinstance(row, BotConfig) else dict(row) for row in value]
+        if isinstance(value, tuple):
+            # 分页结果：(rows, next_after_id)
+            return tuple(cls._copy(v) if isinstance(v, (list, dict)) else v for v in value)
+        return dict(value)
+
+    def read_through(self, key, loader):
+        if self._ttl <= 0:
+            return loader()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return self._copy(entry[1])
+            self.misses += 1
+            generation = self._generation
+        value = loader()
+        if value is not None:
+            with self._lock:
+                settled = time.monotonic() - self._invalidated_at >= self._settle
+                if generation == self._generation and settled:
+                    self._entries[key] = (time.monotonic() + self._ttl, self._copy(value))
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self._invalidated_at = time.monotonic()
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "invalidations": self.invalidations,
+                "ttl": self._ttl,
+            }
+
+
+_bot_cache = _BotConfigCache(BOT_CACHE_TTL, REPLICA_PIN_SECONDS if _replica_pools else 0.0)
+
+
+def _cached_bot_read(func):
+    """装饰 bots 读函数：以（函数名 + 规范化后的参数）为键走读穿缓存。"""
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        unit = _session_var.get()
+        if unit is not None and unit.bots_changed:
+            # 会话内已改过 bots：读取未提交的数据，不能回填缓存
+            return func(*args, **kwargs)
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (func.__name__,) + tuple(bound.arguments.values())
+        return _bot_cache.read_through(key, lambda: func(*args, **kwargs))
+
+    return wrapper
+
+
+def _bots_committed():
+    _bot_cache.invalidate()
+    _pin_primary()
+
+
+def _invalidates_bots(func):
+    """装饰 bots 写函数：函数返回（已提交）后使配置缓存失效，并把调用方的读取固定到主库。
+
+    处于 `session()` 中时失效推迟到会话提交后。
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        unit = _session_var.get()
+        if unit is not None:
+            unit.bots_changed = True
+            try:
+                return func(*args, **kwargs)
+            finally:
+                unit.after_commit(_bots_committed)
+        _pin_primary()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _bot_cache.invalidate()
+            _pin_primary()
+
+    return wrapper
+
+
+def get_cache_stats() -> dict:
+    """返回 bots 配置缓存的命中/未命中/失效次数等指标。"""
+    return _bot_cache.stats()
+
+
+def invalidate_bot_cache():
+    """手动清空 bots 配置缓存（例如外部工具直接改表后）。"""
+    _bot_cache.invalidate()
+
+
+# --- SQL 方言层 ---
+# 业务语句统一以 `?` 为占位符书写，每条语句按后端编译一次并缓存（MySQL 转为 `%s`，字面量 `%` 转义），
+# 每个操作只保留一条代码路径。SQLite 连接按 SQL 文本复用预编译语句（`_SQLITE_STATEMENT_CACHE`）；
+# pymysql 不支持服务端预处理语句，MySQL 侧省下的是每次调用的字符串拼接与替换。
+@functools.lru_cache(maxsize=1024)
+def _compile(sql: str, backend: str) -> str:
+    """把 `?` 占位符语句编译为目标后端的形式。"""
+    if backend == "mysql":
+        return sql.replace("%", "%%").replace("?", "%s")
+    return sql
+
+
+def _execute(cursor, sql: str, params=()):
+    """编译并执行一条语句，返回游标以便链式取结果。"""
+    cursor.execute(_compile(sql, DB_BACKEND), tuple(params))
+    return cursor
+
+
+def _executemany(cursor, sql: str, rows):
+    """编译并批量执行一条语句（MySQL 的 INSERT 会被 pymysql 合并为多行 VALUES）。"""
+    cursor.executemany(_compile(sql, DB_BACKEND), rows)
+    return cursor
+
+
+@contextlib.contextmanager
+def _cursor(conn, cursor_class=None):
+    """借出一个游标，用完关闭（sqlite3 的游标不支持 with）。"""
+    cursor = conn.cursor(cursor_class) if cursor_class else conn.cursor()
+    try:
+        yield cursor
+    finally:
+        cursor.close()
+
+
+def _rows(cursor) -> list:
+    """取出全部结果行为 dict 列表（MySQL DictCursor 已是 dict，SQLite 的 Row 需转换）。"""
+    rows = cursor.fetchall()
+    if DB_BACKEND == "mysql":
+        return list(rows)
+    return [dict(row) for row in rows]
+
+
+def _row(cursor) -> dict | None:
+    row = cursor.fetchone()
+    return dict(row) if row is not None else None
+
+
+def _in(n: int) -> str:
+    """`IN (...)` 的 n 个占位符。"""
+    return ",".join("?" * n)
+
+
+def _for_update() -> str:
+    """读取并锁定行的后缀：MySQL 为行锁；SQLite 由 `_begin_write` 的库级写锁代替。"""
+    return " FOR UPDATE" if DB_BACKEND == "mysql" else ""
+
+
+def _begin_write(conn, cursor):
+    """SQLite 立即取得写锁（BEGIN IMMEDIATE），保证“先查后写”之间没有其它写入；MySQL 无需显式开始。"""
+    if DB_BACKEND != "mysql" and not conn.in_transaction:
+        cursor.execute("BEGIN IMMEDIATE")
+
+
+def _ago(seconds: float) -> tuple:
+    """“当前时间往前 seconds 秒”的 SQL 表达式及其参数。"""
     if DB_BACKEND == "mysql":
+        return "NOW() - INTERVAL ? SECOND", int(seconds)
+    return "datetime('now', ?)", f"-{int(seconds)} seconds"
+
+
+@functools.lru_cache(maxsize=128)
+def _upsert_sql(table: str, columns: tuple, keys: tuple, backend: str, touch: bool = False, assign: tuple = ()) -> str:
+    """生成“插入，主键冲突时更新其余列”的语句。
+
+    参数:
+        keys: 冲突判定的主键列
+        touch: 冲突更新时同时刷新 updated_at
+        assign: 自定义更新表达式 ((列, 模板), ...)；模板中 {new} 为本次插入的值，{greatest} 为取较大值的函数
+    """
+    mysql = backend == "mysql"
+    custom = dict(assign)
+    sets = []
+    for col in columns:
+        if col in keys:
+            continue
+        new = f"VALUES({col})" if mysql else f"excluded.{col}"
+        template = custom.get(col, "{new}")
+        sets.append(f"{col} = " + template.format(new=new, greatest="GREATEST" if mysql else "MAX"))
+    if touch:
+        sets.append("updated_at = CURRENT_TIMESTAMP")
+    head = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({_in(len(columns))})"
+    if mysql:
+        return f"{head} ON DUPLICATE KEY UPDATE {', '.join(sets)}"
+    return f"{head} ON CONFLICT({', '.join(keys)}) DO UPDATE SET {', '.join(sets)}"
+
+
+@functools.lru_cache(maxsize=64)
+def _bots_update_sql(columns: tuple, where: str, bump: bool = True) -> str:
+    """生成更新 bots 指定列的语句；bump 时同时写入修订号（第一个参数为 rev）。"""
+    assignments = ", ".join(f"{col} = ?" for col in columns)
+    if bump:
+        assignments = "rev = ?, " + assignments
+    return f"UPDATE bots SET {assignments} WHERE {where}"
+
+
+# --- 表结构：版本化迁移 ---
+# 热点查询使用的二级索引：(表, 索引名, 列)
+# - bots: 按 (is_active, bot_role) 列出活跃机器人；按 (created_by, bot_role) 列出运营名下/未认领机器人
+# - bots / bot_tombstones: 按 rev 拉取某修订号之后的变更
+# - user_conversations: 按 updated_at 做过期清理；按 bot_id 的扫描与计数由主键 (bot_id, chat_id) 覆盖
+SECONDARY_INDEXES = [
+    ("bots", "idx_bots_active_role", ("is_active", "bot_role")),
+    ("bots", "idx_bots_creator_role", ("created_by", "bot_role")),
+    ("bots", "idx_bots_rev", ("rev",)),
+    ("bot_tombstones", "idx_bot_tombstones_rev", ("rev",)),
+    ("user_conversations", "idx_user_conversations_updated_at", ("updated_at",)),
+]
+
+# 历史 bots 表可能缺失的列：列名 -> (MySQL 列定义, SQLite 列定义)
+_BOTS_LEGACY_COLUMNS = {
+    "play_url": ("TEXT", "TEXT"),
+    "bot_role": ("VARCHAR(32) NOT NULL DEFAULT 'private'", "TEXT NOT NULL DEFAULT 'private'"),
+    "video_file_id": ("TEXT", "TEXT"),
+    "image_file_id": ("TEXT", "TEXT"),
+    "deposit_file_id": ("TEXT", "TEXT"),
+    "sticker_file_id": ("TEXT", "TEXT"),
+    "first_image_file_id": ("TEXT", "TEXT"),
+    "created_by": ("BIGINT NULL", "INTEGER"),
+}
+
+
+def _first_value(row):
+    """取单列结果的值，兼容 DictCursor(dict) / tuple / sqlite3.Row。"""
+    if row is None:
+        return None
+    if isinstance(row, dict):
+        return next(iter(row.values()))
+    return row[0]
+
+
+def _m001_base_tables(cursor, backend: str):
+    """创建 bots / user_conversations / bot_media_file_ids 基础表。"""
+    if backend == "mysql":
         cursor.execute(
             """
             CREATE TABLE IF NOT EXISTS bots (
@@ -105,52 +1117,6 @@ def initialize_db():
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
             """
         )
-        # 兼容旧表：若缺少 play_url 列则补充
-        try:
-            cursor.execute(
-                """
-                SELECT COUNT(*) FROM information_schema.COLUMNS
-                WHERE TABLE_SCHEMA = %s AND TABLE_NAME = 'bots' AND COLUMN_NAME = 'play_url'
-                """,
-                (MYSQL_DATABASE,)
-            )
-            count = cursor.fetchone()[0]
-            if count == 0:
-                cursor.execute("ALTER TABLE bots ADD COLUMN play_url TEXT")
-        except Exception:
-            pass
-        # 兼容旧表：若缺少 bot_role 列则补充
-        try:
-            cursor.execute(
-                """
-                SELECT COUNT(*) FROM information_schema.COLUMNS
-                WHERE TABLE_SCHEMA = %s AND TABLE_NAME = 'bots' AND COLUMN_NAME = 'bot_role'
-                """,
-                (MYSQL_DATABASE,)
-            )
-            count = cursor.fetchone()[0]
-            if count == 0:
-                cursor.execute("ALTER TABLE bots ADD COLUMN bot_role VARCHAR(32) NOT NULL DEFAULT 'private'")
-        except Exception:
-            pass
-        # 兼容旧表：补充缺失的新列
-        for col, ddl in [
-            ("sticker_file_id", "ALTER TABLE bots ADD COLUMN sticker_file_id TEXT"),
-            ("first_image_file_id", "ALTER TABLE bots ADD COLUMN first_image_file_id TEXT"),
-            ("created_by", "ALTER TABLE bots ADD COLUMN created_by BIGINT NULL"),
-        ]:
-            try:
-                cursor.execute(
-                    """
-                    SELECT COUNT(*) FROM information_schema.COLUMNS
-                    WHERE TABLE_SCHEMA = %s AND TABLE_NAME = 'bots' AND COLUMN_NAME = %s
-                    """,
-                    (MYSQL_DATABASE, col)
-                )
-                if cursor.fetchone()[0] == 0:
-                    cursor.execute(ddl)
-            except Exception:
-                pass
     else:
         cursor.execute(
             """
@@ -174,12 +1140,6 @@ def initialize_db():
             );
             """
         )
-        # 兼容旧表：为缺失的列做补充
-        cursor.execute("PRAGMA table_info('bots');")
-        existing_cols = {row[1] for row in cursor.fetchall()}
-        for col in ("video_file_id", "image_file_id", "deposit_file_id", "play_url", "bot_role", "sticker_file_id", "first_image_file_id", "created_by"):
-            if col not in existing_cols:
-                cursor.execute(f"ALTER TABLE bots ADD COLUMN {col} TEXT")
         # 会话持久化表
         cursor.execute(
             """
@@ -206,154 +1166,885 @@ def initialize_db():
             """
         )
 
-    conn.commit()
-    conn.close()
-    print("数据库初始化完成。")
 
+def _table_columns(cursor, backend: str, table: str) -> set:
+    """返回表的现有列名集合。"""
+    if backend == "mysql":
+        cursor.execute(
+            "SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+            (table,),
+        )
+        return {_first_value(row) for row in cursor.fetchall()}
+    cursor.execute(f"PRAGMA table_info('{table}');")
+    return {row[1] for row in cursor.fetchall()}
 
-# --- 用户会话持久化：CRUD ---
-def get_user_conversation(bot_token: str, chat_id: int):
-    """读取某机器人在某聊天下的会话状态与负载。
 
-    参数:
-        bot_token: 机器人 token
-        chat_id: 用户/会话 chat_id
-    返回:
-        dict | None: {"state": str, "payload_json": str | None}，不存在则返回 None
-    """
-    conn = get_db_connection()
-    try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT state, payload_json FROM user_conversations WHERE bot_token=%s AND chat_id=%s", (bot_token, chat_id))
-                row = cursor.fetchone()
-                return dict(row) if row else None
-        else:
-            cursor = conn.cursor()
-            cursor.execute("SELECT state, payload_json FROM user_conversations WHERE bot_token=? AND chat_id=?", (bot_token, chat_id))
-            row = cursor.fetchone()
-            if row:
-                return {"state": row[0], "payload_json": row[1]}
-            return None
-    finally:
-        conn.close()
+def _m002_bots_legacy_columns(cursor, backend: str):
+    """为早期版本创建的 bots 表补齐后来新增的列（一次性探测）。"""
+    existing = _table_columns(cursor, backend, "bots")
+    for col, (mysql_ddl, sqlite_ddl) in _BOTS_LEGACY_COLUMNS.items():
+        if col not in existing:
+            cursor.execute(f"ALTER TABLE bots ADD COLUMN {col} {mysql_ddl if backend == 'mysql' else sqlite_ddl}")
 
 
-def upsert_user_conversation(bot_token: str, chat_id: int, state: str, payload_json: str | None = None):
-    """插入或更新用户会话记录（幂等 UPSERT）。
+def _create_index(cursor, backend: str, table: str, name: str, cols):
+    """幂等创建索引（MySQL 不支持 IF NOT EXISTS，忽略“索引已存在”错误）。"""
+    if backend == "mysql":
+        try:
+            cursor.execute(f"CREATE INDEX {name} ON {table} ({', '.join(cols)})")
+        except Exception as e:
+            if not (getattr(e, "args", None) and e.args[0] == 1061):  # ER_DUP_KEYNAME
+                raise
+    else:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(cols)})")
 
-    若记录不存在则插入；存在则更新 `state` 与 `payload_json`。
-    """
-    conn = get_db_connection()
-    try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    "INSERT INTO user_conversations (bot_token, chat_id, state, payload_json) VALUES (%s,%s,%s,%s) "
-                    "ON DUPLICATE KEY UPDATE state=VALUES(state), payload_json=VALUES(payload_json)",
-                    (bot_token, chat_id, state, payload_json)
-                )
-                conn.commit()
-        else:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO user_conversations (bot_token, chat_id, state, payload_json) VALUES (?,?,?,?) "
-                "ON CONFLICT(bot_token, chat_id) DO UPDATE SET state=excluded.state, payload_json=excluded.payload_json",
-                (bot_token, chat_id, state, payload_json)
-            )
-            conn.commit()
-    finally:
-        conn.close()
 
+def _m003_secondary_indexes(cursor, backend: str):
+    """热点查询二级索引：bots 的 (is_active, bot_role)、(created_by, bot_role) 与会话的 updated_at。"""
+    _create_index(cursor, backend, "bots", "idx_bots_active_role", ("is_active", "bot_role"))
+    _create_index(cursor, backend, "bots", "idx_bots_creator_role", ("created_by", "bot_role"))
+    _create_index(cursor, backend, "user_conversations", "idx_user_conversations_updated_at", ("updated_at",))
 
-def delete_user_conversation(bot_token: str, chat_id: int):
-    """删除指定机器人在指定 chat 的会话记录。"""
-    conn = get_db_connection()
+
+@contextlib.contextmanager
+def _sqlite_atomic(cursor):
+    """SQLite 迁移中的显式事务：sqlite3 不会为 DDL 隐式开启事务，多步表重建需手动 BEGIN，异常时整体回滚。"""
+    conn = cursor.connection
+    if conn.in_transaction:
+        conn.commit()
+    cursor.execute("BEGIN")
     try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                cursor.execute("DELETE FROM user_conversations WHERE bot_token=%s AND chat_id=%s", (bot_token, chat_id))
-                conn.commit()
-        else:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM user_conversations WHERE bot_token=? AND chat_id=?", (bot_token, chat_id))
-            conn.commit()
-    finally:
-        conn.close()
+        yield
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
 
 
-def list_user_conversations(bot_token: str):
-    """列出某个机器人的所有用户会话记录（用于重启后恢复流程）。"""
-    conn = get_db_connection()
-    try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    "SELECT chat_id, state, payload_json FROM user_conversations WHERE bot_token=%s",
-                    (bot_token,)
-                )
-                return cursor.fetchall()
-        else:
-            cursor = conn.cursor()
+def _m004_bot_id_keys(cursor, backend: str):
+    """user_conversations / bot_media_file_ids 由 bot_token 字符串改为引用 bots.id 的整数键。
+
+    回填 bot_id 后以 (bot_id, chat_id) / (bot_id, media_key) 为新主键并移除 bot_token 列；
+    找不到对应机器人的孤儿行直接丢弃。
+    """
+    if backend == "mysql":
+        for table, key_col in (("user_conversations", "chat_id"), ("bot_media_file_ids", "media_key")):
+            cols = _table_columns(cursor, backend, table)
+            if "bot_token" not in cols:
+                continue
+            if "bot_id" not in cols:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN bot_id INT NULL FIRST")
+            cursor.execute(f"UPDATE {table} t JOIN bots b ON b.bot_token = t.bot_token SET t.bot_id = b.id")
+            cursor.execute(f"DELETE FROM {table} WHERE bot_id IS NULL")
             cursor.execute(
-                "SELECT chat_id, state, payload_json FROM user_conversations WHERE bot_token=?",
-                (bot_token,)
+                f"ALTER TABLE {table} MODIFY bot_id INT NOT NULL, DROP PRIMARY KEY, "
+                f"ADD PRIMARY KEY (bot_id, {key_col}), DROP COLUMN bot_token"
             )
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
-    finally:
-        conn.close()
-
+        return
+    # SQLite 不支持修改主键：建新表 -> 回填 -> 替换；每张表的重建在一个显式事务内完成，失败时整体回滚
+    if "bot_token" in _table_columns(cursor, backend, "user_conversations"):
+        with _sqlite_atomic(cursor):
+            # 旧版本的迁移中途失败可能留下半成品的新表
+            cursor.execute("DROP TABLE IF EXISTS user_conversations_new")
+            cursor.execute(
+                """
+                CREATE TABLE user_conversations_new (
+                    bot_id INTEGER NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    payload_json TEXT,
+                    updated_at TEXT DEFAULT (datetime('now')),
+                    PRIMARY KEY (bot_id, chat_id)
+                );
+                """
+            )
+            cursor.execute(
+                "INSERT INTO user_conversations_new (bot_id, chat_id, state, payload_json, updated_at) "
+                "SELECT b.id, t.chat_id, t.state, t.payload_json, t.updated_at "
+                "FROM user_conversations t JOIN bots b ON b.bot_token = t.bot_token"
+            )
+            cursor.execute("DROP TABLE user_conversations")
+            cursor.execute("ALTER TABLE user_conversations_new RENAME TO user_conversations")
+            _create_index(cursor, backend, "user_conversations", "idx_user_conversations_updated_at", ("updated_at",))
+    if "bot_token" in _table_columns(cursor, backend, "bot_media_file_ids"):
+        with _sqlite_atomic(cursor):
+            cursor.execute("DROP TABLE IF EXISTS bot_media_file_ids_new")
+            cursor.execute(
+                """
+                CREATE TABLE bot_media_file_ids_new (
+                    bot_id INTEGER NOT NULL,
+                    media_key TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    updated_at TEXT DEFAULT (datetime('now')),
+                    PRIMARY KEY (bot_id, media_key)
+                );
+                """
+            )
+            cursor.execute(
+                "INSERT INTO bot_media_file_ids_new (bot_id, media_key, file_id, updated_at) "
+                "SELECT b.id, t.media_key, t.file_id, t.updated_at "
+                "FROM bot_media_file_ids t JOIN bots b ON b.bot_token = t.bot_token"
+            )
+            cursor.execute("DROP TABLE bot_media_file_ids")
+            cursor.execute("ALTER TABLE bot_media_file_ids_new RENAME TO bot_media_file_ids")
 
-def get_active_bots(role: str | None = None):
-    """查询启用状态为激活的机器人列表。
 
-    参数:
-        role: 角色过滤（如 'private' 或 'channel'），None 表示不过滤
-    返回:
-        list: 机器人配置字典列表
-    """
-    conn = get_db_connection()
-    try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                if role:
-                    cursor.execute("SELECT * FROM bots WHERE is_active = 1 AND bot_role = %s", (role,))
-                    return cursor.fetchall()
-                else:
-                    cursor.execute("SELECT * FROM bots WHERE is_active = 1")
-                    return cursor.fetchall()
+def _m005_bot_user_stats(cursor, backend: str):
+    """每个机器人的引流人数计数表（随会话写入维护），并按现有会话回填。"""
+    if backend == "mysql":
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bot_user_stats (
+                bot_id INT NOT NULL PRIMARY KEY,
+                user_count INT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """
+        )
+        cursor.execute(
+            "INSERT INTO bot_user_stats (bot_id, user_count) "
+            "SELECT bot_id, COUNT(*) FROM user_conversations GROUP BY bot_id "
+            "ON DUPLICATE KEY UPDATE user_count = VALUES(user_count)"
+        )
+    else:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bot_user_stats (
+                bot_id INTEGER NOT NULL PRIMARY KEY,
+                user_count INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT DEFAULT (datetime('now'))
+            );
+            """
+        )
+        cursor.execute(
+            "INSERT OR REPLACE INTO bot_user_stats (bot_id, user_count) "
+            "SELECT bot_id, COUNT(*) FROM user_conversations GROUP BY bot_id"
+        )
+
+
+def _m006_bots_revision(cursor, backend: str):
+    """bots 变更检测：每行的修订号 rev、全局修订号单行表，以及已删除机器人的墓碑表。"""
+    if "rev" not in _table_columns(cursor, backend, "bots"):
+        cursor.execute(f"ALTER TABLE bots ADD COLUMN rev {'BIGINT' if backend == 'mysql' else 'INTEGER'} NOT NULL DEFAULT 0")
+    _create_index(cursor, backend, "bots", "idx_bots_rev", ("rev",))
+    if backend == "mysql":
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bots_revision (
+                id TINYINT NOT NULL PRIMARY KEY,
+                rev BIGINT NOT NULL DEFAULT 0
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """
+        )
+        cursor.execute("INSERT IGNORE INTO bots_revision (id, rev) VALUES (1, 0)")
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bot_tombstones (
+                bot_id INT NOT NULL PRIMARY KEY,
+                bot_token VARCHAR(255) NOT NULL,
+                rev BIGINT NOT NULL,
+                deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """
+        )
+    else:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bots_revision (
+                id INTEGER NOT NULL PRIMARY KEY,
+                rev INTEGER NOT NULL DEFAULT 0
+            );
+            """
+        )
+        cursor.execute("INSERT OR IGNORE INTO bots_revision (id, rev) VALUES (1, 0)")
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bot_tombstones (
+                bot_id INTEGER NOT NULL PRIMARY KEY,
+                bot_token TEXT NOT NULL,
+                rev INTEGER NOT NULL,
+                deleted_at TEXT DEFAULT (datetime('now'))
+            );
+            """
+        )
+    _create_index(cursor, backend, "bot_tombstones", "idx_bot_tombstones_rev", ("rev",))
+
+
+def _m007_bot_persistence(cursor, backend: str):
+    """PTB 持久化数据按键存储：(bot_id, 类别, 键) -> pickle 后的值。"""
+    if backend == "mysql":
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bot_persistence (
+                bot_id INT NOT NULL,
+                kind VARCHAR(64) NOT NULL,
+                pkey VARCHAR(191) NOT NULL,
+                value MEDIUMBLOB NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                PRIMARY KEY (bot_id, kind, pkey)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """
+        )
+    else:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bot_persistence (
+                bot_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                pkey TEXT NOT NULL,
+                value BLOB NOT NULL,
+                updated_at TEXT DEFAULT (datetime('now')),
+                PRIMARY KEY (bot_id, kind, pkey)
+            );
+            """
+        )
+
+
+# 有序迁移列表：(版本号, 说明, 迁移函数)。只可追加，不可修改已发布的条目。
+SCHEMA_MIGRATIONS = [
+    (1, "基础表 bots / user_conversations / bot_media_file_ids", _m001_base_tables),
+    (2, "补齐历史 bots 表缺失的列", _m002_bots_legacy_columns),
+    (3, "热点查询二级索引", _m003_secondary_indexes),
+    (4, "会话与媒体映射表改用整数 bot_id 键", _m004_bot_id_keys),
+    (5, "机器人引流人数计数表", _m005_bot_user_stats),
+    (6, "bots 修订号与删除墓碑", _m006_bots_revision),
+    (7, "PTB 持久化数据表", _m007_bot_persistence),
+]
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn, backend: str = DB_BACKEND) -> int | None:
+    """读取已应用的最高迁移版本；`schema_version` 表不存在时返回 None。"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MAX(version) FROM schema_version")
+        value = _first_value(cursor.fetchone())
+        return int(value) if value is not None else 0
+    except Exception:
+        conn.rollback()
+        return None
+
+
+def apply_migrations(conn, backend: str = DB_BACKEND) -> list[int]:
+    """按顺序应用尚未执行的迁移，每条迁移成功后立即记录版本，返回本次应用的版本号列表。
+
+    表结构已是最新时只花费一次查询（`SELECT MAX(version)`）。
+    """
+    current = get_schema_version(conn, backend)
+    if current is not None and current >= SCHEMA_VERSION:
+        return []
+    cursor = conn.cursor()
+    if current is None:
+        if backend == "mysql":
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT PRIMARY KEY,
+                    description VARCHAR(255) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+                """
+            )
         else:
-            cursor = conn.cursor()
-            if role:
-                cursor.execute("SELECT * FROM bots WHERE is_active = 1 AND bot_role = ?", (role,))
-                rows = cursor.fetchall()
-                return [dict(row) for row in rows]
-            else:
-                cursor.execute("SELECT * FROM bots WHERE is_active = 1")
-                rows = cursor.fetchall()
-                return [dict(row) for row in rows]
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TEXT DEFAULT (datetime('now'))
+                );
+                """
+            )
+        conn.commit()
+        current = 0
+    applied = []
+    for version, description, migrate in SCHEMA_MIGRATIONS:
+        if version <= current:
+            continue
+        migrate(cursor, backend)
+        cursor.execute(
+            _compile("INSERT INTO schema_version (version, description) VALUES (?, ?)", backend),
+            (version, description),
+        )
+        conn.commit()
+        applied.append(version)
+    return applied
+
+
+def initialize_db():
+    """初始化数据库：按 `SCHEMA_MIGRATIONS` 创建或升级表结构（支持 MySQL / SQLite）。
+
+    - 通过 `schema_version` 表记录已应用的迁移，每条迁移只执行一次。
+    - 表结构已是最新时只需一次查询，不再逐列探测 information_schema / PRAGMA。
+    """
+    conn = get_db_connection()
+    try:
+        applied = apply_migrations(conn)
+    finally:
+        conn.close()
+    if applied:
+        print(f"数据库初始化完成，已应用迁移: {applied}（当前版本 {SCHEMA_VERSION}）。")
+    else:
+        print("数据库初始化完成。")
+
+
+# --- bot_token -> bots.id 映射 ---
+# 会话与媒体表以整数 bot_id 为键，对外 API 仍接收 bot_token；token 与 id 一一对应且不会变化，
+# 解析结果常驻内存，只有删除机器人时移除。
+_bot_ids = {}
+_bot_ids_lock = threading.Lock()
+
+
+def _resolve_bot_ids(tokens) -> dict:
+    """把一组 bot_token 解析为 {bot_token: bots.id}；未命中缓存的用一次 `IN (...)` 查询补齐，不存在的 token 不出现在结果中。"""
+    tokens = list(dict.fromkeys(tokens))
+    with _bot_ids_lock:
+        resolved = {t: _bot_ids[t] for t in tokens if t in _bot_ids}
+    missing = [t for t in tokens if t not in resolved]
+    if not missing:
+        return resolved
+    conn = get_db_connection()
+    try:
+        with _cursor(conn) as cursor:
+            _execute(cursor, f"SELECT id, bot_token FROM bots WHERE bot_token IN ({_in(len(missing))})", missing)
+            found = {row["bot_token"]: row["id"] for row in cursor.fetchall()}
+    finally:
+        conn.close()
+    with _bot_ids_lock:
+        _bot_ids.update(found)
+    resolved.update(found)
+    return resolved
+
+
+def _resolve_bot_id(bot_token: str) -> int | None:
+    return _resolve_bot_ids([bot_token]).get(bot_token)
+
+
+def _forget_bot_id(bot_token: str):
+    with _bot_ids_lock:
+        _bot_ids.pop(bot_token, None)
+
+
+# --- 用户会话持久化：写后合并（write-behind） ---
+_CONV_DELETE = object()
+
+
+class _ConversationWriteBehind:
+    """用户会话写入的后台合并队列。
+
+    - 同一 `(bot_token, chat_id)` 的多次写入只保留最后一次（upsert 或 delete）；落库时再解析为 bot_id
+    - 后台线程每 `interval` 秒，或积压达到 `max_batch` 条时，用 `executemany` 批量提交
+    - `lookup()` 提供读己之写：尚未落库的写入对 `get_user_conversation` 立即可见
+    - `close()` 在退出时把剩余写入全部落库
+    """
+
+    def __init__(self, interval: float, max_batch: int):
+        self.interval = interval
+        self.max_batch = max(1, max_batch)
+        self._pending = {}  # (bot_token, chat_id) -> (state, payload_json) | _CONV_DELETE
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._closed = False
+        self.enqueued = 0
+        self.coalesced = 0
+        self.flushed_rows = 0
+        self.batches = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0 and not self._closed
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = value
+            self.enqueued += 1
+            backlog = len(self._pending)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="conv-write-behind", daemon=True)
+                self._thread.start()
+        if backlog >= self.max_batch:
+            self._wake.set()
+
+    def lookup(self, key):
+        """返回 (是否命中, 值)；值为 `_CONV_DELETE` 表示已排队删除。"""
+        with self._lock:
+            if key in self._pending:
+                return True, self._pending[key]
+            if key in self._inflight:
+                return True, self._inflight[key]
+        return False, None
+
+    def has_pending(self) -> bool:
+        with self._lock:
+            return bool(self._pending or self._inflight)
+
+    def flush(self) -> int:
+        """把当前积压一次性落库，返回写入的键数量。"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._inflight = batch
+            if not batch:
+                return 0
+            # 队列自行提交，不并入调用线程所处的会话
+            token = _session_var.set(None)
+            try:
+                _write_conversation_batch(batch)
+            except Exception as e:
+                with self._lock:
+                    # 落库失败：放回队列等待下次重试，期间的新写入优先
+                    for key, value in batch.items():
+                        self._pending.setdefault(key, value)
+                    self.errors += 1
+                logger.error(f"会话批量写入失败，将在下个周期重试: {e}")
+                return 0
+            finally:
+                _session_var.reset(token)
+                with self._lock:
+                    self._inflight = {}
+            with self._lock:
+                self.flushed_rows += len(batch)
+                self.batches += 1
+            return len(batch)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=5)
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "enqueued": self.enqueued,
+                "coalesced": self.coalesced,
+                "flushed_rows": self.flushed_rows,
+                "batches": self.batches,
+                "errors": self.errors,
+            }
+
+
+_STATS_KEY_CHUNK = 400
+
+
+def _existing_conversation_keys(cursor, pairs) -> set:
+    """返回 pairs 中已存在于 user_conversations 的 (bot_id, chat_id)（MySQL 下同时加锁，防止并发写入重复计数）。"""
+    existing = set()
+    for start in range(0, len(pairs), _STATS_KEY_CHUNK):
+        chunk = pairs[start:start + _STATS_KEY_CHUNK]
+        _execute(
+            cursor,
+            "SELECT bot_id, chat_id FROM user_conversations "
+            f"WHERE (bot_id, chat_id) IN ({','.join(['(?,?)'] * len(chunk))}){_for_update()}",
+            [v for pair in chunk for v in pair],
+        )
+        existing.update((row["bot_id"], row["chat_id"]) for row in cursor.fetchall())
+    return existing
+
+
+def _apply_user_stats_delta(cursor, delta: dict):
+    """把 {bot_id: 增量} 累加进 bot_user_stats（与会话写入同一事务）。"""
+    rows = [(bot_id, n) for bot_id, n in delta.items() if n]
+    if not rows:
+        return
+    sql = _upsert_sql(
+        "bot_user_stats", ("bot_id", "user_count"), ("bot_id",), DB_BACKEND,
+        touch=True, assign=(("user_count", "{greatest}(user_count + {new}, 0)"),),
+    )
+    _executemany(cursor, sql, rows)
+
+
+def _write_conversation_batch(batch: dict):
+    """在同一事务中批量落库会话写入：upsert 与 delete 各一次 `executemany`。
+
+    键中的 bot_token 在此统一解析为 bot_id；已不存在的机器人对应的写入直接丢弃。
+    写入前先查出批内已存在的键，据此在同一事务里维护 `bot_user_stats` 的引流人数。
+    """
+    bot_ids = _resolve_bot_ids(k[0] for k in batch)
+    unknown = {k[0] for k in batch} - bot_ids.keys()
+    if unknown:
+        logger.warning(f"丢弃 {len(unknown)} 个已不存在机器人的会话写入")
+    upserts = [(bot_ids[k[0]], k[1], v[0], v[1]) for k, v in batch.items() if v is not _CONV_DELETE and k[0] in bot_ids]
+    deletes = [(bot_ids[k[0]], k[1]) for k, v in batch.items() if v is _CONV_DELETE and k[0] in bot_ids]
+    if not upserts and not deletes:
+        return
+    pairs = [(row[0], row[1]) for row in upserts] + deletes
+
+    def stats_delta(existing: set) -> dict:
+        delta = collections.Counter()
+        for bot_id, chat_id, _, _ in upserts:
+            if (bot_id, chat_id) not in existing:
+                delta[bot_id] += 1
+        for bot_id, chat_id in deletes:
+            if (bot_id, chat_id) in existing:
+                delta[bot_id] -= 1
+        return delta
+
+    conn = get_db_connection()
+    try:
+        with _cursor(conn) as cursor:
+            # 保证“查已存在键 -> 写入 -> 计数”期间没有其它写入插入同一键
+            _begin_write(conn, cursor)
+            delta = stats_delta(_existing_conversation_keys(cursor, pairs))
+            if upserts:
+                sql = _upsert_sql(
+                    "user_conversations", ("bot_id", "chat_id", "state", "payload_json"), ("bot_id", "chat_id"),
+                    DB_BACKEND, touch=True,
+                )
+                _executemany(cursor, sql, upserts)
+            if deletes:
+                _executemany(cursor, "DELETE FROM user_conversations WHERE bot_id = ? AND chat_id = ?", deletes)
+            _apply_user_stats_delta(cursor, delta)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+_conv_writer = _ConversationWriteBehind(CONV_FLUSH_INTERVAL, CONV_FLUSH_BATCH)
+atexit.register(_conv_writer.close)
+
+
+def flush_conversation_writes() -> int:
+    """立即把排队中的会话写入落库，返回写入的键数量。"""
+    return _conv_writer.flush()
+
+
+def close_conversation_writer():
+    """停止后台写入线程并落库剩余写入（进程退出时调用），之后的写入改为同步执行。"""
+    _conv_writer.close()
+
+
+def get_conversation_writer_stats() -> dict:
+    """返回会话写后合并队列的积压、合并次数、批次数等指标。"""
+    return _conv_writer.stats()
+
+
+# --- 用户会话持久化：CRUD ---
+def get_user_conversation(bot_token: str, chat_id: int):
+    """读取某机器人在某聊天下的会话状态与负载（含尚未落库的排队写入）。
+
+    参数:
+        bot_token: 机器人 token
+        chat_id: 用户/会话 chat_id
+    返回:
+        dict | None: {"state": str, "payload_json": str | None}，不存在则返回 None
+    """
+    found, value = _lookup_queued_conversation((bot_token, chat_id))
+    if found:
+        if value is _CONV_DELETE:
+            return None
+        return {"state": value[0], "payload_json": value[1]}
+    bot_id = _resolve_bot_id(bot_token)
+    if bot_id is None:
+        return None
+    conn = get_db_connection()
+    try:
+        with _cursor(conn) as cursor:
+            _execute(cursor, "SELECT state, payload_json FROM user_conversations WHERE bot_id = ? AND chat_id = ?", (bot_id, chat_id))
+            return _row(cursor)
+    finally:
+        conn.close()
+
+
+def _lookup_queued_conversation(key):
+    """在当前会话与写后合并队列中查找尚未落库的写入，返回 (是否命中, 值)。"""
+    unit = _session_var.get()
+    if unit is not None:
+        found, value = unit.lookup_conversation(key)
+        if found:
+            return found, value
+    return _conv_writer.lookup(key)
+
+
+def _queue_conversation(key, value):
+    """写后合并开启时入队（处于会话中则在会话提交后入队）；关闭时同步写入（处于会话中则并入会话事务）。"""
+    if not _conv_writer.enabled:
+        _write_conversation_batch({key: value})
+        return
+    unit = _session_var.get()
+    if unit is None:
+        _conv_writer.put(key, value)
+    else:
+        unit.queue_conversation(key, value)
+
+
+def upsert_user_conversation(bot_token: str, chat_id: int, state: str, payload_json: str | None = None):
+    """插入或更新用户会话记录（幂等 UPSERT）。
+
+    默认进入写后合并队列，由后台批量落库；写后合并关闭时同步写入。
+    """
+    _queue_conversation((bot_token, chat_id), (state, payload_json))
+
+
+def delete_user_conversation(bot_token: str, chat_id: int):
+    """删除指定机器人在指定 chat 的会话记录（与 upsert 同样走写后合并队列）。"""
+    _queue_conversation((bot_token, chat_id), _CONV_DELETE)
+
+
+def list_user_conversations(bot_token: str):
+    """列出某个机器人的所有用户会话记录（用于重启后恢复流程）。"""
+    if _conv_writer.has_pending():
+        _conv_writer.flush()
+    bot_id = _resolve_bot_id(bot_token)
+    if bot_id is None:
+        return []
+    conn = get_db_connection()
+    try:
+        with _cursor(conn) as cursor:
+            _execute(cursor, "SELECT chat_id, state, payload_json FROM user_conversations WHERE bot_id = ?", (bot_id,))
+            return _rows(cursor)
+    finally:
+        conn.close()
+
+
+def iter_resumable_conversations(role: str = "private", states=None, batch_size: int = 500):
+    """流式遍历所有活跃机器人处于 `AWAITING_*` 阶段的会话，按批产出 [(bot_token, chat_id, state), ...]。
+
+    一条查询覆盖全部机器人，按 (bot_id, chat_id) 主键顺序返回，同一机器人的会话连续出现；
+    MySQL 使用服务端游标（SSCursor），SQLite 使用游标迭代，内存占用只与 `batch_size` 有关。
+    生成器持有一个连接直到耗尽或关闭，必须在同一线程内消费（异步侧请用
+    `async for batch in database.aio.iter_resumable_conversations(...)`）。
+
+    参数:
+        role: 机器人角色过滤
+        states: 需要恢复的阶段集合，None 表示全部 `AWAITING_*`
+        batch_size: 每批行数
+    """
+    if _conv_writer.has_pending():
+        _conv_writer.flush()
+    sql = (
+        "SELECT b.bot_token, c.chat_id, c.state FROM user_conversations c "
+        "JOIN bots b ON b.id = c.bot_id "
+        "WHERE b.is_active = 1 AND b.bot_role = ? "
+    )
+    params = [role]
+    if states:
+        states = list(states)
+        sql += f"AND c.state IN ({_in(len(states))}) "
+        params.extend(states)
+    else:
+        sql += "AND c.state LIKE 'AWAITING%' "
+    sql += "ORDER BY c.bot_id, c.chat_id"
+    conn = get_db_connection()
+    try:
+        with _cursor(conn, SSCursor if DB_BACKEND == "mysql" else None) as cursor:
+            _execute(cursor, sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [(row[0], row[1], row[2]) for row in rows]
+    finally:
+        conn.close()
+
+
+# --- 用户会话持久化：过期清理 ---
+_sweep_lock = threading.Lock()
+_sweep_stats = {"runs": 0, "deleted_total": 0, "last_deleted": 0, "last_seconds": 0.0}
+
+
+def _sweep_chunk(max_age_seconds: float, chunk_size: int) -> int:
+    """在一个短事务中删除最旧的一批过期会话，并同步扣减 bot_user_stats；返回删除行数。"""
+    cutoff, age = _ago(max_age_seconds)
+    conn = get_db_connection()
+    try:
+        with _cursor(conn) as cursor:
+            _begin_write(conn, cursor)
+            # 按 updated_at 索引取最旧的一批（MySQL 同时加锁），避免与并发写入交错
+            _execute(
+                cursor,
+                f"SELECT bot_id, chat_id FROM user_conversations WHERE updated_at < {cutoff} "
+                f"ORDER BY updated_at LIMIT ?{_for_update()}",
+                (age, chunk_size),
+            )
+            keys = [(row["bot_id"], row["chat_id"]) for row in cursor.fetchall()]
+            if keys:
+                _executemany(cursor, "DELETE FROM user_conversations WHERE bot_id = ? AND chat_id = ?", keys)
+                _apply_user_stats_delta(cursor, {k: -n for k, n in collections.Counter(b for b, _ in keys).items()})
+        conn.commit()
+        return len(keys)
+    finally:
+        conn.close()
+
+
+def sweep_stale_conversations(max_age_seconds: float, chunk_size: int = 500, pause: float = 0.0, max_chunks: int | None = None) -> int:
+    """删除 `updated_at` 早于 `max_age_seconds` 秒前的会话记录，返回删除的总行数。
+
+    - 沿 `idx_user_conversations_updated_at` 每次只取最旧的 `chunk_size` 行，在独立的短事务中删除，
+      不会长时间持有锁；批与批之间停顿 `pause` 秒，给在线写入让路
+    - 被删会话同步从 `bot_user_stats` 扣减，计数始终等于表内行数
+    - 同一进程内同时只运行一个清理
+    """
+    if max_age_seconds <= 0:
+        return 0
+    if not _sweep_lock.acquire(blocking=False):
+        return 0
+    started = time.perf_counter()
+    total = 0
+    chunks = 0
+    try:
+        while max_chunks is None or chunks < max_chunks:
+            deleted = _sweep_chunk(max_age_seconds, chunk_size)
+            total += deleted
+            chunks += 1
+            if deleted < chunk_size:
+                break
+            if pause > 0:
+                time.sleep(pause)
+    finally:
+        elapsed = time.perf_counter() - started
+        _sweep_stats["runs"] += 1
+        _sweep_stats["deleted_total"] += total
+        _sweep_stats["last_deleted"] = total
+        _sweep_stats["last_seconds"] = round(elapsed, 3)
+        _sweep_lock.release()
+    return total
+
+
+def get_sweeper_stats() -> dict:
+    """返回会话过期清理的累计运行次数、删除行数与最近一次的结果。"""
+    return dict(_sweep_stats)
+
+
+@_cached_bot_read
+def get_active_bots(role: str | None = None):
+    """查询启用状态为激活的机器人列表。
+
+    参数:
+        role: 角色过滤（如 'private' 或 'channel'），None 表示不过滤
+    返回:
+        list[BotConfig]: 机器人配置记录列表
+    """
+    where = " WHERE is_active = 1"
+    params = ()
+    if role:
+        where += " AND bot_role = ?"
+        params = (role,)
+    conn = get_db_connection(readonly=True)
+    try:
+        return _select_bots(conn, where, params)
     finally:
         conn.close()
 
 
 def get_all_bots():
     """返回数据库中所有机器人（无论激活状态）。"""
+    conn = get_db_connection(readonly=True)
+    try:
+        return _select_bots(conn)
+    finally:
+        conn.close()
+
+
+# --- bots 变更检测 ---
+# 每个修改 bots 的函数在同一事务内把 bots_revision 的全局修订号加一，并把新值写入受影响行的 rev；
+# 删除时先把机器人写入 bot_tombstones。MySQL 上修订号行锁持有到提交，因此修订号按提交顺序递增：
+# 读到修订号 N 时，所有 rev <= N 的变更都已可见。轮询方只需比较一个整数，变化时再拉取增量。
+def _next_bots_revision(cursor) -> int:
+    """在当前事务内把全局修订号加一并返回新值。"""
+    if DB_BACKEND == "mysql":
+        cursor.execute("UPDATE bots_revision SET rev = LAST_INSERT_ID(rev + 1) WHERE id = 1")
+        cursor.execute("SELECT LAST_INSERT_ID()")
+    else:
+        cursor.execute("UPDATE bots_revision SET rev = rev + 1 WHERE id = 1")
+        cursor.execute("SELECT rev FROM bots_revision WHERE id = 1")
+    return int(_first_value(cursor.fetchone()))
+
+
+def _bury_bots(cursor, where: str, params, rev: int):
+    """删除前把命中 `where` 的机器人写入墓碑表（同一 id 已有墓碑时覆盖）。"""
+    if DB_BACKEND == "mysql":
+        sql = (
+            f"INSERT INTO bot_tombstones (bot_id, bot_token, rev) SELECT id, bot_token, ? FROM bots WHERE {where} "
+            "ON DUPLICATE KEY UPDATE bot_token = VALUES(bot_token), rev = VALUES(rev), deleted_at = CURRENT_TIMESTAMP"
+        )
+    else:
+        sql = f"INSERT OR REPLACE INTO bot_tombstones (bot_id, bot_token, rev) SELECT id, bot_token, ? FROM bots WHERE {where}"
+    _execute(cursor, sql, (rev, *params))
+
+
+def get_bots_revision() -> int:
+    """返回 bots 表的全局修订号（单行主键读取）；任何新增、修改、删除都会使其增大。"""
     conn = get_db_connection()
     try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT * FROM bots")
-                return cursor.fetchall()
-        else:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM bots")
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+        with _cursor(conn) as cursor:
+            value = _first_value(_execute(cursor, "SELECT rev FROM bots_revision WHERE id = 1").fetchone())
+        return int(value or 0)
+    finally:
+        conn.close()
+
+
+def get_active_bots_with_revision(role: str | None = None) -> dict:
+    """在主库的同一事务内读取 bots 修订号与活跃机器人（不走配置缓存与只读副本），作为增量轮询的起点。
+
+    先读修订号：返回的机器人行不早于该修订号（MySQL 上两次读取处于同一一致性快照），
+    之后以 `get_bots_changed_since(rev)` 增量同步不会漏掉变更。
+
+    返回:
+        dict: {"rev": 修订号, "bots": list[BotConfig]}
+    """
+    where = " WHERE is_active = 1"
+    params = ()
+    if role:
+        where += " AND bot_role = ?"
+        params = (role,)
+    conn = get_db_connection()
+    try:
+        with _cursor(conn) as cursor:
+            rev = int(_first_value(_execute(cursor, "SELECT rev FROM bots_revision WHERE id = 1").fetchone()) or 0)
+        return {"rev": rev, "bots": _select_bots(conn, where, params)}
     finally:
         conn.close()
 
 
+def get_bots_changed_since(rev: int, role: str | None = None) -> dict:
+    """拉取修订号 `rev` 之后的 bots 变更。
+
+    返回:
+        dict: {"rev": 本次快照的修订号, "changed": 新增或修改的机器人（完整行）,
+               "deleted": [{"id", "bot_token", "rev"}]}
+        下次以返回的 "rev" 继续轮询。应先应用 deleted 再应用 changed：同一 token 删除后重新添加时，
+        两者会同时出现在一次增量里。role 只过滤 changed；被改成其他角色的机器人不会出现在结果中，
+        调用方若按角色维护集合，应传 role=None 自行判断。
+    """
+    conn = get_db_connection()
+    try:
+        with _cursor(conn) as cursor:
+            current = int(_first_value(_execute(cursor, "SELECT rev FROM bots_revision WHERE id = 1").fetchone()) or 0)
+            if current <= rev:
+                return {"rev": current, "changed": [], "deleted": []}
+            where = " WHERE rev > ? AND rev <= ?"
+            params = [rev, current]
+            if role:
+                where += " AND bot_role = ?"
+                params.append(role)
+            changed = _select_bots(conn, where + " ORDER BY rev", params)
+            deleted = _rows(_execute(
+                cursor,
+                "SELECT bot_id AS id, bot_token, rev FROM bot_tombstones WHERE rev > ? AND rev <= ? ORDER BY rev",
+                (rev, current),
+            ))
+        return {"rev": current, "changed": changed, "deleted": deleted}
+    finally:
+        conn.close()
+
+
+@_invalidates_bots
 def add_bot(agent_name: str, token: str, reg_link: str, channel_link: str = None, play_url: str | None = None, video_url: str = None, image_url: str = None, bot_role: str = 'private', created_by: int | None = None):
     """新增一个机器人配置并返回其完整记录。
 
@@ -361,33 +2052,50 @@ def add_bot(agent_name: str, token: str, reg_link: str, channel_link: str = None
     """
     conn = get_db_connection()
     try:
-        if DB_BACKEND == "mysql":
-            try:
-                with conn.cursor() as cursor:
-                    sql = (
-                        "INSERT INTO bots (agent_name, bot_token, registration_link, channel_link, play_url, video_url, image_url, bot_role, created_by) "
-                        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"
-                    )
-                    cursor.execute(sql, (agent_name, token, reg_link, channel_link, play_url, video_url, image_url, bot_role, created_by))
-                    conn.commit()
-                    bot_id = cursor.lastrowid
-                    return get_bot_by_id(bot_id)
-            except Exception:
-                return None
-        else:
-            cursor = conn.cursor()
-            sql = (
-                "INSERT INTO bots (agent_name, bot_token, registration_link, channel_link, play_url, video_url, image_url, bot_role, created_by) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        with _cursor(conn) as cursor:
+            rev = _next_bots_revision(cursor)
+            _execute(
+                cursor,
+                "INSERT INTO bots (agent_name, bot_token, registration_link, channel_link, play_url, video_url, image_url, bot_role, created_by, rev) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (agent_name, token, reg_link, channel_link, play_url, video_url, image_url, bot_role, created_by, rev),
             )
-            cursor.execute(sql, (agent_name, token, reg_link, channel_link, play_url, video_url, image_url, bot_role, created_by))
-            conn.commit()
             bot_id = cursor.lastrowid
-            return get_bot_by_id(bot_id)
+        conn.commit()
+    except Exception as e:
+        logger.warning(f"新增机器人失败: {e}")
+        conn.rollback()
+        return None
     finally:
         conn.close()
+    return get_bot_by_id(bot_id)
+
 
+def _update_bots(fields: dict, where: str, params, bump: bool = True) -> int:
+    """在一个事务内推进修订号并更新命中 `where` 的 bots 行的 `fields`，返回受影响行数。
 
+    没有命中任何行时回滚，修订号不变。bump=False 时不推进修订号、也不取修订号行锁
+    （用于变更检测的消费方不关心的列，如媒体 file_id 回填）；此时 MySQL 上值未变化的行不计入返回值。
+    """
+    conn = get_db_connection()
+    try:
+        with _cursor(conn) as cursor:
+            if bump:
+                rev = _next_bots_revision(cursor)
+                _execute(cursor, _bots_update_sql(tuple(fields), where), (rev, *fields.values(), *params))
+            else:
+                _execute(cursor, _bots_update_sql(tuple(fields), where, bump=False), (*fields.values(), *params))
+            count = cursor.rowcount
+            if count:
+                conn.commit()
+            else:
+                conn.rollback()
+            return count
+    finally:
+        conn.close()
+
+
+@_invalidates_bots
 def update_bot_file_ids(
     token: str,
     video_file_id: str | None = None,
@@ -396,426 +2104,957 @@ def update_bot_file_ids(
     sticker_file_id: str | None = None,
     first_image_file_id: str | None = None,
 ):
-    """按需更新某个机器人的媒体 file_id 字段。不会覆盖为 None 的字段。"""
+    """按需更新某个机器人的媒体 file_id 字段。不会覆盖为 None 的字段。
+
+    file_id 回填是高频写入，不推进 bots 修订号（变更检测的消费方不需要它们）；
+    本地机队快照经媒体写入计数得知变化。
+    """
+    values = {
+        "video_file_id": video_file_id,
+        "image_file_id": image_file_id,
+        "deposit_file_id": deposit_file_id,
+        "sticker_file_id": sticker_file_id,
+        "first_image_file_id": first_image_file_id,
+    }
+    fields = {col: value for col, value in values.items() if value is not None}
+    if not fields:
+        return False
+    updated = _update_bots(fields, "bot_token = ?", (token,), bump=False) > 0
+    if updated:
+        _after_commit(_media_cache.touch)
+    return updated
+
+
+@_invalidates_bots
+def update_play_url(token: str, play_url: str) -> bool:
+    """更新指定机器人的 play_url。返回是否成功。"""
+    return _update_bots({"play_url": play_url}, "bot_token = ?", (token,)) > 0
+
+
+@_invalidates_bots
+def update_registration_link(token: str, registration_link: str) -> bool:
+    """更新指定机器人的 registration_link。返回是否成功。"""
+    return _update_bots({"registration_link": registration_link}, "bot_token = ?", (token,)) > 0
+
+
+# --- 通用媒体 file_id 映射：进程内缓存 ---
+class _MediaFileIdCache:
+    """按机器人维护 `bot_media_file_ids` 的内存映射：{bot_token: {media_key: file_id | None}}。
+
+    值为 None 表示已确认数据库中不存在（负缓存），避免对缺失键反复查询；
+    `upsert_media_file_id` / `delete_media_file_id` 落库后同步更新映射。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_bot = {}
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0  # 媒体落库变更计数（set / drop_bot / touch），供本地快照判断是否需要重写
+
+    def lookup(self, bot_token: str, keys):
+        """返回 (已知的映射, 未知的键列表)。"""
+        known = {}
+        unknown = []
+        with self._lock:
+            bot_map = self._by_bot.get(bot_token) or {}
+            for key in keys:
+                if key in bot_map:
+                    known[key] = bot_map[key]
+                else:
+                    unknown.append(key)
+            self.hits += len(known)
+            self.misses += len(unknown)
+        return known, unknown
+
+    def fill(self, bot_token: str, queried_keys, found: dict):
+        with self._lock:
+            bot_map = self._by_bot.setdefault(bot_token, {})
+            for key in queried_keys:
+                bot_map[key] = found.get(key)
+
+    def replace(self, bot_token: str, mapping: dict):
+        """用一份完整映射（来自快照或整表读取）替换该机器人已知的键。"""
+        with self._lock:
+            self._by_bot[bot_token] = dict(mapping)
+
+    def set(self, bot_token: str, media_key: str, file_id: str | None):
+        with self._lock:
+            self._by_bot.setdefault(bot_token, {})[media_key] = file_id
+            self.writes += 1
+
+    def drop_bot(self, bot_token: str):
+        with self._lock:
+            self._by_bot.pop(bot_token, None)
+            self.writes += 1
+
+    def touch(self):
+        """记一次不经本映射的媒体写入（bots 表上的 file_id 列）。"""
+        with self._lock:
+            self.writes += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "bots": len(self._by_bot),
+                "keys": sum(len(m) for m in self._by_bot.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+            }
+
+
+_media_cache = _MediaFileIdCache()
+
+
+def get_media_cache_stats() -> dict:
+    """返回媒体 file_id 内存映射的规模与命中指标。"""
+    return _media_cache.stats()
+
+
+# --- 通用媒体 file_id 映射：CRUD ---
+def get_cached_media_file_ids(bot_token: str, keys) -> dict | None:
+    """仅查内存映射、不访问数据库（可直接在事件循环中调用）。
+
+    所有键均已知时返回 {media_key: file_id}（只含存在的键）；有未知键时返回 None，
+    调用方应改用 `get_media_file_ids` 回源。
+    """
+    known, unknown = _media_cache.lookup(bot_token, keys)
+    if unknown:
+        return None
+    return {k: v for k, v in known.items() if v}
+
+
+def get_media_file_ids(bot_token: str, keys) -> dict:
+    """批量读取某个机器人多个 media_key 的 file_id，返回 {media_key: file_id}（只含存在的键）。
+
+    先查内存映射；未知的键用一次 `IN (...)` 查询补齐并回填映射（含负缓存）。
+    """
+    keys = list(dict.fromkeys(keys))
+    known, unknown = _media_cache.lookup(bot_token, keys)
+    bot_id = _resolve_bot_id(bot_token) if unknown else None
+    if unknown and bot_id is None:
+        _media_cache.fill(bot_token, unknown, {})
+    elif unknown:
+        conn = get_db_connection()
+        try:
+            with _cursor(conn) as cursor:
+                _execute(
+                    cursor,
+                    f"SELECT media_key, file_id FROM bot_media_file_ids WHERE bot_id = ? AND media_key IN ({_in(len(unknown))})",
+                    (bot_id, *unknown),
+                )
+                found = {row["media_key"]: row["file_id"] for row in cursor.fetchall()}
+        finally:
+            conn.close()
+        _media_cache.fill(bot_token, unknown, found)
+        known.update(found)
+    return {k: v for k, v in known.items() if v}
+
+
+def get_media_file_id(bot_token: str, media_key: str) -> str | None:
+    """读取某个机器人指定 media_key 的 file_id。无则返回 None。"""
+    return get_media_file_ids(bot_token, [media_key]).get(media_key)
+
+
+def upsert_media_file_id(bot_token: str, media_key: str, file_id: str) -> bool:
+    """写入或更新某个 media_key 的 file_id，并同步内存映射。机器人不存在时返回 False。"""
+    bot_id = _resolve_bot_id(bot_token)
+    if bot_id is None:
+        return False
     conn = get_db_connection()
     try:
-        fields = []
-        values = []
-        if video_file_id is not None:
-            fields.append("video_file_id = %s" if DB_BACKEND == "mysql" else "video_file_id = ?")
-            values.append(video_file_id)
-        if image_file_id is not None:
-            fields.append("image_file_id = %s" if DB_BACKEND == "mysql" else "image_file_id = ?")
-            values.append(image_file_id)
-        if deposit_file_id is not None:
-            fields.append("deposit_file_id = %s" if DB_BACKEND == "mysql" else "deposit_file_id = ?")
-            values.append(deposit_file_id)
-        if sticker_file_id is not None:
-            fields.append("sticker_file_id = %s" if DB_BACKEND == "mysql" else "sticker_file_id = ?")
-            values.append(sticker_file_id)
-        if first_image_file_id is not None:
-            fields.append("first_image_file_id = %s" if DB_BACKEND == "mysql" else "first_image_file_id = ?")
-            values.append(first_image_file_id)
-        if not fields:
-            return False
-        values.append(token)
-        if DB_BACKEND == "mysql":
-            sql = f"UPDATE bots SET {', '.join(fields)} WHERE bot_token = %s"
-            with conn.cursor() as cur:
-                cur.execute(sql, tuple(values))
-                conn.commit()
-                return cur.rowcount > 0
-        else:
-            sql = f"UPDATE bots SET {', '.join(fields)} WHERE bot_token = ?"
-            cur = conn.cursor()
-            cur.execute(sql, tuple(values))
-            conn.commit()
-            return cur.rowcount > 0
+        with _cursor(conn) as cursor:
+            sql = _upsert_sql(
+                "bot_media_file_ids", ("bot_id", "media_key", "file_id"), ("bot_id", "media_key"), DB_BACKEND, touch=True,
+            )
+            _execute(cursor, sql, (bot_id, media_key, file_id))
+        conn.commit()
+        _after_commit(functools.partial(_media_cache.set, bot_token, media_key, file_id))
+        return True
     finally:
         conn.close()
 
 
-def update_play_url(token: str, play_url: str) -> bool:
-    """更新指定机器人的 play_url。返回是否成功。"""
+def delete_media_file_id(bot_token: str, media_key: str) -> bool:
+    """删除指定 media_key 的映射，并同步内存映射。"""
+    bot_id = _resolve_bot_id(bot_token)
+    if bot_id is None:
+        return False
     conn = get_db_connection()
     try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                cursor.execute("UPDATE bots SET play_url = %s WHERE bot_token = %s", (play_url, token))
-                conn.commit()
-                return cursor.rowcount > 0
-        else:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE bots SET play_url = ? WHERE bot_token = ?", (play_url, token))
-            conn.commit()
-            return cursor.rowcount > 0
+        with _cursor(conn) as cursor:
+            _execute(cursor, "DELETE FROM bot_media_file_ids WHERE bot_id = ? AND media_key = ?", (bot_id, media_key))
+            deleted = cursor.rowcount > 0
+        conn.commit()
+        _after_commit(functools.partial(_media_cache.set, bot_token, media_key, None))
+        return deleted
     finally:
         conn.close()
 
 
-def update_registration_link(token: str, registration_link: str) -> bool:
-    """更新指定机器人的 registration_link。返回是否成功。"""
+# --- 本地机队快照（见 fleet_snapshot） ---
+def get_fleet_snapshot() -> dict:
+    """读取写本地快照所需的机队数据：bots 修订号、所有活跃机器人与它们的媒体 file_id。
+
+    返回:
+        dict: {"rev": 修订号, "bots": list[BotConfig], "media": {bot_token: {media_key: file_id}}}
+        先读修订号，因此返回的机器人行都不晚于该修订号（MySQL 上三次读取处于同一一致性快照）。
+    """
     conn = get_db_connection()
     try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                cursor.execute("UPDATE bots SET registration_link = %s WHERE bot_token = %s", (registration_link, token))
-                conn.commit()
-                return cursor.rowcount > 0
-        else:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE bots SET registration_link = ? WHERE bot_token = ?", (registration_link, token))
-            conn.commit()
-            return cursor.rowcount > 0
+        with _cursor(conn) as cursor:
+            rev = int(_first_value(_execute(cursor, "SELECT rev FROM bots_revision WHERE id = 1").fetchone()) or 0)
+            bots = _select_bots(conn, " WHERE is_active = 1")
+            _execute(
+                cursor,
+                "SELECT b.bot_token, m.media_key, m.file_id FROM bot_media_file_ids m "
+                "JOIN bots b ON b.id = m.bot_id WHERE b.is_active = 1",
+            )
+            media = {}
+            for row in cursor.fetchall():
+                media.setdefault(row["bot_token"], {})[row["media_key"]] = row["file_id"]
+        return {"rev": rev, "bots": bots, "media": media}
     finally:
         conn.close()
 
 
-# --- 通用媒体 file_id 映射：CRUD ---
-def get_media_file_id(bot_token: str, media_key: str) -> str | None:
-    """读取某个机器人指定 media_key 的 file_id。无则返回 None。"""
+def seed_fleet(bots, media: dict):
+    """用机队数据预热 token -> id 映射与媒体 file_id 映射，使这些读取不再访问数据库。
+
+    启动时以本地快照调用，数据库校正后以 `get_fleet_snapshot()` 的结果再调用一次覆盖旧值
+    （快照可能早于"删除后以同一 token 重新添加"等变更）。
+    """
+    with _bot_ids_lock:
+        for bot in bots:
+            _bot_ids[bot["bot_token"]] = bot["id"]
+    for bot in bots:
+        token = bot["bot_token"]
+        _media_cache.replace(token, media.get(token) or {})
+
+
+# --- PTB 持久化数据（见 persistence.DatabasePersistence） ---
+# 每行一个键：kind 为 "user" / "chat" / "bot" / "callback" / "conv:<会话名>"，value 为 pickle 后的字节串。
+def get_persistence_rows(bot_token: str, kind: str, keys=None) -> dict:
+    """读取某机器人某一类持久化数据，返回 {pkey: value}；keys 为 None 时读取该类全部行。"""
+    bot_id = _resolve_bot_id(bot_token)
+    if bot_id is None:
+        return {}
+    sql = "SELECT pkey, value FROM bot_persistence WHERE bot_id = ? AND kind = ?"
+    params = [bot_id, kind]
+    if keys is not None:
+        keys = list(keys)
+        if not keys:
+            return {}
+        sql += f" AND pkey IN ({_in(len(keys))})"
+        params.extend(keys)
     conn = get_db_connection()
     try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    "SELECT file_id FROM bot_media_file_ids WHERE bot_token = %s AND media_key = %s",
-                    (bot_token, media_key),
-                )
-                row = cursor.fetchone()
-                if not row:
-                    return None
-                return row["file_id"] if isinstance(row, dict) else row[0]
-        else:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT file_id FROM bot_media_file_ids WHERE bot_token = ? AND media_key = ?",
-                (bot_token, media_key),
-            )
-            row = cursor.fetchone()
-            return (row[0] if row else None)
+        with _cursor(conn) as cursor:
+            return {row["pkey"]: bytes(row["value"]) for row in _execute(cursor, sql, params).fetchall()}
     finally:
         conn.close()
 
 
-def upsert_media_file_id(bot_token: str, media_key: str, file_id: str) -> bool:
-    """写入或更新某个 media_key 的 file_id。"""
+def has_persistence_rows(bot_token: str) -> bool:
+    """该机器人是否已有任何持久化数据。"""
+    bot_id = _resolve_bot_id(bot_token)
+    if bot_id is None:
+        return False
     conn = get_db_connection()
     try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    "INSERT INTO bot_media_file_ids (bot_token, media_key, file_id) VALUES (%s,%s,%s) "
-                    "ON DUPLICATE KEY UPDATE file_id = VALUES(file_id)",
-                    (bot_token, media_key, file_id),
-                )
-                conn.commit()
-                return True
-        else:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO bot_media_file_ids (bot_token, media_key, file_id) VALUES (?,?,?) "
-                "ON CONFLICT(bot_token, media_key) DO UPDATE SET file_id = excluded.file_id",
-                (bot_token, media_key, file_id),
-            )
-            conn.commit()
-            return True
+        with _cursor(conn) as cursor:
+            return _execute(cursor, "SELECT 1 FROM bot_persistence WHERE bot_id = ? LIMIT 1", (bot_id,)).fetchone() is not None
     finally:
         conn.close()
 
 
-def delete_media_file_id(bot_token: str, media_key: str) -> bool:
-    """删除指定 media_key 的映射。"""
+def put_persistence_rows(bot_token: str, rows) -> int:
+    """在一个事务内写入持久化数据：rows 为 [(kind, pkey, value)]，value 为 None 表示删除该键。
+
+    返回写入（含删除）的行数；机器人不存在时丢弃并返回 0。
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    bot_id = _resolve_bot_id(bot_token)
+    if bot_id is None:
+        logger.warning("丢弃 %d 条已不存在机器人的持久化写入", len(rows))
+        return 0
+    upserts = [(bot_id, kind, pkey, value) for kind, pkey, value in rows if value is not None]
+    deletes = [(bot_id, kind, pkey) for kind, pkey, value in rows if value is None]
     conn = get_db_connection()
     try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    "DELETE FROM bot_media_file_ids WHERE bot_token = %s AND media_key = %s",
-                    (bot_token, media_key),
+        with _cursor(conn) as cursor:
+            if upserts:
+                sql = _upsert_sql(
+                    "bot_persistence", ("bot_id", "kind", "pkey", "value"), ("bot_id", "kind", "pkey"), DB_BACKEND, touch=True,
                 )
-                conn.commit()
-                return cursor.rowcount > 0
-        else:
-            cursor = conn.cursor()
-            cursor.execute(
-                "DELETE FROM bot_media_file_ids WHERE bot_token = ? AND media_key = ?",
-                (bot_token, media_key),
-            )
-            conn.commit()
-            return cursor.rowcount > 0
+                _executemany(cursor, sql, upserts)
+            if deletes:
+                _executemany(cursor, "DELETE FROM bot_persistence WHERE bot_id = ? AND kind = ? AND pkey = ?", deletes)
+        conn.commit()
+        return len(rows)
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         conn.close()
 
+
+@_invalidates_bots
 def toggle_bot_status(token: str):
-    """切换机器人启用状态（is_active 在 0/1 间翻转）。
+    """切换机器人启用状态（is_active 在 0/1 间翻转，单条 UPDATE 原地翻转）。
 
     返回:
         bool | None: 切换后的状态（True/False）；未找到则返回 None
     """
     conn = get_db_connection()
     try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT is_active FROM bots WHERE bot_token = %s", (token,))
-                current = cursor.fetchone()
-                if not current:
-                    return None
-                new_status = 0 if current["is_active"] else 1
-                cursor.execute("UPDATE bots SET is_active = %s WHERE bot_token = %s", (new_status, token))
-                conn.commit()
-                return bool(new_status)
-        else:
-            cursor = conn.cursor()
-            cursor.execute("SELECT is_active FROM bots WHERE bot_token = ?", (token,))
-            row = cursor.fetchone()
-            if not row:
+        with _cursor(conn) as cursor:
+            rev = _next_bots_revision(cursor)
+            _execute(cursor, "UPDATE bots SET is_active = 1 - is_active, rev = ? WHERE bot_token = ?", (rev, token))
+            if cursor.rowcount == 0:
+                conn.rollback()
                 return None
-            current_active = row["is_active"]
-            new_status = 0 if current_active else 1
-            cursor.execute("UPDATE bots SET is_active = ? WHERE bot_token = ?", (new_status, token))
-            conn.commit()
-            return bool(new_status)
+            new_status = _first_value(_execute(cursor, "SELECT is_active FROM bots WHERE bot_token = ?", (token,)).fetchone())
+        conn.commit()
+        return bool(new_status)
     finally:
         conn.close()
 
 
+# 批量启停时每条 UPDATE 的键数量上限
+_ACTIVE_BATCH = 500
+
+
+@_invalidates_bots
+def set_bots_active(tokens_or_ids, active: bool) -> list:
+    """批量启用/停用机器人：每批一条 UPDATE，全部批次在同一事务内提交。
+
+    参数:
+        tokens_or_ids: bot_token（字符串）或 id（整数），可混用
+        active: 目标状态
+    返回:
+        list[BotConfig]: 状态实际发生变化的机器人（更新后的完整行）；已处于目标状态或不存在的不返回
+    """
+    ids = list(dict.fromkeys(k for k in tokens_or_ids if isinstance(k, int)))
+    tokens = list(dict.fromkeys(k for k in tokens_or_ids if not isinstance(k, int)))
+    if not ids and not tokens:
+        return []
+    value = 1 if active else 0
+    conn = get_db_connection()
+    try:
+        with _cursor(conn) as cursor:
+            rev = _next_bots_revision(cursor)
+            changed = 0
+            for column, keys in (("id", ids), ("bot_token", tokens)):
+                for start in range(0, len(keys), _ACTIVE_BATCH):
+                    chunk = keys[start:start + _ACTIVE_BATCH]
+                    _execute(
+                        cursor,
+                        f"UPDATE bots SET is_active = ?, rev = ? WHERE is_active <> ? AND {column} IN ({_in(len(chunk))})",
+                        (value, rev, value, *chunk),
+                    )
+                    changed += cursor.rowcount
+            if not changed:
+                conn.rollback()
+                return []
+        # 本事务独占这个修订号：rev 等于它的行恰好是本次改动的行（走 idx_bots_rev）
+        rows = _select_bots(conn, " WHERE rev = ?", (rev,))
+        conn.commit()
+        return rows
+    finally:
+        conn.close()
+
+
+@_cached_bot_read
 def get_bot_by_token(token: str):
     """按 bot_token 查询机器人配置。不存在返回 None。"""
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT * FROM bots WHERE bot_token = %s", (token,))
-                bot = cursor.fetchone()
-                return bot if bot else None
-        else:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM bots WHERE bot_token = ?", (token,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
+        rows = _select_bots(conn, " WHERE bot_token = ?", (token,))
+        return rows[0] if rows else None
     finally:
         conn.close()
 
 
+@_cached_bot_read
 def get_bot_by_id(bot_id: int):
     """按自增主键 id 查询机器人配置。不存在返回 None。"""
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT * FROM bots WHERE id = %s", (bot_id,))
-                bot = cursor.fetchone()
-                return bot if bot else None
-        else:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM bots WHERE id = ?", (bot_id,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
+        rows = _select_bots(conn, " WHERE id = ?", (bot_id,))
+        return rows[0] if rows else None
     finally:
         conn.close()
 
 
-def delete_bot(token: str) -> bool:
-    """从数据库中删除一个机器人及其所有关联的用户数据"""
+# 级联删除时，大表每个短事务删除的行数
+_PURGE_CHUNK = 2000
+# 随机器人一起删除的小表，与 bots 行在同一事务内删除
+_BOT_SMALL_TABLES = ("bot_media_file_ids", "bot_user_stats")
+# 可能很大的表：bots 行删除后按 bot_id 分块删除
+_BOT_LARGE_TABLES = ("user_conversations", "bot_persistence")
+
+
+def _delete_chunk_sql(table: str) -> str:
+    """按 bot_id 删除至多 LIMIT 行（SQLite 默认不支持 DELETE ... LIMIT，改用 rowid 子查询）。"""
+    if DB_BACKEND == "mysql":
+        return f"DELETE FROM {table} WHERE bot_id = ? LIMIT ?"
+    return f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE bot_id = ? LIMIT ?)"
+
+
+def _purge_bot_rows(table: str, bot_id: int, chunk_size: int = _PURGE_CHUNK) -> int:
+    """分块删除某 bot_id 在大表中的全部行，每块一个短事务；返回删除行数。"""
+    sql = _delete_chunk_sql(table)
+    total = 0
+    while True:
+        conn = get_db_connection()
+        try:
+            with _cursor(conn) as cursor:
+                _execute(cursor, sql, (bot_id, chunk_size))
+                deleted = cursor.rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        total += deleted
+        if deleted < chunk_size:
+            return total
+
+
+def _forget_deleted_bot(token: str):
+    _media_cache.drop_bot(token)
+    _forget_bot_id(token)
+
+
+def _delete_bot_where(where: str, params) -> dict | None:
+    """删除命中 `where` 的一个机器人及其全部数据，返回回收统计；不存在返回 None。
+
+    bots 行（含墓碑与修订号）与小表在一个事务内删除，之后按 bot_id 无法再解析到该机器人；
+    会话与持久化数据随后分块删除，避免一次长事务锁住大表。
+    """
     conn = get_db_connection()
     try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                cursor.execute("DELETE FROM bots WHERE bot_token = %s", (token,))
-                if cursor.rowcount == 0:
-                    return False
-                cursor.execute("DELETE FROM users WHERE bot_token = %s", (token,))
-                conn.commit()
-                return True
-        else:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM bots WHERE bot_token = ?", (token,))
-            if cursor.rowcount == 0:
-                return False
-            # 若 users 表存在则尝试删除关联记录（忽略失败）
-            try:
-                cursor.execute("DELETE FROM users WHERE bot_token = ?", (token,))
-            except Exception:
-                pass
-            conn.commit()
-            return True
-    except Exception as e:
-        print(f"删除机器人时出错: {e}")
+        with _cursor(conn) as cursor:
+            row = _row(_execute(cursor, f"SELECT id, bot_token FROM bots WHERE {where}{_for_update()}", params))
+            if not row:
+                return None
+            bot_id, token = row["id"], row["bot_token"]
+            _bury_bots(cursor, "id = ?", (bot_id,), _next_bots_revision(cursor))
+            _execute(cursor, "DELETE FROM bots WHERE id = ?", (bot_id,))
+            reclaimed = {"bots": cursor.rowcount}
+            for table in _BOT_SMALL_TABLES:
+                _execute(cursor, f"DELETE FROM {table} WHERE bot_id = ?", (bot_id,))
+                reclaimed[table] = cursor.rowcount
+        conn.commit()
+    except Exception:
         conn.rollback()
-        return False
+        raise
     finally:
         conn.close()
+    # 提交后再清理映射：提前清理时，并发的解析可能在提交前把旧 id / file_id 重新缓存；回滚时也不应清理
+    _after_commit(functools.partial(_forget_deleted_bot, token))
+    for table in _BOT_LARGE_TABLES:
+        reclaimed[table] = _purge_bot_rows(table, bot_id)
+    return {"id": bot_id, "bot_token": token, "reclaimed": reclaimed}
 
 
-def delete_bot_by_id(bot_id: int) -> bool:
-    """按 id 删除机器人，并尝试清理其 users 关联（通过 token）"""
-    conn = get_db_connection()
+@_invalidates_bots
+def delete_bot(token: str) -> dict | None:
+    """从数据库中删除一个机器人及其全部数据（会话、媒体 file_id、引流统计、PTB 持久化数据）。
+
+    返回:
+        dict | None: {"id", "bot_token", "reclaimed": {表名: 删除行数}}；未找到或失败返回 None
+    """
     try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                # 先取 token 以便清理 users
-                cursor.execute("SELECT bot_token FROM bots WHERE id = %s", (bot_id,))
-                row = cursor.fetchone()
-                if not row:
-                    return False
-                token = row["bot_token"] if isinstance(row, dict) else row[0]
-
-                cursor.execute("DELETE FROM bots WHERE id = %s", (bot_id,))
-                if cursor.rowcount == 0:
-                    return False
-                try:
-                    cursor.execute("DELETE FROM users WHERE bot_token = %s", (token,))
-                except Exception:
-                    pass
-                conn.commit()
-                return True
-        else:
-            cursor = conn.cursor()
-            cursor.execute("SELECT bot_token FROM bots WHERE id = ?", (bot_id,))
-            row = cursor.fetchone()
-            if not row:
-                return False
-            token = row[0] if not isinstance(row, sqlite3.Row) else row["bot_token"]
+        return _delete_bot_where("bot_token = ?", (token,))
+    except Exception as e:
+        logger.error(f"删除机器人时出错: {e}")
+        return None
 
-            cursor.execute("DELETE FROM bots WHERE id = ?", (bot_id,))
-            if cursor.rowcount == 0:
-                return False
-            try:
-                cursor.execute("DELETE FROM users WHERE bot_token = ?", (token,))
-            except Exception:
-                pass
-            conn.commit()
-            return True
+
+@_invalidates_bots
+def delete_bot_by_id(bot_id: int) -> dict | None:
+    """按 id 删除机器人及其全部数据，返回值同 `delete_bot`。"""
+    try:
+        return _delete_bot_where("id = ?", (bot_id,))
     except Exception as e:
-        print(f"按ID删除机器人时出错: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
+        logger.error(f"按ID删除机器人时出错: {e}")
+        return None
+
 
+def purge_orphaned_bot_data(chunk_size: int = _PURGE_CHUNK) -> dict:
+    """清理 bots 中已不存在的 bot_id 残留的数据行（旧版删除机器人时遗留，或删除中途进程退出）。
 
+    返回:
+        dict: {表名: 删除行数}
+    """
+    reclaimed = {}
+    for table in _BOT_SMALL_TABLES + _BOT_LARGE_TABLES:
+        conn = get_db_connection()
+        try:
+            with _cursor(conn) as cursor:
+                _execute(cursor, f"SELECT DISTINCT bot_id FROM {table} WHERE bot_id NOT IN (SELECT id FROM bots)")
+                orphans = [_first_value(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+        reclaimed[table] = sum(_purge_bot_rows(table, bot_id, chunk_size) for bot_id in orphans)
+    return reclaimed
+
+
+@_cached_bot_read
 def get_bots_by_creator(created_by: int, role: str | None = None):
     """按创建者（运营）查询机器人，可选按角色筛选。"""
-    conn = get_db_connection()
+    where = " WHERE created_by = ?"
+    params = [created_by]
+    if role:
+        where += " AND bot_role = ?"
+        params.append(role)
+    conn = get_db_connection(readonly=True)
     try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                if role:
-                    cursor.execute("SELECT * FROM bots WHERE created_by = %s AND bot_role = %s", (created_by, role))
-                else:
-                    cursor.execute("SELECT * FROM bots WHERE created_by = %s", (created_by,))
-                return cursor.fetchall()
-        else:
-            cursor = conn.cursor()
-            if role:
-                cursor.execute("SELECT * FROM bots WHERE created_by = ? AND bot_role = ?", (created_by, role))
-                rows = cursor.fetchall()
-                return [dict(row) for row in rows]
-            else:
-                cursor.execute("SELECT * FROM bots WHERE created_by = ?", (created_by,))
-                rows = cursor.fetchall()
-                return [dict(row) for row in rows]
+        return _select_bots(conn, where, params)
     finally:
         conn.close()
 
 
-def count_users_for_bot(bot_token: str) -> int:
-    """统计在 user_conversations 中出现过的唯一 chat_id 数量，视为“点进来过”。"""
-    conn = get_db_connection()
+def count_users_for_bots(tokens) -> dict:
+    """批量读取多个机器人的引流人数（去重 chat_id），返回 {bot_token: 人数}。
+
+    直接读取随会话写入维护的 `bot_user_stats`，一次按主键的查询即可覆盖任意数量的机器人；
+    不存在的 token 不出现在结果中。刚把排队的会话写入落库时固定走主库，副本可能尚未同步这些计数。
+    """
+    tokens = list(dict.fromkeys(tokens))
+    if not tokens:
+        return {}
+    if _conv_writer.has_pending():
+        _conv_writer.flush()
+        _pin_primary()
+    conn = get_db_connection(readonly=True)
     try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT COUNT(DISTINCT chat_id) FROM user_conversations WHERE bot_token = %s", (bot_token,))
-                row = cursor.fetchone()
-                return int(row[0] if isinstance(row, (list, tuple)) else list(row.values())[0])
-        else:
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(DISTINCT chat_id) FROM user_conversations WHERE bot_token = ?", (bot_token,))
-            row = cursor.fetchone()
-            return int(row[0]) if row else 0
+        with _cursor(conn) as cursor:
+            _execute(
+                cursor,
+                "SELECT b.bot_token, COALESCE(s.user_count, 0) AS user_count FROM bots b "
+                f"LEFT JOIN bot_user_stats s ON s.bot_id = b.id WHERE b.bot_token IN ({_in(len(tokens))})",
+                tokens,
+            )
+            return {row["bot_token"]: int(row["user_count"]) for row in cursor.fetchall()}
     finally:
         conn.close()
 
 
+def count_users_for_bot(bot_token: str) -> int:
+    """读取该机器人的引流人数（去重 chat_id，视为“点进来过”），取自 `bot_user_stats`，见 `count_users_for_bots`。"""
+    return count_users_for_bots([bot_token]).get(bot_token, 0)
+
+
 def get_unclaimed_bots(role: str | None = None):
     """查询 created_by 为空/NULL 的历史机器人。"""
-    conn = get_db_connection()
+    where = " WHERE created_by IS NULL"
+    params = ()
+    if role:
+        where += " AND bot_role = ?"
+        params = (role,)
+    conn = get_db_connection(readonly=True)
     try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                if role:
-                    cursor.execute("SELECT * FROM bots WHERE created_by IS NULL AND bot_role = %s", (role,))
-                else:
-                    cursor.execute("SELECT * FROM bots WHERE created_by IS NULL")
-                return cursor.fetchall()
-        else:
-            cursor = conn.cursor()
-            if role:
-                cursor.execute("SELECT * FROM bots WHERE created_by IS NULL AND bot_role = ?", (role,))
-            else:
-                cursor.execute("SELECT * FROM bots WHERE created_by IS NULL")
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+        return _select_bots(conn, where, params)
     finally:
         conn.close()
 
 
-def claim_bot_owner(bot_token: str, operator_id: int) -> bool:
-    """为一个 created_by 为空的机器人设置归属。返回是否成功。"""
-    conn = get_db_connection()
+# 选择器按钮只需要的列
+BOT_PICKER_COLUMNS = ("id", "agent_name", "bot_token", "bot_role", "is_active", "created_by")
+
+
+@_cached_bot_read
+def get_bots_page(
+    after_id: int = 0,
+    limit: int = 25,
+    created_by: int | None = None,
+    role: str | None = None,
+    active_only: bool = False,
+    unclaimed: bool = False,
+    columns: tuple = BOT_PICKER_COLUMNS,
+):
+    """按 id 键集分页查询机器人：`WHERE id > after_id ORDER BY id LIMIT limit`。
+
+    参数:
+        after_id: 上一页最后一个 id（首页传 0）
+        limit: 每页条数
+        created_by: 只看该运营创建的机器人
+        role: 角色过滤
+        active_only: 只看启用中的机器人
+        unclaimed: 只看 created_by 为 NULL 的机器人
+        columns: 返回的列（须为 `BOT_COLUMNS` 的子集，且包含 id）
+    返回:
+        tuple[list[dict], int | None]: (本页行, 下一页的 after_id；没有下一页为 None)
+    """
+    columns = tuple(columns)
+    unknown = set(columns) - set(BOT_COLUMNS)
+    if unknown or "id" not in columns:
+        raise ValueError(f"非法的列投影: {columns}")
+    where = ["id > ?"]
+    params = [after_id]
+    if created_by is not None:
+        where.append("created_by = ?")
+        params.append(created_by)
+    if unclaimed:
+        where.append("created_by IS NULL")
+    if role:
+        where.append("bot_role = ?")
+        params.append(role)
+    if active_only:
+        where.append("is_active = 1")
+    # 多取一行判断是否还有下一页
+    sql = f"SELECT {', '.join(columns)} FROM bots WHERE {' AND '.join(where)} ORDER BY id LIMIT ?"
+    params.append(limit + 1)
+    conn = get_db_connection(readonly=True)
     try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                cursor.execute("UPDATE bots SET created_by = %s WHERE bot_token = %s AND (created_by IS NULL)", (operator_id, bot_token))
-                conn.commit()
-                return cursor.rowcount > 0
-        else:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE bots SET created_by = ? WHERE bot_token = ? AND (created_by IS NULL)", (operator_id, bot_token))
-            conn.commit()
-            return cursor.rowcount > 0
+        with _cursor(conn) as cursor:
+            rows = _rows(_execute(cursor, sql, params))
     finally:
         conn.close()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1]["id"]
+    return rows, None
+
+
+@_invalidates_bots
+def claim_bot_owner(bot_token: str, operator_id: int) -> bool:
+    """为一个 created_by 为空的机器人设置归属。返回是否成功。"""
+    return _update_bots({"created_by": operator_id}, "bot_token = ? AND created_by IS NULL", (bot_token,)) > 0
 
 
+@_invalidates_bots
 def claim_all_unowned(operator_id: int, role: str | None = None) -> int:
     """批量为未认领机器人设置归属，返回受影响数量。可按角色过滤。"""
-    conn = get_db_connection()
-    try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                if role:
-                    cursor.execute("UPDATE bots SET created_by = %s WHERE created_by IS NULL AND bot_role = %s", (operator_id, role))
-                else:
-                    cursor.execute("UPDATE bots SET created_by = %s WHERE created_by IS NULL", (operator_id,))
-                conn.commit()
-                return cursor.rowcount
-        else:
-            cursor = conn.cursor()
-            if role:
-                cursor.execute("UPDATE bots SET created_by = ? WHERE created_by IS NULL AND bot_role = ?", (operator_id, role))
-            else:
-                cursor.execute("UPDATE bots SET created_by = ? WHERE created_by IS NULL", (operator_id,))
-            conn.commit()
-            return cursor.rowcount
-    finally:
-        conn.close()
+    if role:
+        return _update_bots({"created_by": operator_id}, "created_by IS NULL AND bot_role = ?", (role,))
+    return _update_bots({"created_by": operator_id}, "created_by IS NULL", ())
 
 
+@_invalidates_bots
 def claim_bot_owner_by_id(bot_id: int, operator_id: int) -> bool:
     """按 id 认领（created_by 为空时生效）。"""
-    conn = get_db_connection()
-    try:
-        if DB_BACKEND == "mysql":
-            with conn.cursor() as cursor:
-                cursor.execute("UPDATE bots SET created_by = %s WHERE id = %s AND (created_by IS NULL)", (operator_id, bot_id))
-                conn.commit()
-                return cursor.rowcount > 0
+    return _update_bots({"created_by": operator_id}, "id = ? AND created_by IS NULL", (bot_id,)) > 0
+
+
+# --- 异步门面 ---
+class _StreamError:
+    """`_AsyncDatabase.stream` 中把生产线程的异常带回事件循环。"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class _AsyncDatabase:
+    """本模块的异步门面：`await database.aio.get_bot_by_token(token)`。
+
+    - 任意公开函数均可按同名访问，调用被投递到专用的有界线程池执行
+    - 生成器函数（如 `iter_resumable_conversations`）返回异步生成器，整个遍历在同一线程内完成
+    - 线程数由 `DB_EXECUTOR_WORKERS` 控制，避免慢查询占满默认执行器或阻塞事件循环
+    - `stats()` 提供排队深度、运行中数量与排队等待耗时等指标
+    """
+
+    def __init__(self, max_workers: int):
+        self._max_workers = max(1, max_workers)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._max_queued = 0
+        self._submitted = 0
+        self._completed = 0
+        self._total_queue_wait = 0.0
+        self._max_queue_wait = 0.0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="db")
+        return self._executor
+
+    def _invoke(self, func, args, kwargs, enqueued_at: float):
+        waited = time.perf_counter() - enqueued_at
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._total_queue_wait += waited
+            if waited > self._max_queue_wait:
+                self._max_queue_wait = waited
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+
+    @staticmethod
+    def _caller_context() -> contextvars.Context:
+        """复制调用方（当前任务）的上下文带进执行线程，使写后固定主库对同一任务的后续读取生效。"""
+        if _primary_pin.get() is None:
+            _primary_pin.set([0.0])
+        return contextvars.copy_context()
+
+    async def run(self, func, *args, **kwargs):
+        """在数据库线程池中执行任意同步函数并等待结果。"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._queued += 1
+            self._submitted += 1
+            if self._queued > self._max_queued:
+                self._max_queued = self._queued
+        call = functools.partial(self._caller_context().run, self._invoke, func, args, kwargs, time.perf_counter())
+        return await loop.run_in_executor(self._get_executor(), call)
+
+    async def transaction(self, func, *args, **kwargs):
+        """在一次线程池调用内以 `database.session()` 运行同步函数 `func(...)`，返回其结果。
+
+        事务与连接只在这一次调用中持有，不跨越 await：并发的工作单元各占一个执行线程、依次提交，
+        不会出现多个会话持锁等待空闲执行线程提交的情况。
+
+        用法:
+            def save(token, chat_id, state):
+                database.update_bot_file_ids(token, first_image_file_id=fid)
+                database.upsert_user_conversation(token, chat_id, state)
+
+            await database.aio.transaction(save, token, chat_id, state)
+        """
+        return await self.run(_run_in_session, func, args, kwargs)
+
+    async def stream(self, func, *args, **kwargs):
+        """在单个数据库线程中驱动同步生成器 `func(...)`，逐项异步产出。
+
+        生产端与消费端之间是容量为 2 的队列：消费慢时生产线程阻塞等待，内存保持平稳；
+        消费端提前退出时通知生产端停止并关闭生成器（在其所属线程内归还连接）。
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=2)
+        stop = threading.Event()
+        end = object()
+
+        def produce():
+            gen = func(*args, **kwargs)
+            try:
+                for item in gen:
+                    if stop.is_set():
+                        break
+                    asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+            except BaseException as e:
+                if not stop.is_set():
+                    asyncio.run_coroutine_threadsafe(queue.put(_StreamError(e)), loop).result()
+                return
+            finally:
+                gen.close()
+            if not stop.is_set():
+                asyncio.run_coroutine_threadsafe(queue.put(end), loop).result()
+
+        with self._lock:
+            self._queued += 1
+            self._submitted += 1
+            if self._queued > self._max_queued:
+                self._max_queued = self._queued
+        call = functools.partial(self._caller_context().run, self._invoke, produce, (), {}, time.perf_counter())
+        future = loop.run_in_executor(self._get_executor(), call)
+        try:
+            while True:
+                item = await queue.get()
+                if item is end:
+                    break
+                if isinstance(item, _StreamError):
+                    raise item.error
+                yield item
+        finally:
+            stop.set()
+            while not future.done():
+                while not queue.empty():
+                    queue.get_nowait()
+                await asyncio.sleep(0.01)
+            await future
+
+    def __getattr__(self, name: str):
+        func = globals().get(name)
+        if name.startswith("_") or not callable(func) or isinstance(func, type):
+            raise AttributeError(f"database.aio 没有可用的函数 '{name}'")
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return self.stream(func, *args, **kwargs)
+
+            setattr(self, name, wrapper)
+            return wrapper
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await self.run(func, *args, **kwargs)
+
+        setattr(self, name, wrapper)
+        return wrapper
+
+    def stats(self) -> dict:
+        with self._lock:
+            avg_wait = self._total_queue_wait / self._completed if self._completed else 0.0
+            return {
+                "workers": self._max_workers,
+                "queued": self._queued,
+                "running": self._running,
+                "max_queued": self._max_queued,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "queue_wait_avg_ms": round(avg_wait * 1000, 3),
+                "queue_wait_max_ms": round(self._max_queue_wait * 1000, 3),
+            }
+
+    def shutdown(self):
+        """等待已提交的任务完成并关闭线程池（进程退出时调用）。"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+# --- 调用耗时统计与慢查询日志 ---
+class _LatencyHistogram:
+    """按对数分桶（相邻桶边界相差 `_GROWTH` 倍）记录耗时，常数内存估算分位数。"""
+
+    _BASE_MS = 0.01
+    _GROWTH = 1.2
+    _BUCKETS = 96  # 覆盖 0.01ms ~ 约 400s
+
+    def __init__(self):
+        self.counts = [0] * (self._BUCKETS + 1)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms: float, error: bool):
+        if ms <= self._BASE_MS:
+            idx = 0
         else:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE bots SET created_by = ? WHERE id = ? AND (created_by IS NULL)", (operator_id, bot_id))
-            conn.commit()
-            return cursor.rowcount > 0
-    finally:
-        conn.close()
+            idx = min(self._BUCKETS, int(math.log(ms / self._BASE_MS, self._GROWTH)) + 1)
+        self.counts[idx] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+        if error:
+            self.errors += 1
+
+    def percentile(self, q: float) -> float:
+        """返回第 q 分位所在桶的上界（毫秒），不超过实际最大值。"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for idx, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self._BASE_MS * self._GROWTH ** idx, self.max_ms)
+        return self.max_ms
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "p50_ms": round(self.percentile(0.50), 3),
+            "p95_ms": round(self.percentile(0.95), 3),
+            "p99_ms": round(self.percentile(0.99), 3),
+            "max_ms": round(self.max_ms, 3),
+            "total_ms": round(self.total_ms, 3),
+        }
+
+
+_query_stats = {}
+_query_stats_lock = threading.Lock()
+_slow_logger = logging.getLogger(__name__ + ".slow")
+_TOKEN_RE = re.compile(r"(\d+):[A-Za-z0-9_-]{20,}")
+# 统计/管理类函数不计时
+_UNTIMED = {
+    "get_db_connection", "get_pool_stats", "close_db_pool", "get_cache_stats", "invalidate_bot_cache",
+    "get_conversation_writer_stats", "close_conversation_writer", "get_media_cache_stats",
+    "get_sweeper_stats", "get_cached_media_file_ids", "get_query_stats", "reset_query_stats", "session",
+}
+
+
+def _record_call(name: str, started: float, error: bool, args, kwargs):
+    ms = (time.perf_counter() - started) * 1000
+    with _query_stats_lock:
+        hist = _query_stats.get(name)
+        if hist is None:
+            hist = _query_stats[name] = _LatencyHistogram()
+        hist.record(ms, error)
+    if ms >= DB_SLOW_QUERY_MS:
+        # 参数中的 bot token 只保留 id 部分
+        shown = _TOKEN_RE.sub(r"\1:***", ", ".join([repr(a) for a in args] + [f"{k}={v!r}" for k, v in kwargs.items()]))
+        if len(shown) > 200:
+            shown = shown[:200] + "..."
+        _slow_logger.warning(f"慢查询 {name}({shown}) 耗时 {ms:.1f}ms{'（异常）' if error else ''}")
+
+
+def _timed(func):
+    """包装公开函数：记录耗时与异常次数；生成器按整个遍历计时。"""
+    name = func.__name__
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def gen_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            error = False
+            try:
+                yield from func(*args, **kwargs)
+            except GeneratorExit:
+                raise
+            except BaseException:
+                error = True
+                raise
+            finally:
+                _record_call(name, started, error, args, kwargs)
+
+        return gen_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        error = False
+        try:
+            return func(*args, **kwargs)
+        except BaseException:
+            error = True
+            raise
+        finally:
+            _record_call(name, started, error, args, kwargs)
+
+    return wrapper
+
+
+def get_query_stats() -> dict:
+    """返回各公开函数的调用次数、异常次数、p50/p95/p99/最大耗时（毫秒），按总耗时降序。"""
+    with _query_stats_lock:
+        data = {name: hist.as_dict() for name, hist in _query_stats.items()}
+    return dict(sorted(data.items(), key=lambda item: item[1]["total_ms"], reverse=True))
+
+
+def reset_query_stats():
+    """清空耗时统计。"""
+    with _query_stats_lock:
+        _query_stats.clear()
+
+
+if DB_TIMING:
+    for _name, _func in list(globals().items()):
+        if (
+            inspect.isfunction(_func)
+            and _func.__module__ == __name__
+            and not _name.startswith("_")
+            and _name not in _UNTIMED
+        ):
+            globals()[_name] = _timed(_func)
+    del _name, _func
+
+
+aio = _AsyncDatabase(DB_EXECUTOR_WORKERS)
@@ -0,0 +1,331 @@
+"""数据库基准与执行计划检查（开发/运维工具）
+
+用法（在项目根目录执行）：
+    python -m afubot.bot.db_benchmark explain    # 对当前配置的数据库做 EXPLAIN，确认热点查询命中索引（只读）
+    python -m afubot.bot.db_benchmark indexes    # 在临时 SQLite 库中灌入模拟数据，对比有/无二级索引的查询耗时
+    python -m afubot.bot.db_benchmark sqlite     # 多线程读写混合负载下，对比 SQLite 默认模式与调优参数（WAL 等）的吞吐
+    python -m afubot.bot.db_benchmark routing    # 确认 MYSQL_REPLICAS 读写分离：只读走副本，写后固定主库（只读）
+
+`indexes` / `sqlite` 只在临时文件上读写，不会触碰配置中的 `bots.db` 或 MySQL。
+"""
+
+import argparse
+import os
+import random
+import sys
+import sqlite3
+import tempfile
+import threading
+import time
+
+from . import database
+
+
+# 热点查询：(名称, SQL（? 占位）, 参数, 可接受的索引名)
+HOT_QUERIES = [
+    (
+        "active_by_role",
+        "SELECT * FROM bots WHERE is_active = 1 AND bot_role = ?",
+        ("channel",),
+        {"idx_bots_active_role"},
+    ),
+    (
+        "by_creator_role",
+        "SELECT * FROM bots WHERE created_by = ? AND bot_role = ?",
+        (1001, "private"),
+        {"idx_bots_creator_role"},
+    ),
+    (
+        "unclaimed",
+        "SELECT * FROM bots WHERE created_by IS NULL",
+        (),
+        {"idx_bots_creator_role"},
+    ),
+    (
+        "count_users",
+        "SELECT COUNT(*) FROM user_conversations WHERE bot_id = ?",
+        (1,),
+        {"PRIMARY", "sqlite_autoindex_user_conversations_1"},
+    ),
+    (
+        "stale_conversations",
+        "SELECT bot_id, chat_id FROM user_conversations WHERE updated_at < ? ORDER BY updated_at LIMIT 500",
+        ("2000-01-02 00:00:00",),
+        {"idx_user_conversations_updated_at"},
+    ),
+    (
+        "bots_changed_since",
+        "SELECT * FROM bots WHERE rev > ? AND rev <= ?",
+        (100, 120),
+        {"idx_bots_rev"},
+    ),
+]
+
+
+def _explain(cursor, sql: str, params) -> set:
+    """返回该查询执行计划中用到的索引名集合。"""
+    if database.DB_BACKEND == "mysql":
+        cursor.execute("EXPLAIN " + sql.replace("?", "%s"), params)
+        used = set()
+        for row in cursor.fetchall():
+            if row.get("key"):
+                used.update(row["key"].split(","))
+        return used
+    cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+    used = set()
+    for row in cursor.fetchall():
+        detail = row[3]
+        for marker in ("USING COVERING INDEX ", "USING INDEX "):
+            if marker in detail:
+                used.add(detail.split(marker, 1)[1].split(" ", 1)[0])
+                break
+    return used
+
+
+def run_explain() -> bool:
+    """逐条 EXPLAIN 热点查询，打印命中的索引；全部命中返回 True。
+
+    只读：数据库尚未初始化或表结构不是最新版本时只提示，不自动执行迁移。
+    """
+    conn = database.get_db_connection()
+    all_ok = True
+    try:
+        version = database.get_schema_version(conn)
+        if version is None or version < database.SCHEMA_VERSION:
+            print(
+                f"数据库未初始化或表结构不是最新（当前版本 {version}，需要 {database.SCHEMA_VERSION}），"
+                "请先启动一次程序或执行 database.initialize_db()"
+            )
+            return False
+        cursor = conn.cursor()
+        for name, sql, params, expected in HOT_QUERIES:
+            used = _explain(cursor, sql, params)
+            ok = bool(used & expected)
+            all_ok = all_ok and ok
+            print(f"[{'OK' if ok else 'MISS'}] {name:<22} 索引={', '.join(sorted(used)) or '(全表扫描)'}")
+    finally:
+        conn.close()
+    return all_ok
+
+
+def _populate(bots: int, users_per_bot: int):
+    """灌入模拟数据：`bots` 个机器人、每个 `users_per_bot` 条会话。"""
+    rnd = random.Random(42)
+    conn = database.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        bot_rows = []
+        for i in range(bots):
+            created_by = None if i % 10 == 0 else 1000 + i % 50
+            role = "channel" if i % 4 == 0 else "private"
+            bot_rows.append((f"bench-{i}", f"{100000 + i}:bench", "https://example.invalid/reg", role, i % 7 != 0, created_by))
+        cursor.executemany(
+            "INSERT INTO bots (agent_name, bot_token, registration_link, bot_role, is_active, created_by) VALUES (?,?,?,?,?,?)",
+            bot_rows,
+        )
+        conv_rows = []
+        # 新库的 bots.id 从 1 开始自增，与插入顺序一致
+        for i in range(bots):
+            bot_id = i + 1
+            for chat_id in range(users_per_bot):
+                day = rnd.randint(1, 28)
+                conv_rows.append((bot_id, chat_id, "AWAITING_REGISTER_CONFIRM", None, f"2000-01-{day:02d} 12:00:00"))
+        cursor.executemany(
+            "INSERT INTO user_conversations (bot_id, chat_id, state, payload_json, updated_at) VALUES (?,?,?,?,?)",
+            conv_rows,
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _time_queries(repeat: int) -> dict:
+    conn = database.get_db_connection()
+    timings = {}
+    try:
+        cursor = conn.cursor()
+        for name, sql, params, _ in HOT_QUERIES:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                cursor.execute(sql, params)
+                cursor.fetchall()
+            timings[name] = (time.perf_counter() - started) / repeat * 1000
+    finally:
+        conn.close()
+    return timings
+
+
+def run_index_benchmark(bots: int, users_per_bot: int, repeat: int) -> bool:
+    """在临时 SQLite 库中对比有/无二级索引时热点查询的平均耗时（毫秒）。"""
+    if database.DB_BACKEND != "sqlite":
+        print("indexes 基准仅在 DB_BACKEND=sqlite 时运行；MySQL 请使用 explain 子命令。")
+        return True
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_FILE = os.path.join(tmp, "bench.db")
+        database.initialize_db()
+        _populate(bots, users_per_bot)
+        print(f"模拟数据：{bots} 个机器人，{bots * users_per_bot} 条会话")
+        ok = run_explain()
+        with_idx = _time_queries(repeat)
+
+        conn = database.get_db_connection()
+        try:
+            for _, name, _ in database.SECONDARY_INDEXES:
+                conn.execute(f"DROP INDEX IF EXISTS {name}")
+            conn.commit()
+        finally:
+            conn.close()
+        without_idx = _time_queries(repeat)
+        database.close_db_pool()
+
+    print(f"\n{'查询':<22}{'无索引(ms)':>12}{'有索引(ms)':>12}{'加速':>8}")
+    for name in with_idx:
+        before, after = without_idx[name], with_idx[name]
+        speedup = before / after if after else float("inf")
+        print(f"{name:<22}{before:>12.3f}{after:>12.3f}{speedup:>7.1f}x")
+    return ok
+
+
+def _mixed_worker(seed: int, bots: int, users_per_bot: int, write_ratio: float, deadline: float, result: dict):
+    """读写混合：读按主键取会话，写模拟 `update_bot_file_ids` / 会话 upsert 的单行提交。"""
+    rnd = random.Random(seed)
+    reads = writes = locked = 0
+    conn = database.get_db_connection()
+    try:
+        while time.perf_counter() < deadline:
+            bot_id = rnd.randint(1, bots)
+            chat_id = rnd.randrange(users_per_bot)
+            try:
+                if rnd.random() < write_ratio:
+                    if rnd.random() < 0.5:
+                        conn.execute("UPDATE bots SET video_file_id = ? WHERE id = ?", (f"f{rnd.random()}", bot_id))
+                    else:
+                        conn.execute(
+                            "UPDATE user_conversations SET state = ?, updated_at = datetime('now') WHERE bot_id = ? AND chat_id = ?",
+                            ("AWAITING_REGISTER_CONFIRM", bot_id, chat_id),
+                        )
+                    conn.commit()
+                    writes += 1
+                else:
+                    conn.execute(
+                        "SELECT state, payload_json FROM user_conversations WHERE bot_id = ? AND chat_id = ?",
+                        (bot_id, chat_id),
+                    ).fetchall()
+                    conn.execute("SELECT * FROM bots WHERE id = ?", (bot_id,)).fetchall()
+                    reads += 1
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e):
+                    raise
+                conn.rollback()
+                locked += 1
+    finally:
+        conn.close()
+    with result["lock"]:
+        result["reads"] += reads
+        result["writes"] += writes
+        result["locked"] += locked
+
+
+def _run_mixed(pragmas: list, bots: int, users_per_bot: int, threads: int, seconds: float, write_ratio: float) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_FILE = os.path.join(tmp, "mixed.db")
+        database.SQLITE_PRAGMAS = pragmas
+        database.initialize_db()
+        _populate(bots, users_per_bot)
+        database.close_db_pool()
+        result = {"lock": threading.Lock(), "reads": 0, "writes": 0, "locked": 0}
+        deadline = time.perf_counter() + seconds
+        workers = [
+            threading.Thread(target=_mixed_worker, args=(i, bots, users_per_bot, write_ratio, deadline, result))
+            for i in range(threads)
+        ]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+    result.pop("lock")
+    result["ops_per_sec"] = (result["reads"] + result["writes"]) / seconds
+    return result
+
+
+def run_sqlite_benchmark(bots: int, users_per_bot: int, threads: int, seconds: float, write_ratio: float) -> bool:
+    """对比 SQLite 默认模式与 `SQLITE_PRAGMAS` 调优后的混合负载吞吐（各跑一轮独立的临时库）。"""
+    if database.DB_BACKEND != "sqlite":
+        print("sqlite 基准仅在 DB_BACKEND=sqlite 时运行。")
+        return True
+    # SQLITE_TUNING=0 时仍用最小调优组合对比，便于评估是否开启
+    tuned_pragmas = database._sqlite_pragmas() or [("busy_timeout", 5000), ("journal_mode", "WAL"), ("synchronous", "NORMAL")]
+    print(f"负载：{threads} 线程 × {seconds:.0f}s，写比例 {write_ratio:.0%}，{bots} 个机器人 × {users_per_bot} 会话")
+    print("调优参数：" + ", ".join(f"{k}={v}" for k, v in tuned_pragmas))
+    original = database.SQLITE_PRAGMAS
+    try:
+        baseline = _run_mixed([], bots, users_per_bot, threads, seconds, write_ratio)
+        tuned = _run_mixed(tuned_pragmas, bots, users_per_bot, threads, seconds, write_ratio)
+    finally:
+        database.SQLITE_PRAGMAS = original
+    print(f"\n{'模式':<10}{'读/秒':>10}{'写/秒':>10}{'总/秒':>10}{'锁冲突':>8}")
+    for name, r in (("default", baseline), ("tuned", tuned)):
+        print(f"{name:<10}{r['reads'] / seconds:>10.0f}{r['writes'] / seconds:>10.0f}{r['ops_per_sec']:>10.0f}{r['locked']:>8}")
+    if baseline["ops_per_sec"]:
+        print(f"\n吞吐提升：{tuned['ops_per_sec'] / baseline['ops_per_sec']:.1f}x")
+    return True
+
+
+def _server_of(readonly: bool) -> str:
+    conn = database.get_db_connection(readonly=readonly)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT @@hostname AS host, @@port AS port")
+            row = cursor.fetchone()
+            return f"{row['host']}:{row['port']}"
+    finally:
+        conn.close()
+
+
+def run_routing_check() -> bool:
+    """打印主库、普通只读、写后只读三种借出实际连到的 MySQL 实例。"""
+    if database.DB_BACKEND != "mysql" or not database.MYSQL_REPLICAS:
+        print("routing 检查需要 DB_BACKEND=mysql 且配置 MYSQL_REPLICAS（本地可指向第二个实例，如 127.0.0.1:3307）。")
+        return True
+    primary = _server_of(False)
+    replica = _server_of(True)
+    database._pin_primary()
+    pinned = _server_of(True)
+    print(f"主库连接:       {primary}")
+    print(f"只读连接:       {replica}")
+    print(f"写后只读连接:   {pinned}（{database.REPLICA_PIN_SECONDS}s 内固定主库）")
+    ok = replica != primary and pinned == primary
+    print("路由正确" if ok else "路由异常：只读未走副本或写后未固定主库")
+    return ok
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="数据库基准与执行计划检查")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("explain", help="EXPLAIN 热点查询，确认命中索引（只读）")
+    p_idx = sub.add_parser("indexes", help="临时 SQLite 库上对比有/无索引的查询耗时")
+    p_idx.add_argument("--bots", type=int, default=2000)
+    p_idx.add_argument("--users", type=int, default=100, help="每个机器人的会话数")
+    p_idx.add_argument("--repeat", type=int, default=20)
+    p_sql = sub.add_parser("sqlite", help="临时 SQLite 库上对比默认模式与调优参数的读写混合吞吐")
+    p_sql.add_argument("--bots", type=int, default=200)
+    p_sql.add_argument("--users", type=int, default=50, help="每个机器人的会话数")
+    p_sql.add_argument("--threads", type=int, default=8)
+    p_sql.add_argument("--seconds", type=float, default=5)
+    p_sql.add_argument("--write-ratio", type=float, default=0.2)
+    sub.add_parser("routing", help="确认只读副本路由与写后固定主库（只读）")
+    args = parser.parse_args(argv)
+
+    if args.command == "explain":
+        ok = run_explain()
+    elif args.command == "routing":
+        ok = run_routing_check()
+    elif args.command == "indexes":
+        ok = run_index_benchmark(args.bots, args.users, args.repeat)
+    else:
+        ok = run_sqlite_benchmark(args.bots, args.users, args.threads, args.seconds, args.write_ratio)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""本地机队快照
+
+把机队配置（所有活跃机器人的 bots 行 + 它们的媒体 file_id）写成一个紧凑的本地 JSON 文件，
+使启动不必等待数据库：`main.startup` 先按快照启动机器人，数据库在后台初始化并校正。
+
+- 写入：`FleetSnapshotWriter.refresh()` 比较 bots 修订号与本进程的媒体写入计数，变化时才重新读取并写入；
+  先写临时文件、fsync 后 `os.replace`，崩溃时旧快照保持完整。文件含机器人 token，以 0600 权限创建
+- 读取：`load_snapshot()` 对整个文件做一次 mmap 读取；文件缺失、损坏或格式版本不符时返回 None，
+  调用方回退到从数据库启动
+
+快照只是启动加速手段，不是数据源：它可能落后于数据库（例如其他节点的改动、停机期间的变更），
+因此启动后总要以数据库为准校正一次。
+"""
+
+import asyncio
+import json
+import logging
+import mmap
+import os
+import time
+
+from . import database
+from .database import BOT_COLUMNS, BotConfig
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+_COLUMNS = BOT_COLUMNS + ("rev",)
+
+
+def _encode(fleet: dict) -> bytes:
+    """机器人行按列位置存为数组（列名只写一次），媒体映射按 token 分组。"""
+    payload = {
+        "format": SNAPSHOT_FORMAT,
+        "rev": fleet["rev"],
+        "written_at": time.time(),
+        "columns": _COLUMNS,
+        "bots": [[getattr(bot, name) for name in _COLUMNS] for bot in fleet["bots"]],
+        "media": fleet["media"],
+    }
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def write_snapshot(path: str, fleet: dict) -> int:
+    """原子地写入快照（临时文件 + fsync + rename），返回写入的字节数。
+
+    参数:
+        fleet: `database.get_fleet_snapshot()` 的返回值
+    """
+    blob = _encode(fleet)
+    tmp = f"{path}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return len(blob)
+
+
+def load_snapshot(path: str) -> dict | None:
+    """一次 mmap 读取快照文件并解析。
+
+    返回:
+        dict | None: {"rev", "written_at", "bots": list[BotConfig], "media": {bot_token: {media_key: file_id}}}；
+        文件缺失、为空、损坏或格式版本不符时返回 None
+    """
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                payload = json.loads(view[:])
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"本地机队快照 {path} 无法读取，改为从数据库启动: {e}")
+        return None
+    if not isinstance(payload, dict) or payload.get("format") != SNAPSHOT_FORMAT:
+        logger.warning(f"本地机队快照 {path} 格式版本不符，改为从数据库启动")
+        return None
+    columns = payload.get("columns") or []
+    bots = [BotConfig.from_dict(dict(zip(columns, row))) for row in payload.get("bots") or []]
+    return {
+        "rev": int(payload.get("rev") or 0),
+        "written_at": payload.get("written_at"),
+        "bots": bots,
+        "media": payload.get("media") or {},
+    }
+
+
+class FleetSnapshotWriter:
+    """按需重写本地快照：bots 修订号或本进程的媒体写入计数变化时才重新读取机队并写文件。
+
+    修订号覆盖所有节点对 bots 的修改；媒体 file_id 只跟踪本进程的写入（file_id 由各机器人
+    自己上传后写入，通常就在本进程），其他节点写入的 file_id 会在下一次 bots 变更时一并写入。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._written = None  # 上次写入时的 (bots 修订号, 媒体写入计数)
+        self.writes = 0
+        self.last_bytes = 0
+
+    async def refresh(self, force: bool = False) -> bool:
+        """有变更（或 force）时重写快照，返回是否写入。数据库不可用时抛出异常，快照保持不变。"""
+        media_writes = database.get_media_cache_stats()["writes"]
+        if not force and self._written is not None:
+            rev = await database.aio.get_bots_revision()
+            if (rev, media_writes) == self._written:
+                return False
+        fleet = await database.aio.get_fleet_snapshot()
+        self.last_bytes = await asyncio.to_thread(write_snapshot, self.path, fleet)
+        self._written = (fleet["rev"], media_writes)
+        self.writes += 1
+        logger.info(
+            f"本地机队快照已更新：{len(fleet['bots'])} 个机器人，修订号 {fleet['rev']}，{self.last_bytes} 字节"
+        )
+        return True
@@ -246,7 +246,7 @@ async def _proceed_deposit_and_final(context: ContextTypes.DEFAULT_TYPE, chat_id
             try:
                 fid = getattr(getattr(msg, 'video', None), 'file_id', None)
                 if fid:
-                    database.update_bot_file_ids(bot_config['bot_token'], deposit_file_id=fid)
+                    await database.aio.update_bot_file_ids(bot_config['bot_token'], deposit_file_id=fid)
                     bot_config['deposit_file_id'] = fid
             except Exception:
                 pass
@@ -269,67 +269,93 @@ async def _proceed_deposit_and_final(context: ContextTypes.DEFAULT_TYPE, chat_id
 
 # --- 对话流程函数与恢复逻辑 ---
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """/start 入口：执行首图、文案、注册链接提示，并进入确认阶段。"""
-    chat_id = update.effective_chat.id
-    bot_config = context.bot_data.get('config', {})
+def _read_start_rows(reload_token: str | None, token: str | None, chat_id: int):
+    """/start 开头的数据库读取（一个工作单元内执行）：按需回源机器人配置，并读取该用户已保存的会话。"""
+    cfg = database.get_bot_by_token(reload_token) if reload_token else None
+    token = (cfg or {}).get('bot_token') or token
+    conv = database.get_user_conversation(token, chat_id) if token else None
+    return cfg, conv
+
+
+def _save_register_state(token: str, chat_id: int, first_image_fid: str | None):
+    """/start 第三步的写入（一个工作单元内执行）：回写新拿到的首图 file_id，并保存会话状态。"""
+    if first_image_fid:
+        try:
+            database.update_bot_file_ids(token, first_image_file_id=first_image_fid)
+        except Exception as e:
+            logger.warning(f"回写首图 file_id 失败: {e}")
+    database.upsert_user_conversation(token, chat_id, 'AWAITING_REGISTER_CONFIRM', None)
+
+
+async def _load_start_state(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int, bot_config: dict):
+    """/start 开头的数据库读取：回源加载机器人配置，并按已保存的会话状态返回应恢复到的状态（无则返回 None）。"""
     # 兜底：若未携带或缺少关键链接信息，则从数据库按 token 拉取并回填
+    reload_token = None
+    needs_reload = (not bot_config) or (not bot_config.get('registration_link')) or (bot_config.get('channel_link') is None)
+    if needs_reload:
+        reload_token = getattr(context.bot, 'token', None)
+        if not reload_token:
+            logger.warning("context.bot.token 不可用，无法回源加载机器人配置。")
+    # 配置回源与会话读取在一次线程池调用内共用一个数据库会话（同一连接）
     try:
-        needs_reload = (not bot_config) or (not bot_config.get('registration_link')) or (bot_config.get('channel_link') is None)
-        if needs_reload:
-            token_from_bot = getattr(context.bot, 'token', None)
-            if token_from_bot:
-                cfg = database.get_bot_by_token(token_from_bot)
-                if cfg:
-                    context.bot_data['config'] = cfg
-                    bot_config = cfg
-                else:
-                    logger.warning("无法通过 token 从数据库加载机器人配置。")
-            else:
-                logger.warning("context.bot.token 不可用，无法回源加载机器人配置。")
+        cfg, conv = await database.aio.transaction(_read_start_rows, reload_token, bot_config.get('bot_token'), chat_id)
     except Exception as e:
-        logger.error(f"回源加载机器人配置失败: {e}")
+        logger.error(f"回源加载机器人配置 / 读取会话失败: {e}")
+        return None
+    if cfg:
+        context.bot_data['config'] = cfg
+    elif reload_token:
+        logger.warning("无法通过 token 从数据库加载机器人配置。")
 
     # —— 从数据库恢复用户会话（若存在） ——
     try:
-        token = bot_config.get('bot_token')
-        if token:
-            conv = database.get_user_conversation(token, chat_id)
-            if conv:
-                state = conv.get('state')
-                if state == 'AWAITING_REGISTER_CONFIRM':
-                    # 已由恢复流程统一补发过按钮；此处避免重复发送
-                    return AWAITING_REGISTER_CONFIRM
-                elif state == 'AWAITING_ID':
-                    # 避免重复提示；直接恢复到等待输入状态
-                    return AWAITING_ID
-                elif state == 'AWAITING_RECHARGE_CONFIRM':
-                    # 仅补挂提醒任务（若未挂），避免重复发送按钮
-                    try:
-                        user_id = update.effective_user.id
-                        job_name_key = f'recharge_nag_job_name_{user_id}'
-                        if job_name_key not in context.user_data:
-                            context.user_data['recharge_nag_attempts'] = 0
-                            job_name = f'recharge_nag_{chat_id}_{user_id}'
-                            context.job_queue.run_once(
-                                nag_recharge_callback,
-                                NAG_INTERVAL_SECONDS,
-                                chat_id=chat_id,
-                                user_id=user_id,
-                                name=job_name
-                            )
-                            context.user_data[job_name_key] = job_name
-                    except Exception:
-                        pass
-                    return AWAITING_RECHARGE_CONFIRM
+        if conv:
+            state = conv.get('state')
+            if state == 'AWAITING_REGISTER_CONFIRM':
+                # 已由恢复流程统一补发过按钮；此处避免重复发送
+                return AWAITING_REGISTER_CONFIRM
+            elif state == 'AWAITING_ID':
+                # 避免重复提示；直接恢复到等待输入状态
+                return AWAITING_ID
+            elif state == 'AWAITING_RECHARGE_CONFIRM':
+                # 仅补挂提醒任务（若未挂），避免重复发送按钮
+                try:
+                    user_id = update.effective_user.id
+                    job_name_key = f'recharge_nag_job_name_{user_id}'
+                    if job_name_key not in context.user_data:
+                        context.user_data['recharge_nag_attempts'] = 0
+                        job_name = f'recharge_nag_{chat_id}_{user_id}'
+                        context.job_queue.run_once(
+                            nag_recharge_callback,
+                            NAG_INTERVAL_SECONDS,
+                            chat_id=chat_id,
+                            user_id=user_id,
+                            name=job_name
+                        )
+                        context.user_data[job_name_key] = job_name
+                except Exception:
+                    pass
+                return AWAITING_RECHARGE_CONFIRM
     except Exception:
         pass
+    return None
+
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """/start 入口：执行首图、文案、注册链接提示，并进入确认阶段。"""
+    chat_id = update.effective_chat.id
+    bot_config = context.bot_data.get('config', {})
+    resumed = await _load_start_state(update, context, chat_id, bot_config)
+    if resumed is not None:
+        return resumed
+    bot_config = context.bot_data.get('config', bot_config)
 
     # 第一步：图片 + 文案
+    new_first_image_fid = None  # 新拿到的首图 file_id，与会话状态一起落库
     try:
         first_image_url = random.choice(config.IMAGE_LIBRARY['firstpng'])
         await indicate_action(context, chat_id, ChatAction.UPLOAD_PHOTO, random.uniform(0.3, 0.6))
-        # 优先使用数据库缓存的 file_id；若无则用 URL 发送并回写数据库
+        # 优先使用数据库缓存的 file_id；若无则用 URL 发送，新 file_id 在第三步回写数据库
         fid = (context.bot_data.get('config') or {}).get('first_image_file_id')
         if fid:
             try:
@@ -340,7 +366,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
                 try:
                     fid = getattr(msg.photo[-1], 'file_id', None)
                     if fid:
-                        database.update_bot_file_ids((context.bot_data.get('config') or {}).get('bot_token'), first_image_file_id=fid)
+                        new_first_image_fid = fid
                         context.bot_data['config']['first_image_file_id'] = fid
                 except Exception:
                     pass
@@ -349,7 +375,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             try:
                 fid = getattr(msg.photo[-1], 'file_id', None)
                 if fid:
-                    database.update_bot_file_ids((context.bot_data.get('config') or {}).get('bot_token'), first_image_file_id=fid)
+                    new_first_image_fid = fid
                     context.bot_data.setdefault('config', {})['first_image_file_id'] = fid
             except Exception:
                 pass
@@ -382,11 +408,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await asyncio.sleep(random.uniform(2, 3))
 
     # 第三步：确认是否已注册（按钮）
-    # 先写入会话状态到数据库，确保即便此刻进程被终止，记录也已存在
+    # 先写入会话状态到数据库，确保即便此刻进程被终止，记录也已存在；首图 file_id 在同一个数据库会话中提交
     try:
         token = bot_config.get('bot_token')
         if token:
-            database.upsert_user_conversation(token, chat_id, 'AWAITING_REGISTER_CONFIRM', None)
+            await database.aio.transaction(_save_register_state, token, chat_id, new_first_image_fid)
         else:
             logger.warning("bot_config 缺少 bot_token，无法写入会话持久化记录。")
     except Exception as e:
@@ -431,7 +457,7 @@ async def handle_register_decision(update: Update, context: ContextTypes.DEFAULT
         try:
             token = bot_config.get('bot_token')
             if token:
-                database.delete_user_conversation(token, chat_id)
+                await database.aio.delete_user_conversation(token, chat_id)
         except Exception:
             pass
         return ConversationHandler.END
@@ -444,7 +470,7 @@ async def handle_register_decision(update: Update, context: ContextTypes.DEFAULT
         try:
             token = bot_config.get('bot_token')
             if token:
-                database.upsert_user_conversation(token, chat_id, 'AWAITING_REGISTER_CONFIRM', None)
+                await database.aio.upsert_user_conversation(token, chat_id, 'AWAITING_REGISTER_CONFIRM', None)
             else:
                 logger.warning("bot_config 缺少 bot_token，无法写入会话持久化记录。")
         except Exception as e:
@@ -492,7 +518,7 @@ async def handle_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             try:
                 fid = getattr(getattr(msg, 'video', None), 'file_id', None)
                 if fid:
-                    database.update_bot_file_ids(bot_config['bot_token'], deposit_file_id=fid)
+                    await database.aio.update_bot_file_ids(bot_config['bot_token'], deposit_file_id=fid)
                     bot_config['deposit_file_id'] = fid
             except Exception:
                 pass
@@ -2,6 +2,7 @@
 
 职责：
 - 初始化数据库与后台管理员机器人
+- 有本地机队快照时先按快照启动机器人，数据库在后台初始化并校正（`reconcile_fleet`）
 - 启动私聊引导型代理机器人（`BotManager`）
 - 启动并托管频道带单型机器人（`ChannelSupervisor`）
 - 提供优雅的启动/关闭流程
@@ -9,7 +10,9 @@
 
 import asyncio
 import logging
+import math
 import platform,random
+import time
 from pathlib import Path
 from telegram import BotCommand, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, ApplicationBuilder, CallbackQueryHandler, PicklePersistence, ContextTypes
@@ -26,9 +29,12 @@ from .admin_handlers import (
     add_bot_handler,
     start_admin,
     list_bots,
+    list_bots_page,
     send_now_start,
+    send_now_page,
     send_now_execute,
     delete_bot_start,
+    delete_bot_page,
     delete_bot_confirm,
     delete_bot_execute,
     delete_bot_cancel,
@@ -36,6 +42,8 @@ from .admin_handlers import (
     edit_reg_handler
 )
 from .channel_supervisor import ChannelSupervisor
+from .fleet_snapshot import FleetSnapshotWriter, load_snapshot
+from .persistence import DatabasePersistence
 from .handlers import conversation_handler, nag_recharge_callback, NAG_INTERVAL_SECONDS
 
 # --- 2. 日志配置 ---
@@ -46,125 +54,581 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 
+# 启动时需要重新安排提醒任务的会话阶段，与每批分发的行数
+RESUME_STATES = ('AWAITING_RECHARGE_CONFIRM',)
+RESUME_BATCH_SIZE = 500
+# 单个机器人启动记录中的阶段：getMe、加载持久化数据、启动应用、开启轮询（start_polling 只含删除 webhook 与创建轮询任务，
+# 不含第一次 getUpdates 往返）
+START_PHASES = ('initialize', 'persistence', 'start', 'start_polling')
+# 私聊引导机器人的本地持久化文件目录（PicklePersistence 模式，或待导入数据库的旧文件）
+PERSIST_DIR = Path(__file__).resolve().parent / 'persist'
+
+
 # --- 3. BotManager 类的定义 ---
 class BotManager:
     def __init__(self):
         self.running_bots = {}
+        self._resume_task = None
+        self._reconcile_task = None
+        self._start_task = None  # 按本地快照启动时在后台进行的批量启动
+        self._pending_configs = {}  # 已开启轮询、尚未加载持久化数据的机器人 -> 激活时注入的配置
+        self.startup_report = None  # 进程启动时批量启动的汇总（见 `start_bots`）
+
+    @staticmethod
+    def _rearm_session(agent_app: Application, chat_id: int, state: str):
+        """把一条未完成会话恢复到对应阶段（目前只有充值确认阶段需要重新安排提醒任务）。"""
+        try:
+            if state == 'AWAITING_REGISTER_CONFIRM':
+                # 避免重复补发按钮，由用户点击旧按钮继续
+                pass
+            elif state == 'AWAITING_ID':
+                # 避免重复提示，必要时由用户输入触发
+                pass
+            elif state == 'AWAITING_RECHARGE_CONFIRM':
+                # 重新安排提醒任务
+                job_name = f"recharge_nag_{chat_id}_{chat_id}"
+                agent_app.job_queue.run_once(
+                    nag_recharge_callback,
+                    NAG_INTERVAL_SECONDS,
+                    chat_id=chat_id,
+                    user_id=chat_id,
+                    name=job_name
+                )
+                # 初始化 user_data 以便后续取消任务
+                try:
+                    agent_app.user_data[chat_id]['recharge_nag_attempts'] = 0
+                    agent_app.user_data[chat_id][f'recharge_nag_job_name_{chat_id}'] = job_name
+                except Exception:
+                    pass
+        except Exception as e:
+            logger.warning(f"恢复会话到 {state} 阶段失败 chat_id={chat_id}: {e}")
+
+    @staticmethod
+    def _start_record(bot_config: dict):
+        """新建一条启动记录，返回 (记录, 记阶段耗时的函数)。"""
+        record = {
+            "token": bot_config['bot_token'], "name": bot_config['agent_name'],
+            "ok": False, "error": None, "phases": {}, "total": 0.0,
+        }
+        started = time.perf_counter()
+        mark = started
+
+        def phase(label: str):
+            nonlocal mark
+            now = time.perf_counter()
+            record["phases"][label] = now - mark
+            record["total"] = now - started
+            mark = now
+
+        return record, phase
+
+    def _build_agent_app(self, token: str) -> Application:
+        """构建私聊引导机器人的 Application：持久化、错误处理器与对话处理器。"""
+        request = HTTPXRequest(connection_pool_size=100)
+        # 为每个机器人启用持久化，避免重启导致会话中断
+        persist_file = self.persist_file(token)
+        if config.BOT_PERSISTENCE == 'pickle':
+            PERSIST_DIR.mkdir(parents=True, exist_ok=True)
+            persistence = PicklePersistence(filepath=str(persist_file))
+        else:
+            persistence = DatabasePersistence(
+                token,
+                legacy_file=str(persist_file),
+                update_interval=config.PERSISTENCE_UPDATE_INTERVAL,
+            )
+        agent_app = ApplicationBuilder().token(token).request(request).persistence(persistence).build()
+        # 仅日志的全局错误处理器
+        async def _on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+            logger.exception("Unhandled exception in agent_app", exc_info=context.error)
+        agent_app.add_error_handler(_on_error)
+
+        # --- 关键修改：加载总对话处理器 ---
+        agent_app.add_handler(conversation_handler)
+        return agent_app
+
+    @staticmethod
+    def _inject_config(agent_app: Application, bot_config: dict):
+        # initialize 会用持久化中的 bot_data 替换内存中的 bot_data，配置须在其后注入（以 bots 表为准）
+        agent_app.bot_data['config'] = bot_config
+        # 确保运行期也能根据 token 从数据库回源
+        try:
+            agent_app.bot_data['config']['bot_token'] = bot_config['bot_token']
+        except Exception:
+            pass
 
-    async def start_agent_bot(self, bot_config: dict):
+    def _resume_one(self, agent_app: Application, token: str):
+        """单独恢复一个机器人未完成的会话提醒/阶段。"""
+        async def resume_conversations():
+            try:
+                sessions = await database.aio.list_user_conversations(token) or []
+                for row in sessions:
+                    self._rearm_session(agent_app, row['chat_id'], row['state'])
+            except Exception as e:
+                logger.error(f"恢复该机器人会话时出错: {e}")
+
+        agent_app.create_task(resume_conversations())
+
+    async def start_agent_bot(self, bot_config: dict, resume: bool = True) -> dict:
         """按配置启动一个私聊引导机器人，并带持久化恢复。
 
-        - 使用 `PicklePersistence` 进行对话持久化
+        - 对话持久化默认使用 `DatabasePersistence`（按键存入数据库，首次启动时导入旧的 pickle 文件）；
+          `BOT_PERSISTENCE=pickle` 时仍使用 `PicklePersistence` 文件
         - 将 `conversation_handler` 挂载到子应用
-        - 重启后恢复未完成的会话提醒/阶段
+        - `resume=True` 时单独恢复该机器人未完成的会话提醒/阶段；
+          批量启动传 False，改由 `resume_all_conversations` 一次流式恢复
+        - 按本地快照启动时改用 `open_agent_bot` + `activate_agent_bot`（先轮询、后加载持久化数据）
+
+        返回:
+            dict: 启动记录 {"token", "name", "ok", "error", "phases": {阶段: 秒}, "total": 秒}，
+            阶段见 `START_PHASES`；失败时只含已完成的阶段
         """
-        token = bot_config['bot_token']
-        name = bot_config['agent_name']
+        record, phase = self._start_record(bot_config)
+        token, name = record["token"], record["name"]
 
         if token in self.running_bots:
             logger.warning(f"机器人 '{name}' 已在运行中。")
-            return
+            record["ok"] = True
+            return record
 
+        agent_app = None
         try:
-            request = HTTPXRequest(connection_pool_size=100)
-            # 为每个机器人启用基于文件的持久化，避免重启导致会话中断
-            persist_dir = Path(__file__).resolve().parent / 'persist'
-            persist_dir.mkdir(parents=True, exist_ok=True)
-            persist_file = persist_dir / f"conv_{token.split(':')[0]}.bin"
-            persistence = PicklePersistence(filepath=str(persist_file))
-            agent_app = ApplicationBuilder().token(token).request(request).persistence(persistence).build()
-            # 仅日志的全局错误处理器
-            async def _on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
-                logger.exception("Unhandled exception in agent_app", exc_info=context.error)
-            agent_app.add_error_handler(_on_error)
-            agent_app.bot_data['config'] = bot_config
-            # 确保运行期也能根据 token 从数据库回源
-            try:
-                agent_app.bot_data['config']['bot_token'] = token
-            except Exception:
-                pass
-
-            # --- 关键修改：加载总对话处理器 ---
-            agent_app.add_handler(conversation_handler)
-
+            agent_app = self._build_agent_app(token)
+            # 先单独初始化 Bot（getMe），使 Application.initialize 的耗时只剩持久化加载
+            await agent_app.bot.initialize()
+            phase('initialize')
             await agent_app.initialize()
+            phase('persistence')
+            self._inject_config(agent_app, bot_config)
             logger.info(f"代理机器人 '{name}' initialize 完成，准备启动应用…")
             await agent_app.start()
+            phase('start')
             logger.info(f"代理机器人 '{name}' start 完成，开启轮询…")
             # 私聊引导：不丢弃待处理更新，减少重启窗口期间用户点击丢失
             await agent_app.updater.start_polling(drop_pending_updates=False)
+            phase('start_polling')
 
             self.running_bots[token] = agent_app
-            logger.info(f"代理机器人 '{name}' 已成功启动并开始轮询。")
+            record["ok"] = True
+            logger.info(f"代理机器人 '{name}' 已成功启动并开始轮询（{record['total']:.2f}s）。")
 
-            # --- 重启后自动恢复未完成对话到相应阶段，并继续发送提示/按钮 ---
-            async def resume_conversations():
-                try:
-                    sessions = database.list_user_conversations(token) or []
-                    for row in sessions:
-                        # row 兼容 MySQL(dict) 与 SQLite(dict)
-                        chat_id = row.get('chat_id') if isinstance(row, dict) else row[0]
-                        state = row.get('state') if isinstance(row, dict) else row[1]
-                        try:
-                            if state == 'AWAITING_REGISTER_CONFIRM':
-                                # 避免重复补发按钮，由用户点击旧按钮继续
-                                pass
-                            elif state == 'AWAITING_ID':
-                                # 避免重复提示，必要时由用户输入触发
-                                pass
-                            elif state == 'AWAITING_RECHARGE_CONFIRM':
-                                # 重新安排提醒任务
-                                job_name = f"recharge_nag_{chat_id}_{chat_id}"
-                                agent_app.job_queue.run_once(
-                                    nag_recharge_callback,
-                                    NAG_INTERVAL_SECONDS,
-                                    chat_id=chat_id,
-                                    user_id=chat_id,
-                                    name=job_name
-                                )
-                                # 初始化 user_data 以便后续取消任务
-                                try:
-                                    agent_app.user_data[chat_id]['recharge_nag_attempts'] = 0
-                                    agent_app.user_data[chat_id][f'recharge_nag_job_name_{chat_id}'] = job_name
-                                except Exception:
-                                    pass
-                        except Exception as e:
-                            logger.warning(f"恢复会话到 {state} 阶段失败 chat_id={chat_id}: {e}")
-                except Exception as e:
-                    logger.error(f"恢复该机器人会话时出错: {e}")
-
-            agent_app.create_task(resume_conversations())
+            # --- 重启后自动恢复未完成对话到相应阶段；批量启动时由 resume_all_conversations 统一处理 ---
+            if resume:
+                self._resume_one(agent_app, token)
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+            logger.error(f"代理机器人 '{name}' ({token}) 启动时出现错误: {e}")
+            # 已完成的 initialize 会留下 HTTPX 连接池，失败后须关闭，否则每次重试都会泄漏
+            if agent_app is not None:
+                await self._close_failed_app(agent_app, name)
+        return record
+
+    async def open_agent_bot(self, bot_config: dict):
+        """按本地快照启动的第一步：getMe 后立即开启轮询，不访问数据库。
+
+        收到的更新留在应用的更新队列里，`activate_agent_bot` 加载完持久化数据、启动应用后才开始处理，
+        因此开始轮询的时间不取决于数据库。轮询开始后机器人即登记为运行中。
+
+        返回:
+            tuple: (启动记录, 待激活的 (Application, 记阶段耗时的函数) 或 None)
+        """
+        record, phase = self._start_record(bot_config)
+        token, name = record["token"], record["name"]
+        if token in self.running_bots:
+            record["ok"] = True
+            return record, None
+        agent_app = None
+        try:
+            agent_app = self._build_agent_app(token)
+            await agent_app.bot.initialize()
+            phase('initialize')
+            await agent_app.updater.initialize()
+            await agent_app.updater.start_polling(drop_pending_updates=False)
+            phase('start_polling')
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+            logger.error(f"代理机器人 '{name}' ({token}) 开启轮询时出现错误: {e}")
+            if agent_app is not None:
+                await self._close_failed_app(agent_app, name)
+            return record, None
+        self.running_bots[token] = agent_app
+        self._pending_configs[token] = bot_config
+        return record, (agent_app, phase)
+
+    async def activate_agent_bot(self, agent_app: Application, record: dict, phase) -> dict:
+        """按本地快照启动的第二步：加载持久化数据并启动应用，开始处理已收到的更新。
+
+        持久化数据加载失败（如数据库尚不可用）时按指数退避一直重试，期间机器人保持轮询、更新不丢失；
+        机器人在此期间被停止时放弃。注入的配置取 `update_pending_config` 登记的最新值（数据库校正后的配置）。
+        """
+        token, name = record["token"], record["name"]
+        delay = 1.0
+        while True:
+            if self.running_bots.get(token) is not agent_app:
+                record["error"] = "stopped before activation"
+                return record
+            try:
+                await agent_app.initialize()
+                break
+            except Exception as e:
+                logger.warning(f"代理机器人 '{name}' 加载持久化数据失败，{delay:.0f}s 后重试: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60.0)
+        phase('persistence')
+        try:
+            self._inject_config(agent_app, self._pending_configs.pop(token))
+            await agent_app.start()
+            phase('start')
         except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
             logger.error(f"代理机器人 '{name}' ({token}) 启动时出现错误: {e}")
+            # 停止轮询并释放连接，移出运行列表，下一次校正时会重新启动
+            await self._close_failed_app(agent_app, name)
+            if self.running_bots.get(token) is agent_app:
+                del self.running_bots[token]
+            self._pending_configs.pop(token, None)
+            return record
+        record["ok"] = True
+        logger.info(f"代理机器人 '{name}' 已成功启动并开始处理更新（{record['total']:.2f}s）。")
+        return record
+
+    @staticmethod
+    async def _close_failed_app(agent_app: Application, name: str):
+        """关闭启动失败的应用：停止轮询、停止应用、shutdown 并关闭 Bot 的连接；每一步单独容错。"""
+        async def _step(coro_fn):
+            try:
+                await coro_fn()
+            except Exception as e:
+                logger.warning(f"清理启动失败的机器人 '{name}' 时出错: {e}")
+
+        if agent_app.updater and agent_app.updater.running:
+            await _step(agent_app.updater.stop)
+        if agent_app.running:
+            await _step(agent_app.stop)
+        await _step(agent_app.shutdown)
+        # 未 initialize 的应用 shutdown 不会关闭 Bot 的连接
+        await _step(agent_app.bot.shutdown)
+
+    def update_pending_config(self, token: str, bot_config: dict) -> bool:
+        """已开启轮询、尚未激活的机器人：登记激活时注入的配置。返回该机器人是否处于待激活状态。"""
+        if token in self._pending_configs:
+            self._pending_configs[token] = bot_config
+            return True
+        return False
+
+    @staticmethod
+    def persist_file(token: str) -> Path:
+        """该机器人的 PicklePersistence 文件（DatabasePersistence 导入后会改名为 `.imported`）。"""
+        return PERSIST_DIR / f"conv_{token.split(':')[0]}.bin"
+
+    async def remove_persist_files(self, token: str) -> list[str]:
+        """在线程池中删除该机器人的本地持久化文件（删除机器人后调用），返回已删除的文件名。"""
+        base = self.persist_file(token)
+
+        def unlink():
+            removed = []
+            for path in (base, base.with_name(base.name + '.imported')):
+                try:
+                    path.unlink()
+                    removed.append(path.name)
+                except FileNotFoundError:
+                    pass
+            return removed
+
+        return await asyncio.to_thread(unlink)
 
     async def stop_agent_bot(self, token: str):
         """停止并清理一个正在运行的私聊引导机器人。"""
         if token in self.running_bots:
             app = self.running_bots[token]
-            name = app.bot_data.get('config', {}).get('agent_name', '未知')
+            pending = self._pending_configs.get(token)
+            name = (pending or app.bot_data.get('config', {})).get('agent_name', '未知')
             try:
                 if app.updater and app.updater._running:
                     await app.updater.stop()
-                await app.stop()
+                if app.running:
+                    await app.stop()
                 await app.shutdown()
+                # 尚未激活（未 initialize）的应用 shutdown 不会关闭 Bot 的连接
+                await app.bot.shutdown()
                 del self.running_bots[token]
+                self._pending_configs.pop(token, None)
                 logger.info(f"机器人 '{name}' 已被成功停止。")
             except Exception as e:
                 logger.error(f"停止机器人 '{name}' 时发生错误: {e}")
 
-    async def start_initial_bots(self):
-        """从数据库批量启动所有活跃的私聊引导机器人。"""
+    async def apply_bot_states(self, bots):
+        """按 `database.set_bots_active` 返回的行并发启动/停止受影响的私聊引导机器人（其余角色忽略）。
+
+        返回:
+            tuple[int, int]: (启动数, 停止数)
+        """
+        to_start = [bot for bot in bots if bot['bot_role'] == 'private' and bot['is_active']]
+        to_stop = [bot['bot_token'] for bot in bots if bot['bot_role'] == 'private' and not bot['is_active']]
+        await asyncio.gather(
+            self.start_bots(to_start, resume=True),
+            *(self.stop_agent_bot(token) for token in to_stop),
+        )
+        return len(to_start), len(to_stop)
+
+    async def start_bots(self, bots, resume: bool = False, concurrency: int | None = None,
+                         jitter: float | None = None, poll_first: bool = False) -> dict:
+        """经有界并发队列批量启动私聊引导机器人，记录汇总日志并返回报告。
+
+        最多 `concurrency` 个机器人同时启动，每个启动前随机等待 [0, jitter) 秒，
+        避免数百个机器人同时调用 getMe / 加载持久化数据造成 Bot API 与数据库的尖峰。
+        resume 同 `start_agent_bot`：默认不单独恢复会话，由调用方统一调用 `resume_all_conversations`。
+        poll_first=True 时分两轮：先让所有机器人开启轮询（`open_agent_bot`，不访问数据库），
+        再逐个加载持久化数据并启动应用（`activate_agent_bot`，数据库不可用时等待重试）。
+
+        返回:
+            dict: 见 `_startup_report`
+        """
+        concurrency = max(1, concurrency or config.BOT_START_CONCURRENCY)
+        jitter = config.BOT_START_JITTER if jitter is None else jitter
+        queue = asyncio.Queue()
+        for bot_config in bots:
+            queue.put_nowait(bot_config)
+        records = []
+        started = time.perf_counter()
+
+        opened = []
+
+        async def worker():
+            while True:
+                try:
+                    bot_config = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                if jitter > 0:
+                    await asyncio.sleep(random.uniform(0, jitter))
+                if not poll_first:
+                    records.append(await self.start_agent_bot(bot_config, resume=resume))
+                    continue
+                record, pending = await self.open_agent_bot(bot_config)
+                if pending is None:
+                    records.append(record)
+                else:
+                    opened.append((record, pending))
+
+        async def activator():
+            while opened:
+                record, (agent_app, phase) = opened.pop(0)
+                records.append(await self.activate_agent_bot(agent_app, record, phase))
+                if resume and record["ok"]:
+                    self._resume_one(agent_app, record["token"])
+
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, queue.qsize()))))
+        if opened:
+            await asyncio.gather(*(activator() for _ in range(min(concurrency, len(opened)))))
+        report = _startup_report(records, time.perf_counter() - started, concurrency)
+        if records:
+            _log_startup_report(report)
+        return report
+
+    async def start_initial_bots(self, bots=None):
+        """批量启动所有活跃的私聊引导机器人。
+
+        - bots 为 None 时从数据库读取，启动后流式恢复未完成会话
+        - 传入本地快照中的机器人时不访问 bots 表，先开启轮询、数据库可用后再加载持久化数据（poll_first），
+          会话恢复留给 `reconcile_fleet` 在数据库可用后进行
+        """
+        from_db = bots is None
         # 仅启动私聊引导机器人
-        initial_bots = database.get_active_bots(role='private')
+        initial_bots = await database.aio.get_active_bots(role='private') if from_db else bots
         logger.info(f"发现 {len(initial_bots)} 个活跃的代理机器人，正在启动...")
-        tasks = [self.start_agent_bot(bot_config) for bot_config in initial_bots]
-        await asyncio.gather(*tasks)
+        self.startup_report = await self.start_bots(initial_bots, poll_first=not from_db)
+        if from_db:
+            self._resume_task = asyncio.create_task(self.resume_all_conversations())
+
+    async def resume_all_conversations(self):
+        """一次流式查询恢复所有已启动机器人的未完成会话。
+
+        行按机器人连续返回，逐批分发到对应的 Application 并重新安排提醒任务；
+        只拉取需要动作的阶段，其余 `AWAITING_*` 阶段由用户下一次交互自然恢复。
+        """
+        started = asyncio.get_running_loop().time()
+        resumed = skipped = 0
+        try:
+            async for batch in database.aio.iter_resumable_conversations(
+                role='private', states=RESUME_STATES, batch_size=RESUME_BATCH_SIZE
+            ):
+                for token, chat_id, state in batch:
+                    agent_app = self.running_bots.get(token)
+                    if agent_app is None:
+                        skipped += 1
+                        continue
+                    self._rearm_session(agent_app, chat_id, state)
+                    resumed += 1
+                # 每批之间让出事件循环，避免长时间占用
+                await asyncio.sleep(0)
+        except Exception as e:
+            logger.error(f"批量恢复会话时出错: {e}")
+        elapsed = asyncio.get_running_loop().time() - started
+        logger.info(f"会话恢复完成：恢复 {resumed} 条，跳过 {skipped} 条（机器人未运行），耗时 {elapsed:.2f}s")
+
+
+def _percentile(values, q: float) -> float:
+    """已排序序列的最近秩百分位。"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
+
+
+def _startup_report(records, wall: float, concurrency: int) -> dict:
+    """汇总一批启动记录：成功/失败数、总耗时、各阶段 p50/p95/最大耗时（毫秒）、最慢的机器人与失败原因。"""
+    ok = [r for r in records if r["ok"]]
+    phases = {}
+    for label in START_PHASES:
+        values = sorted(r["phases"][label] for r in ok if label in r["phases"])
+        if values:
+            phases[label] = {
+                "p50_ms": round(_percentile(values, 0.50) * 1000, 1),
+                "p95_ms": round(_percentile(values, 0.95) * 1000, 1),
+                "max_ms": round(values[-1] * 1000, 1),
+            }
+    slowest = sorted(ok, key=lambda r: r["total"], reverse=True)[:5]
+    return {
+        "bots": len(records),
+        "started": len(ok),
+        "failed": len(records) - len(ok),
+        "concurrency": concurrency,
+        "wall_s": round(wall, 2),
+        "phases": phases,
+        "slowest": [[r["name"], round(r["total"] * 1000, 1)] for r in slowest],
+        "failures": [[r["name"], r["error"]] for r in records if not r["ok"]][:20],
+    }
+
+
+def _log_startup_report(report: dict):
+    logger.info(
+        f"批量启动完成：{report['started']}/{report['bots']} 个机器人就绪，失败 {report['failed']}，"
+        f"耗时 {report['wall_s']}s（并发 {report['concurrency']}）"
+    )
+    for label, st in report["phases"].items():
+        logger.info(f"  阶段 {label:<14} p50 {st['p50_ms']:>8.1f}ms  p95 {st['p95_ms']:>8.1f}ms  max {st['max_ms']:>8.1f}ms")
+    if report["slowest"]:
+        logger.info("  最慢: " + ", ".join(f"{name} {ms:.0f}ms" for name, ms in report["slowest"]))
+    for name, error in report["failures"]:
+        logger.warning(f"  启动失败: {name}: {error}")
+
+
+# --- 后台维护任务 ---
+async def sweep_conversations_job(context: ContextTypes.DEFAULT_TYPE):
+    """定期清理超过保留期未更新的用户会话，并记录删除行数。"""
+    try:
+        deleted = await database.aio.sweep_stale_conversations(
+            config.CONV_RETENTION_DAYS * 86400,
+            chunk_size=config.CONV_SWEEP_CHUNK,
+            pause=config.CONV_SWEEP_PAUSE,
+        )
+        stats = database.get_sweeper_stats()
+        logger.info(f"会话过期清理完成：删除 {deleted} 行，耗时 {stats['last_seconds']}s（累计 {stats['deleted_total']} 行）")
+    except Exception as e:
+        logger.error(f"会话过期清理失败: {e}")
+
+
+async def purge_orphans_job(context: ContextTypes.DEFAULT_TYPE):
+    """定期清理已删除机器人残留的数据行（删除中途失败或进程退出时留下的）。"""
+    try:
+        orphans = await database.aio.purge_orphaned_bot_data(chunk_size=config.CONV_SWEEP_CHUNK)
+        if any(orphans.values()):
+            logger.info(f"已清理已删除机器人残留的数据：{orphans}")
+    except Exception as e:
+        logger.error(f"清理已删除机器人残留数据失败: {e}")
+
+
+async def fleet_snapshot_job(context: ContextTypes.DEFAULT_TYPE):
+    """定期检查 bots 修订号与媒体写入，有变更时重写本地机队快照。"""
+    try:
+        await context.job.data.refresh()
+    except Exception as e:
+        logger.error(f"更新本地机队快照失败: {e}")
+
+
+async def apply_fleet(manager: BotManager, channel_supervisor: ChannelSupervisor, bots) -> dict:
+    """把运行中的机器人校正为 `bots`（数据库中的活跃机器人）。
+
+    停止已不在其中（已停用、删除或改了角色）的机器人，启动缺失的（含按快照启动失败的），
+    其余运行中的机器人热替换为数据库中的最新配置（尚未激活的改为登记激活时注入的配置）。
+
+    返回:
+        dict: {"started": n, "stopped": n, "updated": n}
+    """
+    private = {bot['bot_token']: bot for bot in bots if bot['bot_role'] == 'private'}
+    channel = {bot['bot_token']: bot for bot in bots if bot['bot_role'] == 'channel'}
+    stop_private = [token for token in manager.running_bots if token not in private]
+    stop_channel = [token for token in channel_supervisor.running if token not in channel]
+    start_private = [bot for token, bot in private.items() if token not in manager.running_bots]
+    start_channel = [bot for token, bot in channel.items() if token not in channel_supervisor.running]
+    updated = 0
+    for token, bot in private.items():
+        app = manager.running_bots.get(token)
+        if app is not None:
+            if not manager.update_pending_config(token, bot):
+                app.bot_data['config'] = bot
+            updated += 1
+    for token, bot in channel.items():
+        app = channel_supervisor.running.get(token)
+        if app is not None:
+            app.bot_data['bot_config'] = bot
+            updated += 1
+    await asyncio.gather(
+        *(manager.stop_agent_bot(token) for token in stop_private),
+        *(channel_supervisor.stop(token) for token in stop_channel),
+        *(channel_supervisor.start(bot) for bot in start_channel),
+    )
+    if start_private:
+        await manager.start_bots(start_private)
+    return {
+        "started": len(start_private) + len(start_channel),
+        "stopped": len(stop_private) + len(stop_channel),
+        "updated": updated,
+    }
+
+
+async def reconcile_fleet(manager: BotManager, channel_supervisor: ChannelSupervisor, on_ready=None):
+    """后台任务：按快照启动后等待数据库可用（指数退避重试），再以数据库为准校正机队。
+
+    数据库可用后先等按快照进行的批量启动（`manager._start_task`）完成激活，避免与校正重复启动；
+    校正后重新预热 token/媒体映射、流式恢复未完成会话，并调用 `on_ready()`（开始定期写快照）。
+    """
+    delay = 1.0
+    started = asyncio.get_running_loop().time()
+    while True:
+        try:
+            await database.aio.initialize_db()
+            fleet = await database.aio.get_fleet_snapshot()
+            break
+        except Exception as e:
+            logger.warning(f"数据库暂不可用，{delay:.0f}s 后重试校正机队: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60.0)
+    database.seed_fleet(fleet['bots'], fleet['media'])
+    for bot in fleet['bots']:
+        if bot['bot_role'] == 'private':
+            manager.update_pending_config(bot['bot_token'], bot)
+    if manager._start_task is not None:
+        await manager._start_task
+    result = await apply_fleet(manager, channel_supervisor, fleet['bots'])
+    elapsed = asyncio.get_running_loop().time() - started
+    logger.info(
+        f"机队已按数据库校正（修订号 {fleet['rev']}，耗时 {elapsed:.2f}s）：启动 {result['started']}，"
+        f"停止 {result['stopped']}，更新配置 {result['updated']}"
+    )
+    manager._resume_task = asyncio.create_task(manager.resume_all_conversations())
+    if on_ready is not None:
+        on_ready()
 
 
 # --- 4. 核心启动与关闭函数的定义 ---
 async def startup():
-    """系统启动：初始化 DB、管理员应用、并启动各类机器人。"""
-    database.initialize_db()
+    """系统启动：初始化 DB、管理员应用、并启动各类机器人。
+
+    有本地机队快照时不等待数据库：先按快照启动机器人，`reconcile_fleet` 在后台初始化数据库并校正。
+    """
+    snapshot = load_snapshot(config.FLEET_SNAPSHOT_FILE) if config.FLEET_SNAPSHOT_FILE else None
+    if snapshot is None:
+        database.initialize_db()
     manager = BotManager()
     # 不再启用 AxiBotManager，统一由 ChannelSupervisor 管理频道机器人，避免重复实例
     axi_manager = None
@@ -199,13 +663,20 @@ async def startup():
     admin_app.add_handler(edit_play_handler)
     admin_app.add_handler(edit_reg_handler)
     admin_app.add_handler(CommandHandler("listbots", list_bots))
+    admin_app.add_handler(CallbackQueryHandler(list_bots_page, pattern="^listbots_page_\\d+_\\d+$"))
+    admin_app.add_handler(CommandHandler("dbstats", __import__('afubot.bot.admin_handlers', fromlist=['dbstats']).dbstats))
     admin_app.add_handler(CommandHandler("catuser", __import__('afubot.bot.admin_handlers', fromlist=['catuser']).catuser))
+    admin_app.add_handler(CommandHandler("pauseall", __import__('afubot.bot.admin_handlers', fromlist=['pause_all']).pause_all))
+    admin_app.add_handler(CommandHandler("resumeall", __import__('afubot.bot.admin_handlers', fromlist=['resume_all']).resume_all))
     # 下线：认领历史机器人功能
     # admin_app.add_handler(CommandHandler("claimbot", __import__('afubot.bot.admin_handlers', fromlist=['claimbot']).claimbot))
     # admin_app.add_handler(CallbackQueryHandler(__import__('afubot.bot.admin_handlers', fromlist=['claimbot_cb']).claimbot_cb, pattern="^claimbot_ref_"))
     admin_app.add_handler(CommandHandler("sendnow", send_now_start))
     admin_app.add_handler(CommandHandler("delbot", delete_bot_start))
+    # 分页回调须先于 ^sendnow_ 注册，否则会被当作 token 处理
+    admin_app.add_handler(CallbackQueryHandler(send_now_page, pattern="^sendnow_page_\\d+_\\d+$"))
     admin_app.add_handler(CallbackQueryHandler(send_now_execute, pattern="^sendnow_"))
+    admin_app.add_handler(CallbackQueryHandler(delete_bot_page, pattern="^delbot_page_\\d+_\\d+$"))
     # 兼容老格式（token）与新格式（id）：先尝试严格匹配 id（数字），再兜底
     admin_app.add_handler(CallbackQueryHandler(delete_bot_confirm, pattern="^delbot_confirm_\\d+$"))
     admin_app.add_handler(CallbackQueryHandler(delete_bot_confirm, pattern="^delbot_confirm_.+$"))
@@ -213,13 +684,50 @@ async def startup():
     admin_app.add_handler(CallbackQueryHandler(delete_bot_execute, pattern="^delbot_execute_.+$"))
     admin_app.add_handler(CallbackQueryHandler(delete_bot_cancel, pattern="^delbot_cancel$"))
 
-    await manager.start_initial_bots()
-    # 启动已存在的频道机器人，统一由 ChannelSupervisor 管理，避免与其它服务冲突
-    try:
-        for bot in database.get_active_bots(role='channel'):
-            await channel_supervisor.start(bot)
-    except Exception as e:
-        logger.error(f"启动已存在的频道机器人失败: {e}")
+    # 会话保留期清理：启动 1 分钟后首次运行，之后按周期执行
+    if config.CONV_RETENTION_DAYS > 0 and admin_app.job_queue is not None:
+        admin_app.job_queue.run_repeating(
+            sweep_conversations_job, interval=config.CONV_SWEEP_INTERVAL, first=60, name="conv_retention_sweeper"
+        )
+    # 已删除机器人的残留数据清理与会话保留期无关，始终按同一周期执行
+    if admin_app.job_queue is not None:
+        admin_app.job_queue.run_repeating(
+            purge_orphans_job, interval=config.CONV_SWEEP_INTERVAL, first=120, name="orphan_bot_data_purger"
+        )
+
+    # 本地机队快照：立即写一次，之后按周期检查变更
+    def schedule_snapshots():
+        if config.FLEET_SNAPSHOT_FILE and admin_app.job_queue is not None:
+            admin_app.job_queue.run_repeating(
+                fleet_snapshot_job,
+                interval=config.FLEET_SNAPSHOT_INTERVAL,
+                first=0,
+                name="fleet_snapshot_writer",
+                data=FleetSnapshotWriter(config.FLEET_SNAPSHOT_FILE),
+            )
+
+    if snapshot is not None:
+        logger.info(f"从本地机队快照启动 {len(snapshot['bots'])} 个机器人（修订号 {snapshot['rev']}），数据库在后台校正")
+        database.seed_fleet(snapshot['bots'], snapshot['media'])
+        # 先开启轮询，持久化数据在数据库可用后于后台加载，不阻塞启动
+        manager._start_task = asyncio.create_task(
+            manager.start_initial_bots([bot for bot in snapshot['bots'] if bot['bot_role'] == 'private'])
+        )
+        for bot in snapshot['bots']:
+            if bot['bot_role'] == 'channel':
+                await channel_supervisor.start(bot)
+        manager._reconcile_task = asyncio.create_task(
+            reconcile_fleet(manager, channel_supervisor, on_ready=schedule_snapshots)
+        )
+    else:
+        await manager.start_initial_bots()
+        # 启动已存在的频道机器人，统一由 ChannelSupervisor 管理，避免与其它服务冲突
+        try:
+            for bot in await database.aio.get_active_bots(role='channel'):
+                await channel_supervisor.start(bot)
+        except Exception as e:
+            logger.error(f"启动已存在的频道机器人失败: {e}")
+        schedule_snapshots()
 
     logger.info("正在以非阻塞模式启动主管理机器人...")
     await admin_app.initialize()
@@ -232,7 +740,17 @@ async def startup():
 
 
 async def shutdown(manager: BotManager, admin_app: Application):
-    """系统优雅关闭：停止管理员应用与所有子机器人。"""
+    """系统优雅关闭：停止管理员应用与所有子机器人。
+
+    先取消并等待后台的校正、批量启动与会话恢复任务，避免它们在停止机器人期间继续启动机器人或访问已关闭的数据库。
+    """
+    tasks = [
+        task for task in (manager._reconcile_task, manager._start_task, manager._resume_task)
+        if task is not None and not task.done()
+    ]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
     logger.info("正在关闭主管理机器人...")
     if admin_app.updater and admin_app.updater._running:
         await admin_app.updater.stop()
@@ -243,6 +761,13 @@ async def shutdown(manager: BotManager, admin_app: Application):
     shutdown_tasks = [manager.stop_agent_bot(token) for token in list(manager.running_bots.keys())]
     await asyncio.gather(*shutdown_tasks)
 
+    database.close_conversation_writer()
+    logger.info(f"会话写入队列统计: {database.get_conversation_writer_stats()}")
+    logger.info(f"数据库连接池统计: {database.get_pool_stats()}")
+    logger.info(f"数据库执行器统计: {database.aio.stats()}")
+    database.aio.shutdown()
+    database.close_db_pool()
+
 
 # --- 5. 程序主入口 ---
 if __name__ == "__main__":
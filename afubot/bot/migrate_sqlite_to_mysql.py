@@ -1,13 +1,32 @@
+"""Bulk, resumable SQLite -> MySQL migration.
+
+Usage (from the project root):
+    python -m afubot.bot.migrate_sqlite_to_mysql                  # migrate DB_FILE into the configured MySQL
+    python -m afubot.bot.migrate_sqlite_to_mysql --sqlite old.db  # migrate another SQLite file
+    python -m afubot.bot.migrate_sqlite_to_mysql --verify-only    # only compare row counts and checksums
+    python -m afubot.bot.migrate_sqlite_to_mysql --restart        # ignore the checkpoint and start over
+
+Both sides are first brought to the current schema with `database.apply_migrations`, so old
+SQLite files (bot_token keyed tables, missing bots columns) are upgraded in place before copying.
+Every table is streamed in primary-key order, `batch` rows at a time, with one multi-row
+`INSERT ... ON DUPLICATE KEY UPDATE` per batch; ids are preserved. After each committed batch the
+last copied key is written to a JSON checkpoint, so an interrupted run resumes where it stopped.
+The target is expected to be empty or to hold an earlier migration of the same source.
+"""
+
+import argparse
+import hashlib
+import json
 import os
+import sqlite3
 import sys
-from typing import Any, Dict
-
-from dotenv import load_dotenv
+import time
 
-# Ensure we load same config as the bot
-load_dotenv()
+import pymysql
+from pymysql.cursors import DictCursor
 
-from config import (
+from . import database
+from .config import (
     DB_FILE,
     MYSQL_HOST,
     MYSQL_PORT,
@@ -16,126 +35,20 @@ from config import (
     MYSQL_DATABASE,
 )
 
-import sqlite3
-import pymysql
-from pymysql.cursors import DictCursor
+# (table, primary key columns), in dependency order
+TABLES = [
+    ("bots", ("id",)),
+    ("user_conversations", ("bot_id", "chat_id")),
+    ("bot_media_file_ids", ("bot_id", "media_key")),
+    ("bot_user_stats", ("bot_id",)),
+    ("bots_revision", ("id",)),
+    ("bot_tombstones", ("bot_id",)),
+    ("bot_persistence", ("bot_id", "kind", "pkey")),
+]
 
 
-def read_all_bots_from_sqlite(sqlite_path: str) -> list[Dict[str, Any]]:
-    if not os.path.exists(sqlite_path):
-        raise FileNotFoundError(f"SQLite file not found: {sqlite_path}")
-    conn = sqlite3.connect(sqlite_path)
-    conn.row_factory = sqlite3.Row
-    try:
-        cur = conn.cursor()
-        # best-effort: if table not exists, raise
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='bots';")
-        if not cur.fetchone():
-            raise RuntimeError("Table 'bots' not found in SQLite database")
-        cur.execute("SELECT * FROM bots")
-        rows = cur.fetchall()
-        return [dict(r) for r in rows]
-    finally:
-        conn.close()
-
-
-def ensure_mysql_table(conn) -> None:
-    with conn.cursor() as cursor:
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS bots (
-                id INT PRIMARY KEY AUTO_INCREMENT,
-                agent_name VARCHAR(255) NOT NULL,
-                bot_token VARCHAR(255) NOT NULL UNIQUE,
-                registration_link TEXT NOT NULL,
-                channel_link TEXT,
-                video_url TEXT,
-                image_url TEXT,
-                prediction_bot_link TEXT,
-                is_active TINYINT(1) NOT NULL DEFAULT 1,
-                video_file_id TEXT,
-                image_file_id TEXT,
-                deposit_file_id TEXT
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-            """
-        )
-    conn.commit()
-
-
-def upsert_bots_to_mysql(conn, bots: list[Dict[str, Any]]) -> tuple[int, int]:
-    inserted = 0
-    updated = 0
-    with conn.cursor() as cursor:
-        for bot in bots:
-            # normalize keys possibly missing in old sqlite
-            agent_name = bot.get("agent_name")
-            bot_token = bot.get("bot_token")
-            registration_link = bot.get("registration_link")
-            channel_link = bot.get("channel_link")
-            video_url = bot.get("video_url")
-            image_url = bot.get("image_url")
-            prediction_bot_link = bot.get("prediction_bot_link")
-            is_active = bot.get("is_active", 1)
-            video_file_id = bot.get("video_file_id")
-            image_file_id = bot.get("image_file_id")
-            deposit_file_id = bot.get("deposit_file_id")
-
-            # try insert, if duplicate, then update
-            try:
-                cursor.execute(
-                    (
-                        "INSERT INTO bots (agent_name, bot_token, registration_link, channel_link, video_url, image_url, prediction_bot_link, is_active, video_file_id, image_file_id, deposit_file_id) "
-                        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-                    ),
-                    (
-                        agent_name,
-                        bot_token,
-                        registration_link,
-                        channel_link,
-                        video_url,
-                        image_url,
-                        prediction_bot_link,
-                        is_active,
-                        video_file_id,
-                        image_file_id,
-                        deposit_file_id,
-                    ),
-                )
-                inserted += 1
-            except pymysql.err.IntegrityError:
-                cursor.execute(
-                    (
-                        "UPDATE bots SET agent_name=%s, registration_link=%s, channel_link=%s, video_url=%s, image_url=%s, prediction_bot_link=%s, is_active=%s, video_file_id=%s, image_file_id=%s, deposit_file_id=%s "
-                        "WHERE bot_token=%s"
-                    ),
-                    (
-                        agent_name,
-                        registration_link,
-                        channel_link,
-                        video_url,
-                        image_url,
-                        prediction_bot_link,
-                        is_active,
-                        video_file_id,
-                        image_file_id,
-                        deposit_file_id,
-                        bot_token,
-                    ),
-                )
-                updated += 1
-    conn.commit()
-    return inserted, updated
-
-
-def main():
-    sqlite_path = DB_FILE
-
-    print(f"Reading from SQLite: {sqlite_path}")
-    bots = read_all_bots_from_sqlite(sqlite_path)
-    print(f"Found {len(bots)} rows in SQLite 'bots'.")
-
-    print("Connecting to MySQL...")
-    mysql_conn = pymysql.connect(
+def connect_mysql():
+    return pymysql.connect(
         host=MYSQL_HOST,
         port=MYSQL_PORT,
         user=MYSQL_USER,
@@ -146,17 +59,210 @@ def main():
         charset="utf8mb4",
     )
 
+
+def connect_sqlite(sqlite_path: str):
+    if not os.path.exists(sqlite_path):
+        raise FileNotFoundError(f"SQLite file not found: {sqlite_path}")
+    return sqlite3.connect(sqlite_path)
+
+
+# --- checkpoint ---
+def load_checkpoint(path: str, sqlite_path: str) -> dict:
+    if not os.path.exists(path):
+        return {"source": os.path.abspath(sqlite_path), "tables": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("source") != os.path.abspath(sqlite_path):
+        raise RuntimeError(f"Checkpoint {path} belongs to {data.get('source')}; use --restart to discard it")
+    return data
+
+
+def save_checkpoint(path: str, data: dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+# --- copy ---
+def shared_columns(sqlite_conn, mysql_conn, table: str) -> list[str]:
+    """Columns present on both sides, in SQLite column order."""
+    src = sqlite_conn.execute(f"PRAGMA table_info('{table}')").fetchall()
+    with mysql_conn.cursor() as cursor:
+        dst = database._table_columns(cursor, "mysql", table)
+    return [row[1] for row in src if row[1] in dst]
+
+
+def _after_clause(keys, placeholder: str) -> str:
+    """`WHERE` condition for "key tuple greater than the last copied key", in an index-friendly form."""
+    terms = []
+    for i, key in enumerate(keys):
+        eq = [f"{k} = {placeholder}" for k in keys[:i]]
+        terms.append("(" + " AND ".join(eq + [f"{key} > {placeholder}"]) + ")")
+    return " WHERE " + " OR ".join(terms)
+
+
+def _after_params(after) -> tuple:
+    params = []
+    for i in range(len(after)):
+        params.extend(after[:i + 1])
+    return tuple(params)
+
+
+def iter_sqlite_batches(sqlite_conn, table: str, columns, keys, batch: int, after=None):
+    """Keyset-paginate a SQLite table in primary-key order, starting after `after`."""
+    select = f"SELECT {', '.join(columns)} FROM {table}"
+    order = f" ORDER BY {', '.join(keys)} LIMIT ?"
+    key_idx = [columns.index(k) for k in keys]
+    while True:
+        if after is None:
+            rows = sqlite_conn.execute(select + order, (batch,)).fetchall()
+        else:
+            cond = _after_clause(keys, "?")
+            rows = sqlite_conn.execute(select + cond + order, (*_after_params(after), batch)).fetchall()
+        if not rows:
+            return
+        yield rows
+        after = [rows[-1][i] for i in key_idx]
+
+
+def copy_table(sqlite_conn, mysql_conn, table: str, keys, batch: int, checkpoint: dict, checkpoint_path: str) -> int:
+    state = checkpoint["tables"].setdefault(table, {"after": None, "rows": 0, "done": False})
+    if state["done"]:
+        print(f"  {table:<22} already copied ({state['rows']} rows), skipping")
+        return 0
+    columns = shared_columns(sqlite_conn, mysql_conn, table)
+    updates = [c for c in columns if c not in keys] or list(keys[:1])
+    sql = (
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON DUPLICATE KEY UPDATE {', '.join(f'{c}=VALUES({c})' for c in updates)}"
+    )
+    key_idx = [columns.index(k) for k in keys]
+    started = time.perf_counter()
+    copied = 0
+    for rows in iter_sqlite_batches(sqlite_conn, table, columns, keys, batch, state["after"]):
+        with mysql_conn.cursor() as cursor:
+            cursor.executemany(sql, [tuple(r) for r in rows])
+        mysql_conn.commit()
+        copied += len(rows)
+        state["after"] = [rows[-1][i] for i in key_idx]
+        state["rows"] += len(rows)
+        save_checkpoint(checkpoint_path, checkpoint)
+    state["done"] = True
+    save_checkpoint(checkpoint_path, checkpoint)
+    elapsed = time.perf_counter() - started
+    rate = copied / elapsed if elapsed > 0 else 0.0
+    print(f"  {table:<22} {copied:>10} rows in {elapsed:7.2f}s  ({rate:,.0f} rows/s)")
+    return copied
+
+
+# --- verify ---
+def _normalize(value) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+def table_digest(rows_iter) -> tuple[int, str]:
+    """Row count and an order-independent checksum (sum of per-row MD5s mod 2**128).
+
+    Order-independent because MySQL collations may sort text keys differently from SQLite.
+    """
+    total = 0
+    count = 0
+    for rows in rows_iter:
+        for row in rows:
+            row_hash = hashlib.md5("\x1f".join(_normalize(v) for v in row).encode("utf-8")).digest()
+            total = (total + int.from_bytes(row_hash, "big")) % (1 << 128)
+            count += 1
+    return count, f"{total:032x}"
+
+
+def iter_mysql_batches(mysql_conn, table: str, columns, keys, batch: int):
+    select = f"SELECT {', '.join(columns)} FROM {table}"
+    order = f" ORDER BY {', '.join(keys)} LIMIT %s"
+    after = None
+    while True:
+        with mysql_conn.cursor(pymysql.cursors.Cursor) as cursor:
+            if after is None:
+                cursor.execute(select + order, (batch,))
+            else:
+                cursor.execute(select + _after_clause(keys, "%s") + order, (*_after_params(after), batch))
+            rows = cursor.fetchall()
+        if not rows:
+            return
+        yield rows
+        after = [rows[-1][columns.index(k)] for k in keys]
+
+
+def verify(sqlite_conn, mysql_conn, batch: int) -> bool:
+    ok = True
+    for table, keys in TABLES:
+        columns = shared_columns(sqlite_conn, mysql_conn, table)
+        src = table_digest(iter_sqlite_batches(sqlite_conn, table, columns, keys, batch))
+        dst = table_digest(iter_mysql_batches(mysql_conn, table, columns, keys, batch))
+        match = src == dst
+        ok = ok and match
+        status = "OK" if match else "MISMATCH"
+        print(f"  [{status}] {table:<22} sqlite={src[0]} ({src[1][:12]})  mysql={dst[0]} ({dst[1][:12]})")
+    mysql_conn.rollback()
+    return ok
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Bulk, resumable SQLite -> MySQL migration")
+    parser.add_argument("--sqlite", default=DB_FILE, help="source SQLite file (default: DB_FILE)")
+    parser.add_argument("--batch", type=int, default=5000, help="rows per INSERT batch")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <sqlite>.migrate.json)")
+    parser.add_argument("--restart", action="store_true", help="discard the checkpoint and copy everything again")
+    parser.add_argument("--verify-only", action="store_true", help="only compare row counts and checksums")
+    parser.add_argument("--no-verify", action="store_true", help="skip the verification pass")
+    args = parser.parse_args(argv)
+
+    checkpoint_path = args.checkpoint or args.sqlite + ".migrate.json"
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    print(f"Source SQLite: {args.sqlite}")
+    sqlite_conn = connect_sqlite(args.sqlite)
+    print(f"Target MySQL:  {MYSQL_USER}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DATABASE}")
+    mysql_conn = connect_mysql()
     try:
-        ensure_mysql_table(mysql_conn)
-        inserted, updated = upsert_bots_to_mysql(mysql_conn, bots)
-        print(f"Migration finished. Inserted: {inserted}, Updated: {updated}")
+        for name, conn, backend in (("SQLite", sqlite_conn, "sqlite"), ("MySQL", mysql_conn, "mysql")):
+            applied = database.apply_migrations(conn, backend)
+            if applied:
+                print(f"{name} schema upgraded: {applied}")
+
+        if not args.verify_only:
+            checkpoint = load_checkpoint(checkpoint_path, args.sqlite)
+            started = time.perf_counter()
+            total = 0
+            for table, keys in TABLES:
+                total += copy_table(sqlite_conn, mysql_conn, table, keys, args.batch, checkpoint, checkpoint_path)
+            elapsed = time.perf_counter() - started
+            rate = total / elapsed if elapsed > 0 else 0.0
+            print(f"Copied {total} rows in {elapsed:.2f}s ({rate:,.0f} rows/s)")
+
+        if args.no_verify:
+            return 0
+        print("Verifying row counts and checksums...")
+        if not verify(sqlite_conn, mysql_conn, args.batch):
+            print("Verification failed.")
+            return 1
+        print("Verification passed.")
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        return 0
     finally:
+        sqlite_conn.close()
         mysql_conn.close()
 
 
 if __name__ == "__main__":
     try:
-        main()
+        sys.exit(main())
     except Exception as e:
         print(f"Migration failed: {e}")
         sys.exit(1)
@@ -0,0 +1,291 @@
+"""基于数据库的 PTB 持久化
+
+`DatabasePersistence` 取代每个引导机器人一个的 `PicklePersistence` 文件：会话状态、user_data、
+chat_data、bot_data 按键存为 `bot_persistence` 表中的独立行（见 `database.get_persistence_rows` /
+`database.put_persistence_rows`），任何节点都能接管任何机器人。
+
+- 懒加载：user_data / chat_data 启动时不读取，某个用户/会话第一次产生更新时
+  （PTB 调用 `refresh_user_data` / `refresh_chat_data`）按主键读取一行；会话状态与 bot_data 启动时各一次查询
+- 增量写入：只写内容变化的键（与上次落库内容的摘要比较），同一轮 `update_persistence`
+  产生的写入合并为一个事务，经 `database.aio` 在线程池中执行
+- 迁移：数据库中还没有该机器人的数据时，自动导入旧的 PicklePersistence 文件并将其重命名为 `.imported`
+
+值使用标准 pickle 序列化，因此只适合存放普通数据（字典、数字、字符串等），不要存放 Bot 等运行时对象。
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pickle
+
+from telegram.ext import BasePersistence, PicklePersistence
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def _encode_key(key) -> str:
+    """把 PTB 的键（用户/会话 id、会话元组、bot_data 的字符串键）编码为行主键。"""
+    return json.dumps(key, ensure_ascii=False, separators=(",", ":"))
+
+
+def _decode_key(pkey: str):
+    value = json.loads(pkey)
+    return tuple(value) if isinstance(value, list) else value
+
+
+def _digest(blob: bytes) -> bytes:
+    return hashlib.blake2b(blob, digest_size=16).digest()
+
+
+def _conv_kind(name: str) -> str:
+    return f"conv:{name}"
+
+
+class DatabasePersistence(BasePersistence):
+    """把一个机器人的 PTB 持久化数据按键存入数据库。
+
+    参数:
+        bot_token: 数据所属机器人
+        legacy_file: 旧版 PicklePersistence 文件；数据库中尚无该机器人的数据时导入一次
+        bot_data_exclude: 不落库的 bot_data 键（默认 config：以 bots 表为准，启动后重新注入）
+        store_data / update_interval: 同 `BasePersistence`
+    """
+
+    def __init__(
+        self,
+        bot_token: str,
+        legacy_file: str | None = None,
+        bot_data_exclude=("config",),
+        store_data=None,
+        update_interval: float = 60,
+    ):
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.bot_token = bot_token
+        self.legacy_file = legacy_file
+        self.bot_data_exclude = frozenset(bot_data_exclude)
+        self._ready = False
+        self._ready_lock = asyncio.Lock()
+        self._loaded = {"user": set(), "chat": set()}  # 已懒加载过的用户/会话 id
+        self._digests = {}  # (kind, pkey) -> 上次落库内容的摘要；None 表示已删除
+        self._pending = {}  # (kind, pkey) -> 待写入的字节串；None 表示删除
+        self._write_task = None
+        self._unpicklable = set()  # 已告警过的无法序列化的 (kind, pkey)
+
+    # --- 读取 ---
+    async def _ensure_ready(self):
+        if self._ready:
+            return
+        async with self._ready_lock:
+            if self._ready:
+                return
+            if self.legacy_file and os.path.exists(self.legacy_file):
+                await self._import_legacy()
+            self._ready = True
+
+    async def _load_kind(self, kind: str) -> dict:
+        rows = await database.aio.get_persistence_rows(self.bot_token, kind)
+        data = {}
+        for pkey, blob in rows.items():
+            self._digests[(kind, pkey)] = _digest(blob)
+            data[_decode_key(pkey)] = pickle.loads(blob)
+        return data
+
+    async def _load_one(self, kind: str, ident) -> dict | None:
+        pkey = _encode_key(ident)
+        rows = await database.aio.get_persistence_rows(self.bot_token, kind, [pkey])
+        blob = rows.get(pkey)
+        if blob is None:
+            return None
+        self._digests[(kind, pkey)] = _digest(blob)
+        return pickle.loads(blob)
+
+    async def _refresh(self, kind: str, ident, data):
+        """某个 id 第一次被用到时读取其行，合并进 PTB 的内存字典（内存中已有的键优先）。"""
+        loaded = self._loaded[kind]
+        if ident in loaded:
+            return
+        stored = await self._load_one(kind, ident)
+        loaded.add(ident)
+        if stored:
+            for key, value in stored.items():
+                data.setdefault(key, value)
+
+    async def get_user_data(self) -> dict:
+        await self._ensure_ready()
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        await self._ensure_ready()
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        await self._ensure_ready()
+        return await self._load_kind("bot")
+
+    async def get_callback_data(self):
+        await self._ensure_ready()
+        data = await self._load_kind("callback")
+        return data.get(None)
+
+    async def get_conversations(self, name: str) -> dict:
+        await self._ensure_ready()
+        return await self._load_kind(_conv_kind(name))
+
+    async def refresh_user_data(self, user_id: int, user_data) -> None:
+        await self._refresh("user", user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        await self._refresh("chat", chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        # 每个机器人同一时间只在一个节点运行，bot_data 以内存为准
+        return
+
+    # --- 写入 ---
+    def _dumps(self, kind: str, pkey: str, value) -> bytes | None:
+        try:
+            return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            if (kind, pkey) not in self._unpicklable:
+                self._unpicklable.add((kind, pkey))
+                logger.warning(f"持久化数据无法序列化，已跳过 {kind}/{pkey}: {e}")
+            return None
+
+    def _stage(self, kind: str, pkey: str, blob: bytes | None):
+        """登记一个键的新值；与上次落库内容相同且没有待写入的旧值时跳过。"""
+        key = (kind, pkey)
+        if key not in self._pending:
+            digest = None if blob is None else _digest(blob)
+            if self._digests.get(key, _MISSING) == digest:
+                return
+        self._pending[key] = blob
+
+    async def _write_pending(self):
+        """把已登记的写入合并落库；同一轮 update_persistence 中的并发调用共享同一次写入。"""
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.ensure_future(self._drain())
+        await asyncio.shield(self._write_task)
+
+    async def _drain(self):
+        # 让出一次事件循环，使同一轮 gather 中的其余 update_* 先完成登记
+        await asyncio.sleep(0)
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            rows = [(kind, pkey, blob) for (kind, pkey), blob in batch.items()]
+            try:
+                await database.aio.put_persistence_rows(self.bot_token, rows)
+            except Exception:
+                # 失败的键放回待写入队列（期间登记的更新值优先），下一轮重试
+                for key, blob in batch.items():
+                    self._pending.setdefault(key, blob)
+                raise
+            for key, blob in batch.items():
+                self._digests[key] = None if blob is None else _digest(blob)
+
+    async def _update_mapping(self, kind: str, ident, data):
+        pkey = _encode_key(ident)
+        # 尚未懒加载就被写入（例如启动恢复时直接写 user_data）：先把库中已有内容就地合并进 PTB 的字典，
+        # 避免覆盖丢键；之后该 id 视为已加载，PTB 删除的键不会再被带回
+        await self._refresh(kind, ident, data)
+        blob = self._dumps(kind, pkey, data)
+        if blob is not None:
+            self._stage(kind, pkey, blob)
+            await self._write_pending()
+
+    async def update_user_data(self, user_id: int, data) -> None:
+        await self._update_mapping("user", user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        await self._update_mapping("chat", chat_id, data)
+
+    async def update_bot_data(self, data) -> None:
+        present = set()
+        for key, value in data.items():
+            if key in self.bot_data_exclude:
+                continue
+            pkey = _encode_key(key)
+            present.add(pkey)
+            blob = self._dumps("bot", pkey, value)
+            if blob is not None:
+                self._stage("bot", pkey, blob)
+        for kind, pkey in list(self._digests):
+            if kind == "bot" and pkey not in present and self._digests[(kind, pkey)] is not None:
+                self._stage("bot", pkey, None)
+        await self._write_pending()
+
+    async def update_callback_data(self, data) -> None:
+        pkey = _encode_key(None)
+        blob = self._dumps("callback", pkey, data)
+        if blob is not None:
+            self._stage("callback", pkey, blob)
+            await self._write_pending()
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        kind = _conv_kind(name)
+        pkey = _encode_key(key)
+        if new_state is None:
+            self._stage(kind, pkey, None)
+        else:
+            blob = self._dumps(kind, pkey, new_state)
+            if blob is None:
+                return
+            self._stage(kind, pkey, blob)
+        await self._write_pending()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._loaded["user"].add(user_id)
+        self._stage("user", _encode_key(user_id), None)
+        await self._write_pending()
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._loaded["chat"].add(chat_id)
+        self._stage("chat", _encode_key(chat_id), None)
+        await self._write_pending()
+
+    async def flush(self) -> None:
+        """关闭时写出剩余的待写入数据。"""
+        if self._pending or (self._write_task is not None and not self._write_task.done()):
+            try:
+                await self._write_pending()
+            except Exception as e:
+                logger.error(f"持久化数据落库失败，{len(self._pending)} 个键未写入: {e}")
+
+    # --- 旧文件导入 ---
+    async def _import_legacy(self):
+        """把旧版 PicklePersistence 单文件导入数据库（仅当库中尚无该机器人的数据）。"""
+        if await database.aio.has_persistence_rows(self.bot_token):
+            logger.info(f"数据库中已有持久化数据，忽略旧文件 {self.legacy_file}")
+            return
+        legacy = PicklePersistence(filepath=self.legacy_file)
+        legacy.set_bot(self.bot)
+        rows = []
+
+        def add(kind, key, value):
+            pkey = _encode_key(key)
+            blob = self._dumps(kind, pkey, value)
+            if blob is not None:
+                rows.append((kind, pkey, blob))
+
+        for user_id, data in (await legacy.get_user_data()).items():
+            add("user", user_id, data)
+        for chat_id, data in (await legacy.get_chat_data()).items():
+            add("chat", chat_id, data)
+        for key, value in (await legacy.get_bot_data()).items():
+            if key not in self.bot_data_exclude:
+                add("bot", key, value)
+        callback_data = await legacy.get_callback_data()
+        if callback_data is not None:
+            add("callback", None, callback_data)
+        for name, conversations in (legacy.conversations or {}).items():
+            for key, state in conversations.items():
+                add(_conv_kind(name), key, state)
+
+        await database.aio.put_persistence_rows(self.bot_token, rows)
+        os.replace(self.legacy_file, self.legacy_file + ".imported")
+        logger.info(f"已从 {self.legacy_file} 导入 {len(rows)} 条持久化数据")
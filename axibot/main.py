@@ -135,7 +135,7 @@ async def _send_5_min_warning(context: ContextTypes.DEFAULT_TYPE):
                 if fid:
                     try:
                         from afubot.bot import database as afu_db
-                        afu_db.update_bot_file_ids(bot_conf.get('bot_token'), sticker_file_id=fid)
+                        await afu_db.aio.update_bot_file_ids(bot_conf.get('bot_token'), sticker_file_id=fid)
                     except Exception:
                         pass
                     bot_conf['sticker_file_id'] = fid
@@ -237,7 +237,7 @@ async def _send_success_and_unlock(context: ContextTypes.DEFAULT_TYPE):
                                 context.bot_data['sticker_file_ids'] = sticker_cache
                                 try:
                                     if afu_db:
-                                        afu_db.update_bot_file_ids((context.bot_data.get('bot_config') or {}).get('bot_token'), sticker_file_id=fid)
+                                        await afu_db.aio.update_bot_file_ids((context.bot_data.get('bot_config') or {}).get('bot_token'), sticker_file_id=fid)
                                 except Exception:
                                     pass
                         except Exception:
@@ -485,6 +485,8 @@ class AxiBotManager:
         self.last_check_time = 0
         self.check_interval = 15  # 每15秒检查一次新机器人，保证更快拾取
         self.bot_status = {}  # token -> {"last_error": time, "error_count": int}
+        self.channel_bots = {}  # token -> 活跃频道机器人配置，按 bots 修订号增量维护
+        self.bots_rev = None  # 已同步到的 bots 修订号；None 表示尚未全量加载
         self._stop_event = threading.Event()
         self._monitor_thread = None
         self.shared_resources = {
@@ -687,6 +689,33 @@ class AxiBotManager:
             app.bot_data['paused'] = False
             logger.info(f"已恢复机器人 {app.bot_data.get('agent_name')}")
 
+    async def _sync_channel_bots(self):
+        """把 `channel_bots` 同步到数据库最新状态。
+
+        修订号未变时只读一行；变化时只拉取该修订号之后的新增/修改/删除，不再每次全量读取并比对。
+        """
+        if self.bots_rev is None:
+            # 全量读取须与修订号同一事务、直接读主库：走缓存或副本时读到的可能早于修订号，期间的变更会永久丢失
+            snapshot = await afu_db.aio.get_active_bots_with_revision(role='channel')
+            self.channel_bots = {bot['bot_token']: bot for bot in snapshot["bots"]}
+            self.bots_rev = snapshot["rev"]
+            return
+        rev = await afu_db.aio.get_bots_revision()
+        if rev == self.bots_rev:
+            return
+        delta = await afu_db.aio.get_bots_changed_since(self.bots_rev)
+        for gone in delta["deleted"]:
+            self.channel_bots.pop(gone["bot_token"], None)
+        for bot in delta["changed"]:
+            if bot.get("is_active") and bot.get("bot_role") == "channel":
+                self.channel_bots[bot["bot_token"]] = bot
+            else:
+                self.channel_bots.pop(bot["bot_token"], None)
+        logger.info(
+            f"bots 修订号 {self.bots_rev} -> {delta['rev']}：变更 {len(delta['changed'])}，删除 {len(delta['deleted'])}"
+        )
+        self.bots_rev = delta["rev"]
+
     async def check_new_bots(self):
         """从 afubot 数据库拉取频道机器人并做动态管理（启动/暂停/恢复/权限检查）。"""
         if afu_db is None:
@@ -696,9 +725,10 @@ class AxiBotManager:
             current_time = time.time()
             current_hour = datetime.datetime.now().hour
 
-            # 获取所有活跃的频道机器人
-            active_bots = afu_db.get_active_bots(role='channel')
-            active_tokens = set(bot['bot_token'] for bot in active_bots)
+            # 同步活跃的频道机器人（无变更时只读取修订号）
+            await self._sync_channel_bots()
+            active_bots = list(self.channel_bots.values())
+            active_tokens = set(self.channel_bots)
 
             # 停止已被删除或停用的机器人
             for token in list(self.running_bots.keys()):
@@ -755,8 +785,8 @@ class AxiBotManager:
 
         try:
             # 仅启动频道带单机器人
-            active_bots = afu_db.get_active_bots(role='channel')
-            for bot in active_bots:
+            await self._sync_channel_bots()
+            for bot in list(self.channel_bots.values()):
                 await self.start_bot(bot)
 
             if not self.running_bots:
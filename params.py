@@ -7,6 +7,17 @@ logger = logging.getLogger(__name__)
 ROOT = Path(__file__).resolve().parent
 TGS_DIR = ROOT / "tgsfile"
 
+
+async def _resolve_file_id(token: str, keys: list[str]) -> str | None:
+    """按优先顺序解析已缓存的 file_id：先查内存映射，未知键再一次性批量回源。"""
+    found = afu_db.get_cached_media_file_ids(token, keys)
+    if found is None:
+        found = await afu_db.aio.get_media_file_ids(token, keys)
+    for k in keys:
+        if found.get(k):
+            return found[k]
+    return None
+
 async def tgs_file(context: ContextTypes.DEFAULT_TYPE, name: str) -> bool:
     # 扩展：支持 .tgs/.webp/.webm；优先复用已缓存的 file_id；兼容旧 key
     try:
@@ -16,19 +27,11 @@ async def tgs_file(context: ContextTypes.DEFAULT_TYPE, name: str) -> bool:
 
         exts = [".tgs", ".webp", ".webm"]
 
-        # 1) 先尝试带后缀的缓存（更精确）
-        for ext in exts:
-            k = f"sticker:{name}{ext}"
-            fid = afu_db.get_media_file_id(token, k)
-            if fid:
-                await context.bot.send_sticker(chat_id=chat_id, sticker=fid)
-                return True
-
-        # 2) 兼容旧键（无后缀）
-        legacy_key = f"sticker:{name}"
-        legacy_fid = afu_db.get_media_file_id(token, legacy_key)
-        if legacy_fid:
-            await context.bot.send_sticker(chat_id=chat_id, sticker=legacy_fid)
+        # 1) 先尝试带后缀的缓存（更精确），2) 再兼容旧键（无后缀）；一次批量解析
+        keys = [f"sticker:{name}{ext}" for ext in exts] + [f"sticker:{name}"]
+        fid = await _resolve_file_id(token, keys)
+        if fid:
+            await context.bot.send_sticker(chat_id=chat_id, sticker=fid)
             return True
 
         # 3) 本地文件首发：按优先顺序查找存在的文件
@@ -39,7 +42,7 @@ async def tgs_file(context: ContextTypes.DEFAULT_TYPE, name: str) -> bool:
                     msg = await context.bot.send_sticker(chat_id=chat_id, sticker=f)
                 got = getattr(getattr(msg, "sticker", None), "file_id", None)
                 if got:
-                    afu_db.upsert_media_file_id(token, f"sticker:{name}{ext}", got)
+                    await afu_db.aio.upsert_media_file_id(token, f"sticker:{name}{ext}", got)
                 return True
 
         logger.warning("sticker not found for %s (tried %s)", name, exts)
@@ -61,19 +64,11 @@ async def image_file(context: ContextTypes.DEFAULT_TYPE, name: str) -> bool:
 
         exts = [".jpg", ".jpeg", ".png"]
 
-        # 1) 尝试带后缀的缓存
-        for ext in exts:
-            key = f"photo:{name}{ext}"
-            fid = afu_db.get_media_file_id(token, key)
-            if fid:
-                await context.bot.send_photo(chat_id=chat_id, photo=fid)
-                return True
-
-        # 2) 兼容旧键（无后缀）
-        legacy_key = f"photo:{name}"
-        legacy_fid = afu_db.get_media_file_id(token, legacy_key)
-        if legacy_fid:
-            await context.bot.send_photo(chat_id=chat_id, photo=legacy_fid)
+        # 1) 尝试带后缀的缓存，2) 兼容旧键（无后缀）；一次批量解析
+        keys = [f"photo:{name}{ext}" for ext in exts] + [f"photo:{name}"]
+        fid = await _resolve_file_id(token, keys)
+        if fid:
+            await context.bot.send_photo(chat_id=chat_id, photo=fid)
             return True
 
         # 3) 本地首发
@@ -89,7 +84,7 @@ async def image_file(context: ContextTypes.DEFAULT_TYPE, name: str) -> bool:
                 except Exception:
                     file_id = None
                 if file_id:
-                    afu_db.upsert_media_file_id(token, f"photo:{name}{ext}", file_id)
+                    await afu_db.aio.upsert_media_file_id(token, f"photo:{name}{ext}", file_id)
                 return True
 
         logger.warning("image not found for %s (tried %s)", name, exts)
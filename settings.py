@@ -16,6 +16,75 @@ MYSQL_USER = os.getenv('MYSQL_USER')
 MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD')
 MYSQL_DATABASE = os.getenv('MYSQL_DATABASE', 'bots')
 
+# --- MySQL read replicas ---
+# 只读副本，逗号分隔；每项为 host:port 或 user:password@host:port/db，省略的部分沿用主库配置。
+# 为空表示不做读写分离。本地可用第二个 MySQL 实例做副本，例如 MYSQL_REPLICAS=127.0.0.1:3307
+MYSQL_REPLICAS = [s.strip() for s in os.getenv('MYSQL_REPLICAS', '').split(',') if s.strip()]
+# 调用方写入后，其后续读取固定走主库的时长（秒），规避副本复制延迟
+REPLICA_PIN_SECONDS = float(os.getenv('REPLICA_PIN_SECONDS', '5'))
+
+# --- SQLite tuning ---
+# 是否对 SQLite 连接启用性能参数（WAL 等）；设为 0 时沿用 sqlite3 默认（回滚日志模式）
+SQLITE_TUNING = os.getenv('SQLITE_TUNING', '1') == '1'
+# WAL 允许读写并发；WAL 下 synchronous=NORMAL 仍保证数据库一致，仅可能丢失掉电前最后的提交
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+# 写锁等待上限（毫秒），超时才抛出 "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+# 内存映射读取的上限（字节）与页缓存（负数表示 KiB）
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv('SQLITE_CACHE_SIZE', '-65536'))
+SQLITE_TEMP_STORE = os.getenv('SQLITE_TEMP_STORE', 'MEMORY')
+
+# --- Connection pool ---
+# MySQL 连接池上限、借出等待超时（秒）、连接最长存活（秒，超时重建）
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '16'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '3600'))
+# 连接空闲超过该秒数后，借出时先 ping 一次做健康检查
+DB_POOL_PING_INTERVAL = float(os.getenv('DB_POOL_PING_INTERVAL', '1'))
+# 异步门面（database.aio）专用线程池的线程数；应小于连接池大小，为会话写后合并线程、同步调用方等留出连接
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', '10'))
+
+# --- Query instrumentation ---
+# 是否为 database 公开函数记录耗时直方图；超过 DB_SLOW_QUERY_MS 毫秒的调用记入慢查询日志
+DB_TIMING = os.getenv('DB_TIMING', '1') == '1'
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '200'))
+
+# --- Bot config cache ---
+# bots 配置读穿缓存的 TTL（秒），0 表示关闭缓存
+BOT_CACHE_TTL = float(os.getenv('BOT_CACHE_TTL', '30'))
+
+# --- Conversation write-behind ---
+# 会话写入的后台合并落库周期（秒，0 表示同步写入）与单批最大条数
+CONV_FLUSH_INTERVAL = float(os.getenv('CONV_FLUSH_INTERVAL', '0.3'))
+CONV_FLUSH_BATCH = int(os.getenv('CONV_FLUSH_BATCH', '200'))
+
+# --- Conversation retention ---
+# 超过该天数未更新的会话由后台清理；默认 0 不清理，需要时显式开启（如 CONV_RETENTION_DAYS=30）。
+# 清理会删除会话行并同步扣减引流统计（/catuser 人数随之减少）。清理周期（秒）、每批删除行数与批间停顿（秒）
+CONV_RETENTION_DAYS = float(os.getenv('CONV_RETENTION_DAYS', '0'))
+CONV_SWEEP_INTERVAL = float(os.getenv('CONV_SWEEP_INTERVAL', '3600'))
+CONV_SWEEP_CHUNK = int(os.getenv('CONV_SWEEP_CHUNK', '500'))
+CONV_SWEEP_PAUSE = float(os.getenv('CONV_SWEEP_PAUSE', '0.05'))
+
+# --- Bot persistence ---
+# 引导机器人的 PTB 持久化：database（按键存入数据库）或 pickle（旧版 persist/conv_<id>.bin 文件）；
+# 数据库持久化的落库周期（秒）
+BOT_PERSISTENCE = os.getenv('BOT_PERSISTENCE', 'database')
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv('PERSISTENCE_UPDATE_INTERVAL', '60'))
+
+# --- Fleet snapshot ---
+# 本地机队快照（活跃机器人 + 媒体 file_id）：启动时先按快照启动机器人，数据库在后台校正；留空表示关闭。
+# 快照含机器人 token，以 0600 权限写入；每 FLEET_SNAPSHOT_INTERVAL 秒检查一次变更并按需重写
+FLEET_SNAPSHOT_FILE = os.getenv('FLEET_SNAPSHOT_FILE', str(PROJECT_ROOT / 'fleet_snapshot.json'))
+FLEET_SNAPSHOT_INTERVAL = float(os.getenv('FLEET_SNAPSHOT_INTERVAL', '5'))
+
+# --- Bot startup ---
+# 批量启动私聊引导机器人的并发上限，与每个机器人启动前的随机延迟上限（秒），把对 Bot API 与数据库的请求摊开
+BOT_START_CONCURRENCY = int(os.getenv('BOT_START_CONCURRENCY', '8'))
+BOT_START_JITTER = float(os.getenv('BOT_START_JITTER', '0.5'))
+
 # --- Admin bot ---
 ADMIN_BOT_TOKEN = os.getenv('ADMIN_BOT_TOKEN')
 